@@ -0,0 +1 @@
+"""Бенчмарки бота. Каждый модуль запускается отдельно: python -m benchmarks.<имя> --help"""
@@ -0,0 +1,147 @@
+"""Генератор синтетических данных: пользователи, группы, участники, желания и резервирования.
+
+Запуск: python -m benchmarks.dataset bench.db [--size medium] [--users 100000 --wishes 1000000 ...]
+"""
+import argparse
+import itertools
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, NamedTuple
+
+import db_controller
+
+# Сколько строк вставлять за один вызов executemany
+CHUNK_SIZE = 50000
+
+
+class DatasetSize(NamedTuple):
+    """Размер синтетического набора данных (количество строк в таблицах)"""
+    users: int
+    groups: int
+    memberships: int
+    wishes: int
+    reservations: int
+
+
+SIZES = {
+    'small': DatasetSize(users=1000, groups=50, memberships=5000, wishes=10000, reservations=2000),
+    'medium': DatasetSize(users=20000, groups=1000, memberships=50000, wishes=200000, reservations=40000),
+    'large': DatasetSize(users=200000, groups=10000, memberships=500000, wishes=2000000, reservations=400000),
+}
+
+STATUSES = ('active',) * 7 + ('completed',) * 2 + ('cancelled',)
+RESERVATION_STATUSES = ('reserved',) * 6 + ('fulfilled',) * 3 + ('cancelled',)
+START_DATE = datetime(2024, 1, 1)
+
+
+def username(user_id: int) -> str:
+    """Имя пользователя в синтетических данных"""
+    return f'user{user_id}'
+
+
+def group_id(index: int) -> int:
+    """Id группы в синтетических данных (id групп Telegram отрицательные)"""
+    return -1000000 - index
+
+
+def skewed_user(rng: random.Random, users: int) -> int:
+    """Случайный пользователь: у небольшой части пользователей большая часть желаний"""
+    return int(users * rng.random() ** 3) + 1
+
+
+def _dates(rng: random.Random, count: int) -> Iterator[str]:
+    """Возрастающие даты создания в формате CURRENT_TIMESTAMP"""
+    step = timedelta(days=365) / max(count, 1)
+    date = START_DATE
+    for _ in range(count):
+        date += step * rng.random() * 2
+        yield date.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _insert(conn: sqlite3.Connection, query: str, rows: Iterator[tuple]):
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            break
+        conn.executemany(query, chunk)
+
+
+def generate(db_name: str, size: DatasetSize, seed: int = 1) -> Dict[str, float]:
+    """Создать схему в db_name и заполнить её синтетическими данными. Возвращает время по таблицам (с)"""
+    db_controller.configure(db_name=db_name)
+    db_controller.init_db()
+    db_controller.close_connections()
+
+    rng = random.Random(seed)
+    timings = {}
+    conn = sqlite3.connect(db_name, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('BEGIN')
+
+    started = time.perf_counter()
+    _insert(conn, 'INSERT INTO user (user_id, username, first_name) VALUES (?, ?, ?)',
+            ((user_id, username(user_id), f'Имя {user_id}') for user_id in range(1, size.users + 1)))
+    timings['user'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    _insert(conn, 'INSERT INTO "group" (group_id, title) VALUES (?, ?)',
+            ((group_id(index), f'Группа {index}') for index in range(size.groups)))
+    timings['group'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    members = set()
+    while len(members) < min(size.memberships, size.groups * size.users):
+        members.add((group_id(rng.randrange(size.groups)), rng.randint(1, size.users)))
+    _insert(conn, 'INSERT INTO group_member (group_id, user_id) VALUES (?, ?)', iter(sorted(members)))
+    timings['group_member'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+
+    def wishes():
+        for wish_id, create_date in enumerate(_dates(rng, size.wishes), 1):
+            user_id = skewed_user(rng, size.users)
+            # Часть желаний добавлена из групп, остальные - в личке
+            chat_id = group_id(rng.randrange(size.groups)) if size.groups and rng.random() < 0.3 else user_id
+            yield (wish_id, user_id, chat_id, f'Желание &amp; подарок №{wish_id}',
+                   f'Описание желания {wish_id}' if wish_id % 2 else None, rng.choice(STATUSES),
+                   rng.randint(1, 5), create_date, rng.choice((None, 499.0, 1990.0, 15000.0)))
+
+    _insert(conn, 'INSERT INTO wish (wish_id, user_id, chat_id, wish_text, description, status, priority, '
+                  'create_date, price) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', wishes())
+    timings['wish'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    _insert(conn, 'INSERT INTO reservation (wish_id, user_id, reserved_at, status) VALUES (?, ?, ?, ?)',
+            ((rng.randint(1, size.wishes), rng.randint(1, size.users), reserved_at,
+              rng.choice(RESERVATION_STATUSES))
+             for reserved_at in _dates(rng, size.reservations)))
+    timings['reservation'] = time.perf_counter() - started
+
+    conn.execute('COMMIT')
+    started = time.perf_counter()
+    conn.execute('ANALYZE')
+    timings['analyze'] = time.perf_counter() - started
+    conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('db_name')
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--seed', type=int, default=1)
+    for field in DatasetSize._fields:
+        parser.add_argument(f'--{field}', type=int, help=f'переопределить количество ({field})')
+    args = parser.parse_args()
+
+    size = SIZES[args.size]._replace(**{field: getattr(args, field) for field in DatasetSize._fields
+                                        if getattr(args, field) is not None})
+    timings = generate(args.db_name, size, args.seed)
+    for table, seconds in timings.items():
+        print(f'{table:14} {seconds:8.2f} с')
+
+
+if __name__ == '__main__':
+    main()
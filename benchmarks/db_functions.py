@@ -0,0 +1,231 @@
+"""Время выполнения каждой функции db_controller на синтетических данных разного размера.
+
+Результат выводится в JSON. С --baseline результат сравнивается с сохранённым ранее:
+функции, ставшие медленнее порога, печатаются как регрессии, а код выхода равен 1.
+
+Запуск: python -m benchmarks.db_functions [--sizes small medium] [--output result.json]
+        python -m benchmarks.db_functions --baseline baseline.json [--threshold 1.2]
+        python -m benchmarks.db_functions --profile  (отчёт db_profiler по формам запросов)
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import db_controller
+from benchmarks.dataset import SIZES, DatasetSize, generate, group_id, username
+
+# Функция db_controller и генератор аргументов для очередного вызова: args(rng, state) -> (args, kwargs).
+# state - общий словарь, через который изменения передают созданные id следующим функциям
+Case = Tuple[str, Callable, Callable[[random.Random, Dict[str, Any]], Tuple[tuple, dict]]]
+
+
+def build_cases(size: DatasetSize) -> List[Case]:
+    def user(rng):
+        return rng.randint(1, size.users)
+
+    def wish(rng):
+        return rng.randint(1, size.wishes)
+
+    def group(rng):
+        return group_id(rng.randrange(size.groups))
+
+    def reservation(rng):
+        return rng.randint(1, size.reservations)
+
+    def new_id(state, name, start):
+        state[name] = state.get(name, start) + 1
+        return state[name]
+
+    def created(state, name):
+        # Берём созданные ранее id с конца, чтобы каждое удаление затрагивало существующую строку
+        return state.setdefault(f'{name}_created', []).pop()
+
+    def remember(state, name, value):
+        state.setdefault(f'{name}_created', []).append(value)
+        return value
+
+    def consume(func):
+        # Потоковые функции (iter_*) замеряются вместе с чтением всех строк
+        return lambda *args, **kwargs: sum(1 for _ in func(*args, **kwargs))
+
+    dc = db_controller
+    return [
+        # Чтение
+        ('get_user', dc.get_user, lambda rng, state: ((user(rng),), {})),
+        ('user_exists', dc.user_exists, lambda rng, state: ((user(rng),), {})),
+        ('get_user_by_username', dc.get_user_by_username, lambda rng, state: ((username(user(rng)),), {})),
+        ('get_wish', dc.get_wish, lambda rng, state: ((wish(rng),), {})),
+        ('get_user_wishes', dc.get_user_wishes, lambda rng, state: ((user(rng),), {})),
+        ('get_user_wishes[active]', dc.get_user_wishes, lambda rng, state: ((user(rng), 'active'), {})),
+        ('iter_user_wishes', consume(dc.iter_user_wishes), lambda rng, state: ((user(rng),), {})),
+        ('get_user_wishes_page', dc.get_user_wishes_page, lambda rng, state: ((user(rng), 5), {})),
+        ('count_user_wishes', dc.count_user_wishes, lambda rng, state: ((user(rng),), {})),
+        ('get_chat_wishes', dc.get_chat_wishes, lambda rng, state: ((user(rng),), {})),
+        ('get_chat_wishes[group]', dc.get_chat_wishes, lambda rng, state: ((group(rng),), {})),
+        ('get_chat_wishes[active]', dc.get_chat_wishes, lambda rng, state: ((user(rng), 'active'), {})),
+        ('iter_chat_wishes[group]', consume(dc.iter_chat_wishes), lambda rng, state: ((group(rng),), {})),
+        ('get_group_wishes_page', dc.get_group_wishes_page, lambda rng, state: ((group(rng), 10), {})),
+        ('get_group_wishes_page[price]', dc.get_group_wishes_page,
+         lambda rng, state: ((group(rng), 10, 'price'), {})),
+        ('get_group', dc.get_group, lambda rng, state: ((group(rng),), {})),
+        ('group_exists', dc.group_exists, lambda rng, state: ((group(rng),), {})),
+        ('get_group_members', dc.get_group_members, lambda rng, state: ((group(rng),), {})),
+        ('get_user_groups', dc.get_user_groups, lambda rng, state: ((user(rng),), {})),
+        ('is_group_member', dc.is_group_member, lambda rng, state: ((group(rng), user(rng)), {})),
+        ('get_reservation', dc.get_reservation, lambda rng, state: ((reservation(rng),), {})),
+        ('get_wish_reservations', dc.get_wish_reservations, lambda rng, state: ((wish(rng),), {})),
+        ('iter_wish_reservations', consume(dc.iter_wish_reservations), lambda rng, state: ((wish(rng),), {})),
+        ('get_user_reservations', dc.get_user_reservations, lambda rng, state: ((user(rng),), {})),
+        ('iter_user_reservations', consume(dc.iter_user_reservations), lambda rng, state: ((user(rng),), {})),
+        ('get_active_reservation_for_wish', dc.get_active_reservation_for_wish,
+         lambda rng, state: ((wish(rng),), {})),
+        ('get_active_reservations', dc.get_active_reservations,
+         lambda rng, state: (([wish(rng) for _ in range(5)],), {})),
+        ('get_wish_summary', dc.get_wish_summary, lambda rng, state: ((user(rng),), {})),
+        ('get_wish_summary[chat]', dc.get_wish_summary, lambda rng, state: ((), {'chat_id': group(rng)})),
+        ('get_fsm_record', dc.get_fsm_record, lambda rng, state: ((f'1:{user(rng)}:{user(rng)}:::default',), {})),
+        # Изменения
+        ('add_user', dc.add_user,
+         lambda rng, state: ((new_id(state, 'user', size.users), 'bench'), {})),
+        ('update_user', dc.update_user, lambda rng, state: ((user(rng),), {'first_name': 'Новое имя'})),
+        ('add_wish', dc.add_wish, lambda rng, state: ((user(rng), user(rng), 'Новое желание'), {'priority': 4})),
+        ('update_wish', dc.update_wish, lambda rng, state: ((wish(rng),), {'priority': rng.randint(1, 5)})),
+        ('complete_wish', dc.complete_wish, lambda rng, state: ((wish(rng),), {})),
+        ('cancel_wish', dc.cancel_wish, lambda rng, state: ((wish(rng),), {})),
+        ('delete_wish', dc.delete_wish, lambda rng, state: ((wish(rng),), {})),
+        ('add_group', dc.add_group,
+         lambda rng, state: ((remember(state, 'group', -new_id(state, 'group', 0)), 'Новая группа'), {})),
+        ('update_group', dc.update_group, lambda rng, state: ((group(rng),), {'title': 'Новое название'})),
+        ('delete_group', dc.delete_group, lambda rng, state: ((created(state, 'group'),), {})),
+        ('add_group_member', dc.add_group_member,
+         lambda rng, state: ((group(rng), remember(state, 'member', new_id(state, 'member', size.users))), {})),
+        ('remove_group_member', dc.remove_group_member, lambda rng, state: ((group(rng), user(rng)), {})),
+        ('add_reservation', dc.add_reservation, lambda rng, state: ((wish(rng), user(rng)), {})),
+        ('update_reservation_status', dc.update_reservation_status,
+         lambda rng, state: ((reservation(rng), 'reserved'), {})),
+        ('cancel_reservation', dc.cancel_reservation, lambda rng, state: ((reservation(rng),), {})),
+        ('fulfill_reservation', dc.fulfill_reservation, lambda rng, state: ((reservation(rng),), {})),
+        ('delete_reservation', dc.delete_reservation, lambda rng, state: ((reservation(rng),), {})),
+        ('save_fsm_records', dc.save_fsm_records,
+         lambda rng, state: (([(f'1:{user(rng)}:{user(rng)}:::default', 'State:x', '{}', time.time())],), {})),
+        ('delete_expired_fsm_records', dc.delete_expired_fsm_records, lambda rng, state: ((0,), {})),
+    ]
+
+
+def measure(func: Callable, make_args, calls: int, rng: random.Random, state: Dict[str, Any]) -> Dict[str, float]:
+    """Вызвать func calls раз и вернуть статистику времени вызова (мкс)"""
+    samples = []
+    for _ in range(calls):
+        args, kwargs = make_args(rng, state)
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    return {
+        'calls': calls,
+        'mean_us': round(statistics.fmean(samples), 2),
+        'p50_us': round(samples[len(samples) // 2], 2),
+        'p99_us': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 2),
+    }
+
+
+def run_size(name: str, size: DatasetSize, calls: int, window: float, seed: int,
+             profile: bool = False) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        print(f'[{name}] генерация данных: {dict(size._asdict())}', file=sys.stderr)
+        generate(db_name, size, seed)
+        db_controller.configure(db_name=db_name, write_batch_window=window, profile=profile)
+        if profile:
+            db_controller.get_profiler().reset()
+        db_controller.clear_caches()
+        rng = random.Random(seed)
+        state: Dict[str, Any] = {}
+        functions = {}
+        for case_name, func, make_args in build_cases(size):
+            functions[case_name] = measure(func, make_args, calls, rng, state)
+            print(f'[{name}] {case_name:34} p50={functions[case_name]["p50_us"]:10.1f} мкс', file=sys.stderr)
+        db_controller.close_connections()
+    if profile:
+        print(f'[{name}] запросы (* - полный просмотр таблицы):', file=sys.stderr)
+        print(db_controller.get_profiler().report(), file=sys.stderr)
+    return {'rows': dict(size._asdict()), 'functions': functions}
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Сравнить p50 с базовым результатом. Возвращает описания регрессий"""
+    regressions = []
+    for size_name, size_result in result['sizes'].items():
+        base_size = baseline['sizes'].get(size_name)
+        if not base_size:
+            continue
+        for name, stats in size_result['functions'].items():
+            base = base_size['functions'].get(name)
+            if not base or not base['p50_us']:
+                continue
+            ratio = stats['p50_us'] / base['p50_us']
+            marker = ''
+            if ratio > threshold:
+                marker = '  <-- регрессия'
+                regressions.append(f'{size_name}/{name}: {base["p50_us"]} -> {stats["p50_us"]} мкс (x{ratio:.2f})')
+            print(f'{size_name:7} {name:34} {base["p50_us"]:10.1f} -> {stats["p50_us"]:10.1f} мкс  '
+                  f'x{ratio:5.2f}{marker}', file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=SIZES, default=['small', 'medium'])
+    parser.add_argument('--calls', type=int, default=500, help='вызовов каждой функции')
+    parser.add_argument('--window', type=float, default=0.0,
+                        help='окно группового коммита (по умолчанию 0: измеряется сама запись)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл для результата (по умолчанию stdout)')
+    parser.add_argument('--baseline', help='сохранённый результат для сравнения')
+    parser.add_argument('--threshold', type=float, default=1.2, help='допустимое замедление p50 (в разах)')
+    parser.add_argument('--profile', action='store_true',
+                        help='замерять запросы профилировщиком (времена функций будут выше)')
+    args = parser.parse_args()
+
+    result = {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'calls': args.calls,
+            'window': args.window,
+            'seed': args.seed,
+        },
+        'sizes': {name: run_size(name, SIZES[name], args.calls, args.window, args.seed, args.profile)
+                  for name in args.sizes},
+    }
+
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print(f'Регрессий: {len(regressions)}', file=sys.stderr)
+            for line in regressions:
+                print(f'  {line}', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Задержка обработчиков при конкурентных апдейтах: синхронный db_controller против db_async.
+
+Запуск: python -m benchmarks.handler_latency [--updates 400] [--wishes 200000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import db_controller
+import db_async
+
+
+def fill_db(wishes: int):
+    """Заполнить временную БД: один пользователь с большим списком и много пользователей без желаний"""
+    db_controller.init_db()
+    conn = db_controller.get_connection()
+    conn.executemany('INSERT INTO user (user_id, username) VALUES (?, ?)',
+                     ((user_id, f'user{user_id}') for user_id in range(1, 1001)))
+    conn.executemany('INSERT INTO wish (user_id, chat_id, wish_text, priority, price) VALUES (?, ?, ?, ?, ?)',
+                     ((random.randint(1, 1000), 1, f'wish {i}', random.randint(1, 5), 100.0)
+                      for i in range(wishes)))
+    conn.commit()
+    conn.close()
+
+
+async def handler_sync(heavy: bool):
+    """Обработчик в старом стиле: синхронный вызов прямо в корутине"""
+    if heavy:
+        db_controller.get_user_wishes(random.randint(1, 1000))
+    else:
+        db_controller.user_exists(random.randint(1, 1000))
+    # Имитация запроса к Telegram API
+    await asyncio.sleep(0.005)
+
+
+async def handler_async(heavy: bool):
+    """Обработчик, ожидающий асинхронный слой БД"""
+    if heavy:
+        await db_async.get_user_wishes(random.randint(1, 1000))
+    else:
+        await db_async.user_exists(random.randint(1, 1000))
+    await asyncio.sleep(0.005)
+
+
+async def run_load(handler, updates: int, heavy_ratio: float):
+    """Запустить updates конкурентных обработчиков и вернуть задержки лёгких запросов (мс)"""
+    latencies = []
+
+    async def timed(heavy: bool):
+        started = time.perf_counter()
+        await handler(heavy)
+        if not heavy:
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    for _ in range(updates):
+        tasks.append(asyncio.create_task(timed(random.random() < heavy_ratio)))
+        # Апдейты приходят не одновременно, а потоком
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=400)
+    parser.add_argument('--wishes', type=int, default=200000)
+    parser.add_argument('--heavy-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_controller.configure(db_name=os.path.join(tmp, 'bench.db'))
+        fill_db(args.wishes)
+
+        for name, handler in (('sync (до)', handler_sync), ('db_async (после)', handler_async)):
+            latencies = await run_load(handler, args.updates, args.heavy_ratio)
+            print(f'{name:18} p50={statistics.median(latencies):8.2f} мс  '
+                  f'p99={percentile(latencies, 0.99):8.2f} мс  n={len(latencies)}')
+
+        db_async.shutdown()
+        db_controller.close_connections()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""Строки желаний как словари (прежний dict(row)) против записей records: память и время чтения списков.
+
+Память - сколько занимают 10 000 прочитанных желаний (tracemalloc, вместе со значениями столбцов),
+время - чтение всего списка пользователя и одной страницы теми же запросами.
+
+Запуск: python -m benchmarks.records [--size small] [--db bench.db] [--number 200]
+"""
+import argparse
+import os
+import tempfile
+import timeit
+import tracemalloc
+
+import db_controller
+from benchmarks.dataset import SIZES, generate
+from records import Wish
+
+PER_PAGE = 5
+MEMORY_ROWS = 10000
+
+
+def legacy_user_wishes(user_id: int):
+    """Все желания пользователя в прежнем виде: SELECT * и словарь на каждую строку"""
+    with db_controller.get_manager().reader() as conn:
+        rows = conn.execute('SELECT * FROM wish WHERE user_id = ? ORDER BY create_date DESC', (user_id,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def legacy_user_wishes_page(user_id: int, limit: int):
+    """Первая страница желаний пользователя в прежнем виде"""
+    with db_controller.get_manager().reader() as conn:
+        rows = conn.execute('SELECT * FROM wish WHERE user_id = ? ORDER BY create_date DESC, wish_id DESC LIMIT ?',
+                            (user_id, limit)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def legacy_rows(limit: int):
+    """Первые limit желаний таблицы словарями"""
+    with db_controller.get_manager().reader() as conn:
+        rows = conn.execute('SELECT * FROM wish ORDER BY wish_id LIMIT ?', (limit,)).fetchall()
+    return [dict(row) for row in rows]
+
+
+def record_rows(limit: int):
+    """Те же строки записями, как их читает db_controller: кортежи без sqlite3.Row"""
+    columns = ', '.join('NULL' if field in Wish._field_defaults else field for field in Wish._fields)
+    with db_controller.get_manager().reader() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        return list(map(Wish._make, cursor.execute(f'SELECT {columns} FROM wish ORDER BY wish_id LIMIT ?',
+                                                   (limit,))))
+
+
+def measure_memory(load) -> int:
+    """Сколько байт остаётся занято результатом load()"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        rows = load()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(rows) == MEMORY_ROWS
+    return used
+
+
+def bench(name: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f'{name:44} {seconds / number * 1e6:10.1f} мкс')
+
+
+def run(number: int):
+    with db_controller.get_manager().reader() as conn:
+        # Пользователь с самым длинным списком (в синтетических данных списки неравномерные) и обычный
+        largest, largest_count = conn.execute(
+            'SELECT user_id, COUNT(*) AS n FROM wish GROUP BY user_id ORDER BY n DESC LIMIT 1').fetchone()
+        typical = conn.execute('SELECT MAX(user_id) / 2 FROM user').fetchone()[0]
+        typical_count = conn.execute('SELECT COUNT(*) FROM wish WHERE user_id = ?', (typical,)).fetchone()[0]
+
+    legacy_memory = measure_memory(lambda: legacy_rows(MEMORY_ROWS))
+    records_memory = measure_memory(lambda: record_rows(MEMORY_ROWS))
+    print(f'{MEMORY_ROWS} желаний: dict {legacy_memory / 1024:.0f} КиБ, записи {records_memory / 1024:.0f} КиБ '
+          f'({legacy_memory / records_memory:.2f}x, {(legacy_memory - records_memory) / MEMORY_ROWS:.0f} байт '
+          f'на желание)')
+
+    for name, user_id, count in (('большой', largest, largest_count), ('обычный', typical, typical_count)):
+        bench(f'список ({name}, {count}): dict (до)', lambda: legacy_user_wishes(user_id), max(number // 10, 1))
+        bench(f'список ({name}, {count}): записи (после)', lambda: db_controller.get_user_wishes(user_id),
+              max(number // 10, 1))
+    bench('страница: dict (до)', lambda: legacy_user_wishes_page(typical, PER_PAGE), number)
+    bench('страница: записи (после)', lambda: db_controller.get_user_wishes_page(typical, PER_PAGE), number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', choices=SIZES, default='small')
+    parser.add_argument('--db', help='готовая БД вместо синтетической')
+    parser.add_argument('--number', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.db:
+        db_controller.configure(db_name=args.db)
+        run(args.number)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, 'bench.db')
+        generate(db_name, SIZES[args.size])
+        db_controller.configure(db_name=db_name)
+        try:
+            run(args.number)
+        finally:
+            db_controller.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Время отрисовки одной страницы списка желаний: прежняя сборка через += против renderer.
+
+Запуск: python -m benchmarks.render [--number 20000]
+"""
+import argparse
+import html
+import random
+import timeit
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+import renderer
+from records import Wish
+
+PER_PAGE = 5
+
+
+def make_wishes(count: int):
+    """Страница желаний с экранированным текстом, как они хранятся в БД"""
+    random.seed(1)
+    wishes = []
+    for wish_id in range(1, count + 1):
+        wishes.append(Wish(
+            wish_id=wish_id, user_id=1, chat_id=1,
+            wish_text=html.escape(f'Настольная игра <Каркассон> & дополнение №{wish_id}', quote=False),
+            description=html.escape('Большая коробка, лучше в подарочной упаковке & с открыткой'
+                                    if wish_id % 2 else '', quote=False),
+            status='active', priority=random.randint(1, 5), create_date='2024-01-01 00:00:00',
+            complete_date=None, image_url=None, price=random.choice([None, 1490.0, 2990.5]),
+        ))
+    return wishes
+
+
+def render_legacy(wishes, page: int, total: int, title: str, prefix: str, with_delete: bool):
+    """Отрисовка в прежнем виде: конкатенация строк и новые клавиатуры на каждый вызов"""
+    start_idx = page * PER_PAGE
+    total_pages = (total + PER_PAGE - 1) // PER_PAGE
+    wishes_text = title
+    for idx, wish in enumerate(wishes, 1):
+        wish_number = start_idx + idx
+        priority_stars = '⭐' * wish.priority
+        price_text = f"₽{wish.price:.2f}" if wish.price else '—'
+        wishes_text += (
+            f"{wish_number}. <b>{wish.wish_text}</b>\n"
+            f"   🌟 {priority_stars} | 💰 {price_text} | 📅 {wish.status}\n"
+        )
+        if wish.description:
+            desc = wish.description[:40] + '...' if len(wish.description) > 40 else wish.description
+            wishes_text += f'   📝 {desc}\n'
+        wishes_text += '\n'
+    keyboard_buttons = []
+    if with_delete:
+        for idx, wish in enumerate(wishes):
+            keyboard_buttons.append([InlineKeyboardButton(text=f'🗑️ Удалить #{start_idx + idx + 1}',
+                                                          callback_data=f"wish_delete_{wish.wish_id}")])
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(text='⬅️ Назад', callback_data=f'{prefix}{page - 1}'))
+    if page < total_pages - 1:
+        nav_buttons.append(InlineKeyboardButton(text='Далее ➡️', callback_data=f'{prefix}{page + 1}'))
+    if nav_buttons:
+        keyboard_buttons.append(nav_buttons)
+    keyboard_buttons.append([InlineKeyboardButton(text='🏠 Главное меню', callback_data='main_menu')])
+    if total_pages > 1:
+        wishes_text += f'\n📄 Страница {page + 1} из {total_pages}'
+    return wishes_text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
+def legacy_main_menu():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text='🎁 Добавить желание', callback_data='add_wish_start')],
+        [InlineKeyboardButton(text='📋 Посмотреть мои желания', callback_data='show_my_wishes')]
+    ])
+
+
+def bench(name: str, func, number: int):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f'{name:34} {seconds / number * 1e6:8.2f} мкс')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=20000)
+    args = parser.parse_args()
+
+    wishes = make_wishes(PER_PAGE)
+    total, page = 40, 3
+    titles = {role: title.format(username='@user') for role, (title, *_) in renderer.ROLES.items()}
+
+    for role in ('owner', 'other'):
+        _, prefix, with_delete, _ = renderer.ROLES[role]
+        bench(f'{role}: += (до)', lambda: render_legacy(wishes, page, total, titles[role], prefix, with_delete),
+              args.number)
+        bench(f'{role}: renderer (после)',
+              lambda: renderer.render_wishes_page(role, wishes, page, total, PER_PAGE, '@user'), args.number)
+
+    bench('главное меню: новая клавиатура (до)', legacy_main_menu, args.number)
+    bench('главное меню: MAIN_MENU_KB (после)', lambda: renderer.MAIN_MENU_KB, args.number)
+
+
+if __name__ == '__main__':
+    main()
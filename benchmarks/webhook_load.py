@@ -0,0 +1,128 @@
+"""Нагрузочный тест вебхука: синтетические апдейты отправляются POST-запросами на локальный сервер.
+
+Обработчик имитирует запрос к Telegram API задержкой. Тест проверяет, что апдейты одного
+чата обрабатываются строго по порядку, и сравнивает пропускную способность при разных
+ограничениях числа одновременно обрабатываемых апдейтов.
+
+Запуск: python -m benchmarks.webhook_load [--updates 5000] [--chats 200] [--api-latency 0.02]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.strategy import FSMStrategy
+from aiogram.types import Message
+
+import webhook
+
+PATH = '/webhook'
+SECRET = 'load-test'
+
+
+def make_update(update_id: int, chat_id: int, seq: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+            'text': str(seq),
+        },
+    }
+
+
+class Stats:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.handled = 0
+        self.violations = 0
+        self.last_seq = {}
+        self.active_chats = set()
+        self.sent_at = {}
+        self.latencies = []
+        self.done = asyncio.Event()
+
+
+def build_dispatcher(stats: Stats, api_latency: float) -> Dispatcher:
+    router = Router()
+
+    @router.message()
+    async def handle(message: Message):
+        chat_id, seq = message.chat.id, int(message.text)
+        # Апдейт чата обрабатывается раньше предыдущего или параллельно с ним - нарушение порядка
+        if seq <= stats.last_seq.get(chat_id, -1) or chat_id in stats.active_chats:
+            stats.violations += 1
+        stats.last_seq[chat_id] = seq
+        stats.active_chats.add(chat_id)
+        await asyncio.sleep(api_latency)
+        stats.active_chats.discard(chat_id)
+        stats.latencies.append((time.perf_counter() - stats.sent_at[message.message_id]) * 1000)
+        stats.handled += 1
+        if stats.handled == stats.expected:
+            stats.done.set()
+
+    dp = Dispatcher(fsm_strategy=FSMStrategy.CHAT)
+    dp.include_router(router)
+    return dp
+
+
+async def run_load(updates: int, chats: int, connections: int, api_latency: float, max_in_flight: int,
+                   port: int):
+    stats = Stats(updates)
+    bot = Bot(token='123456:load-test')
+    app = webhook.create_app(build_dispatcher(stats, api_latency), bot, path=PATH, secret_token=SECRET,
+                             max_in_flight=max_in_flight)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+
+    # Апдейты уходят по возрастанию update_id через несколько соединений, как их отправляет Telegram
+    queue = asyncio.Queue()
+    for update_id in range(updates):
+        queue.put_nowait(update_id)
+    seq = {}
+    url = f'http://127.0.0.1:{port}{PATH}'
+    headers = {'X-Telegram-Bot-Api-Secret-Token': SECRET}
+
+    async def sender(session: ClientSession):
+        while not queue.empty():
+            update_id = queue.get_nowait()
+            chat_id = update_id % chats + 1
+            chat_seq = seq[chat_id] = seq.get(chat_id, -1) + 1
+            stats.sent_at[update_id] = time.perf_counter()
+            async with session.post(url, json=make_update(update_id, chat_id, chat_seq), headers=headers) as resp:
+                assert resp.status == 200, resp.status
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(sender(session) for _ in range(connections)))
+    await stats.done.wait()
+    elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    latencies = sorted(stats.latencies)
+    print(f'max_in_flight={max_in_flight:<5} {updates / elapsed:8.0f} апд/с  '
+          f'p50={statistics.median(latencies):7.1f} мс  p99={latencies[int(len(latencies) * 0.99)]:7.1f} мс  '
+          f'нарушений порядка: {stats.violations}')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=200)
+    parser.add_argument('--connections', type=int, default=40)
+    parser.add_argument('--api-latency', type=float, default=0.02)
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--in-flight', type=int, nargs='+', default=[1, 16, 256])
+    args = parser.parse_args()
+
+    for max_in_flight in args.in_flight:
+        await run_load(args.updates, args.chats, args.connections, args.api_latency, max_in_flight, args.port)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
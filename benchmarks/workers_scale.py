@@ -0,0 +1,109 @@
+"""Пропускная способность при обработке апдейтов в 1, 2, 4 и 8 процессах (workers.WorkerPool).
+
+Обработчик читает страницу желаний из БД, отрисовывает её и обновляет состояние FSM,
+запрос к Telegram API имитируется задержкой. Пропускная способность растёт с числом
+процессов, пока хватает ядер процессора.
+
+Запуск: python -m benchmarks.workers_scale [--updates 20000] [--workers 1 2 4 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.strategy import FSMStrategy
+from aiogram.types import Message
+
+import db_async
+import db_controller
+import renderer
+import workers
+
+USERS = 1000
+PER_PAGE = 5
+
+
+def fill_db(wishes: int):
+    db_controller.init_db()
+    conn = db_controller.get_connection()
+    conn.executemany('INSERT INTO user (user_id, username) VALUES (?, ?)',
+                     ((user_id, f'user{user_id}') for user_id in range(1, USERS + 1)))
+    conn.executemany('INSERT INTO wish (user_id, chat_id, wish_text, priority, price) VALUES (?, ?, ?, ?, ?)',
+                     ((random.randint(1, USERS), 1, f'wish {i}', random.randint(1, 5), 100.0)
+                      for i in range(wishes)))
+    conn.commit()
+    conn.close()
+
+
+def setup():
+    """Подготовка процесса-обработчика (выполняется в каждом процессе)"""
+    db_controller.configure(db_name=os.environ['BENCH_DB'])
+    api_latency = float(os.environ['BENCH_API_LATENCY'])
+    router = Router()
+
+    @router.message()
+    async def show_page(message: Message, state: FSMContext):
+        owner_id = int(message.text)
+        total = await db_async.count_user_wishes(owner_id)
+        wishes = await db_async.get_user_wishes_page(owner_id, PER_PAGE)
+        renderer.render_wishes_page('other', wishes, 0, total, PER_PAGE, '@user')
+        await state.update_data(wishes_owner_id=owner_id, current_page=0)
+        await asyncio.sleep(api_latency)
+
+    dp = Dispatcher(fsm_strategy=FSMStrategy.CHAT)
+    dp.include_router(router)
+    return dp, Bot(token='123456:bench')
+
+
+def make_update(update_id: int, chat_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'user'},
+            'text': str(random.randint(1, USERS)),
+        },
+    }
+
+
+async def run_load(count: int, updates: int, chats: int):
+    pool = workers.WorkerPool(count, setup=setup)
+    await pool.start()
+    batch = [make_update(update_id, update_id % chats + 1) for update_id in range(updates)]
+    started = time.perf_counter()
+    for data in batch:
+        await pool.route(data)
+    # close дожидается обработки всех переданных апдейтов
+    await pool.close()
+    elapsed = time.perf_counter() - started
+    print(f'процессов: {count}  {updates / elapsed:8.0f} апд/с')
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--wishes', type=int, default=50000)
+    parser.add_argument('--api-latency', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['BENCH_DB'] = os.path.join(tmp, 'bench.db')
+        os.environ['BENCH_API_LATENCY'] = str(args.api_latency)
+        db_controller.configure(db_name=os.environ['BENCH_DB'])
+        fill_db(args.wishes)
+        db_controller.close_connections()
+        print(f'ядер процессора: {os.cpu_count()}')
+        for count in args.workers:
+            await run_load(count, args.updates, args.chats)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+"""Пропускная способность записи: коммит на каждое изменение против группового коммита.
+
+Запуск: python -m benchmarks.write_throughput [--writes 5000] [--synchronous FULL]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import db_controller
+import db_async
+
+
+async def burst(writes: int) -> float:
+    """Одновременно добавить writes желаний и вернуть количество записей в секунду"""
+    started = time.perf_counter()
+    results = await asyncio.gather(*(
+        db_async.add_wish(user_id=i % 100, chat_id=-1, wish_text=f'wish {i}', priority=3)
+        for i in range(writes)
+    ))
+    elapsed = time.perf_counter() - started
+    assert all(results), 'часть изменений не выполнена'
+    return writes / elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writes', type=int, default=5000)
+    parser.add_argument('--window', type=float, default=0.002)
+    parser.add_argument('--synchronous', default='FULL')
+    args = parser.parse_args()
+
+    modes = (
+        ('коммит на изменение', dict(write_batch_window=0, write_batch_max=1)),
+        ('групповой коммит', dict(write_batch_window=args.window, write_batch_max=256)),
+    )
+    for name, settings in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_controller.configure(db_name=os.path.join(tmp, 'bench.db'),
+                                    synchronous=args.synchronous, **settings)
+            db_controller.init_db()
+            rate = await burst(args.writes)
+            print(f'{name:22} {rate:10.0f} записей/с')
+            db_controller.close_connections()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
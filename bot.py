@@ -1,17 +1,265 @@
+import time
+
+# Начало запуска процесса: от него считается время импорта (см. Startup)
+STARTED = time.perf_counter()
+
 import asyncio
+import functools
+import logging
+from typing import Dict, Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.strategy import FSMStrategy
 
 import config
-import handlers
+import db_controller
 
+# Остальные модули импортируются там, где нужны: обработчики - только в процессе, который обрабатывает
+# апдейты, обслуживание БД и метрики - только если включены
 
-async def main():
-    dp = Dispatcher(fsm_strategy=FSMStrategy.CHAT)
-    bot = Bot(token=config.TOKEN)
-    await bot.set_my_commands(commands=[{"command": "start", "description": "Start the bot"}])
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """Длительность этапов запуска (с) для лога и метрик"""
+
+    def __init__(self, started: float):
+        self.stages: Dict[str, float] = {}
+        self._started = started
+        self._last = started
+
+    def done(self, stage: str):
+        """Завершён этап stage (начался после предыдущего)"""
+        now = time.perf_counter()
+        self.stages[stage] = now - self._last
+        self._last = now
+
+    def add(self, stage: str, seconds: float):
+        """Добавить этап, идущий в фоне"""
+        self.stages[stage] = seconds
+
+    def report(self) -> str:
+        """Общее время и этапы для лога"""
+        stages = ', '.join(f'{stage} {seconds:.3f}' for stage, seconds in self.stages.items())
+        return f'{self._last - self._started:.3f} с ({stages})'
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Этапы для метрик"""
+        return {stage: {'seconds': seconds} for stage, seconds in self.stages.items()}
+
+
+def configure_db():
+    """Настроить соединения с БД из config"""
+    db_controller.configure(
+        db_name=config.DB_NAME,
+        readers=config.DB_READERS,
+        mmap_size=config.DB_MMAP_SIZE,
+        cache_size=config.DB_CACHE_SIZE,
+        synchronous=config.DB_SYNCHRONOUS,
+        busy_timeout=config.DB_BUSY_TIMEOUT,
+        write_batch_window=config.DB_WRITE_BATCH_WINDOW,
+        write_batch_max=config.DB_WRITE_BATCH_MAX,
+        profile=config.DB_PROFILE,
+        slow_query_threshold=config.DB_SLOW_QUERY_MS / 1000
+    )
+
+
+def _statement_stats():
+    """Показатели профилировщика запросов для метрик"""
+    return {row['statement']: {'calls': row['calls'], 'seconds': row['seconds'], 'slow': row['slow']}
+            for row in db_controller.get_profiler().stats()}
+
+
+def add_db_collectors():
+    """Добавить в метрики кэши поиска и профилировщик запросов этого процесса"""
+    import metrics
+    metrics.add_collector('cache', db_controller.cache_stats, label='cache')
+    if db_controller.get_profiler() is not None:
+        metrics.add_collector('db_statement', _statement_stats, label='statement')
+
+
+def create_dispatcher() -> Dispatcher:
+    """Создать диспетчер с хранилищем состояний FSM и обработчиками"""
+    import handlers
+    from fsm_storage import SQLiteStorage
+    storage = SQLiteStorage(
+        max_size=config.FSM_CACHE_SIZE,
+        idle_ttl=config.FSM_IDLE_TTL,
+        flush_interval=config.FSM_FLUSH_INTERVAL,
+        expire_after=config.FSM_EXPIRE_AFTER
+    )
+    # owner_id передаётся обработчикам (команды, доступные только владельцу бота)
+    dp = Dispatcher(storage=storage, fsm_strategy=FSMStrategy.CHAT, owner_id=config.OWNER_ID)
+    if config.METRICS:
+        import metrics
+        metrics.setup(handlers.router)
+        add_db_collectors()
     dp.include_router(handlers.router)
-    await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    return dp
+
+
+def create_bot(processes: int = 1) -> Bot:
+    """Создать бота. Сообщения отправляются через планировщик с лимитами Telegram.
+
+    processes - сколько процессов отправляют сообщения: общий лимит делится между ними.
+    """
+    from send_scheduler import SendScheduler
+    bot = Bot(token=config.TOKEN)
+    scheduler = SendScheduler(
+        rate=config.SEND_RATE / processes,
+        burst=max(config.SEND_RATE / processes, 1),
+        chat_rate=config.SEND_CHAT_RATE,
+        chat_burst=config.SEND_CHAT_BURST,
+        group_rate=config.SEND_GROUP_RATE,
+        group_burst=config.SEND_GROUP_BURST
+    )
+    if config.METRICS:
+        # Замер подключается до планировщика, чтобы учитывать и ожидание в его очереди
+        import metrics
+        bot.session.middleware(metrics.ApiTimer())
+        metrics.add_collector('send', scheduler.stats)
+    bot.session.middleware(scheduler)
+    return bot
+
+
+def create_maintenance() -> 'db_maintenance.MaintenanceScheduler':
+    """Создать планировщик обслуживания БД из config. Задачи выполняются в этом порядке:
+    контрольная точка идёт после vacuum, чтобы сразу уменьшить файл
+    """
+    import db_maintenance
+    scheduler = db_maintenance.MaintenanceScheduler(
+        idle_window=config.MAINTENANCE_IDLE_WINDOW,
+        max_rate=config.MAINTENANCE_MAX_RATE,
+        max_in_flight=config.MAINTENANCE_MAX_IN_FLIGHT,
+        max_run=config.MAINTENANCE_MAX_RUN
+    )
+    if config.ARCHIVE_AFTER_DAYS:
+        scheduler.add('archive', config.ARCHIVE_INTERVAL, functools.partial(
+            db_maintenance.archive, older_than_days=config.ARCHIVE_AFTER_DAYS,
+            batch_size=config.ARCHIVE_BATCH_SIZE, pause=config.ARCHIVE_BATCH_PAUSE
+        ))
+    scheduler.add('analyze', config.MAINTENANCE_ANALYZE_INTERVAL, db_maintenance.analyze)
+    scheduler.add('fts_merge', config.MAINTENANCE_FTS_MERGE_INTERVAL, db_maintenance.fts_merge)
+    scheduler.add('vacuum', config.MAINTENANCE_VACUUM_INTERVAL, db_maintenance.vacuum)
+    scheduler.add('checkpoint', config.MAINTENANCE_CHECKPOINT_INTERVAL, db_maintenance.checkpoint)
+    if config.METRICS:
+        import metrics
+        metrics.add_collector('maintenance', scheduler.stats, label='task')
+    return scheduler
+
+
+async def set_commands(bot: Bot, startup: Startup):
+    """Зарегистрировать команды бота (заодно открывает соединение с API до первого ответа)"""
+    started = time.perf_counter()
+    try:
+        await bot.set_my_commands(commands=[{"command": "start", "description": "Start the bot"}])
+    except Exception:
+        logger.exception('Не удалось зарегистрировать команды бота')
+        return
+    startup.add('commands', time.perf_counter() - started)
+
+
+async def warm_up(dp: Optional[Dispatcher], startup: Startup):
+    """Прогреть кэши в фоне (см. warmup). Кэши обработчиков - только если апдейты обрабатывает этот процесс
+    (dp не None)
+    """
+    import warmup
+    per_page = 0
+    if dp is not None:
+        import handlers
+        per_page = handlers.WISHES_PER_PAGE
+    started = time.perf_counter()
+    try:
+        stats = await warmup.warm_up(config.WARMUP_MAX_BYTES, config.WARMUP_RECENT, per_page,
+                                     storage=dp.storage if dp is not None else None)
+    except Exception:
+        logger.exception('Ошибка прогрева кэшей')
+        return
+    seconds = time.perf_counter() - started
+    startup.add('warm_up', seconds)
+    logger.info('Прогрев за %.3f с: %s', seconds,
+                ', '.join(f'{name} {value:.3f}' if isinstance(value, float) else f'{name} {value}'
+                          for name, value in stats.items()))
+
+
+async def main():
+    startup = Startup(STARTED)
+    startup.done('import')
+    configure_db()
+    # Схема проверяется и при необходимости обновляется один раз, в главном процессе
+    db_controller.init_db()
+    startup.done('schema')
+    dp = None
+    if config.WORKERS:
+        # Апдейты обрабатывают процессы-обработчики: диспетчер и обработчики здесь не нужны
+        if config.METRICS:
+            add_db_collectors()
+    else:
+        dp = create_dispatcher()
+        startup.done('dispatcher')
+    bot = create_bot()
+    startup.done('bot')
+    metrics_runner = None
+    if config.METRICS or config.METRICS_PORT:
+        import metrics
+        if config.METRICS:
+            metrics.add_collector('startup', startup.stats, label='stage')
+        if config.METRICS_PORT:
+            metrics_runner = await metrics.start_server(config.METRICS_HOST, config.METRICS_PORT)
+    maintenance = None
+    if config.MAINTENANCE:
+        maintenance = create_maintenance()
+        maintenance.start()
+    startup.done('services')
+    # Регистрация команд и прогрев не задерживают приём апдейтов
+    background = [asyncio.create_task(set_commands(bot, startup))]
+    if config.WARMUP:
+        background.append(asyncio.create_task(warm_up(dp, startup)))
+    logger.info('Бот запущен за %s', startup.report())
+    try:
+        # Модули режимов работы импортируются только в своём режиме
+        if config.WORKERS:
+            import workers
+            # Апдейты принимает этот процесс, а обрабатывают процессы-обработчики
+            # (типы апдейтов для Telegram сообщают они же)
+            await workers.run(
+                bot, config.WORKERS,
+                max_in_flight=config.WORKER_MAX_IN_FLIGHT,
+                webhook_url=config.WEBHOOK_URL if config.BOT_MODE == 'webhook' else None,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret_token=config.WEBHOOK_SECRET,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+                metrics_host=config.METRICS_HOST,
+                metrics_port=config.METRICS_PORT + 1 if config.METRICS_PORT else None,
+                maintenance=maintenance
+            )
+        elif config.BOT_MODE == 'webhook':
+            import webhook
+            await webhook.run_webhook(
+                dp, bot,
+                base_url=config.WEBHOOK_URL,
+                path=config.WEBHOOK_PATH,
+                host=config.WEBHOOK_HOST,
+                port=config.WEBHOOK_PORT,
+                secret_token=config.WEBHOOK_SECRET,
+                max_in_flight=config.WEBHOOK_MAX_IN_FLIGHT,
+                max_connections=config.WEBHOOK_MAX_CONNECTIONS
+            )
+        else:
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+    finally:
+        for task in background:
+            task.cancel()
+        if maintenance is not None:
+            await maintenance.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Дождаться запросов в пуле потоков БД, прежде чем закрывать соединения
+        import db_async
+        db_async.shutdown()
+        db_controller.close_connections()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+# Признак отсутствия записи в кэше (None - допустимое закэшированное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """Потокобезопасный LRU-кэш ограниченного размера со временем жизни записей.
+
+    Значение None кэшируется как отрицательный результат (например, "пользователь
+    не найден") со своим, обычно более коротким, временем жизни negative_ttl.
+
+    index(value) - необязательный вторичный ключ значения: по нему записи удаляются
+    invalidate_indexed без перебора кэша (например, username -> пользователь по user_id).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300, negative_ttl: float = 30,
+                 index: Optional[Callable[[Any], Hashable]] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._index_of = index
+        self._index: Dict[Hashable, Set[Hashable]] = {}
+        # Увеличивается при каждой инвалидации: get_or_load не сохраняет значение,
+        # загруженное до инвалидации (оно могло устареть, пока шла загрузка)
+        self._generation = 0
+
+    def _remove(self, key: Hashable):
+        """Удалить запись вместе с её вторичным ключом (под блокировкой)"""
+        value, _ = self._data.pop(key)
+        if self._index_of is not None and value is not None:
+            index_key = self._index_of(value)
+            keys = self._index.get(index_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[index_key]
+
+    def _store(self, key: Hashable, value: Any):
+        """Сохранить значение (под блокировкой)"""
+        ttl = self.negative_ttl if value is None else self.ttl
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, time.monotonic() + ttl)
+        if self._index_of is not None and value is not None:
+            self._index.setdefault(self._index_of(value), set()).add(key)
+        while len(self._data) > self.max_size:
+            self._remove(next(iter(self._data)))
+
+    def get(self, key: Hashable) -> Any:
+        """Получить значение или MISSING, если записи нет или она устарела"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return MISSING
+
+    def set(self, key: Hashable, value: Any):
+        """Сохранить значение"""
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """Получить значение из кэша, а при промахе - загрузить через loader и сохранить.
+        Если во время загрузки кэш инвалидировали, значение возвращается, но не сохраняется
+        """
+        generation = self._generation
+        value = self.get(key)
+        if value is MISSING:
+            value = loader()
+            with self._lock:
+                if self._generation == generation:
+                    self._store(key, value)
+        return value
+
+    def invalidate(self, key: Hashable):
+        """Удалить запись"""
+        with self._lock:
+            self._generation += 1
+            if key in self._data:
+                self._remove(key)
+
+    def invalidate_indexed(self, index_key: Hashable):
+        """Удалить все записи со вторичным ключом index_key"""
+        with self._lock:
+            self._generation += 1
+            for key in list(self._index.get(index_key, ())):
+                self._remove(key)
+
+    def invalidate_where(self, predicate: Callable[[Hashable, Any], bool]):
+        """Удалить все записи, для которых predicate(key, value) истинно"""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key, (value, _) in self._data.items() if predicate(key, value)]:
+                self._remove(key)
+
+    def clear(self):
+        """Очистить кэш"""
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+            self._index.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов"""
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
@@ -8,4 +8,90 @@ load_dotenv()
 TOKEN = os.getenv('TELEGRAM_TOKEN')
 
 if not TOKEN:
-    raise ValueError('TELEGRAM_TOKEN не найден. Проверьте .env файл')
\ No newline at end of file
+    raise ValueError('TELEGRAM_TOKEN не найден. Проверьте .env файл')
+
+# Telegram id владельца бота: ему доступны служебные команды (/export). Не задан - команды недоступны
+OWNER_ID = int(os.getenv('OWNER_ID')) if os.getenv('OWNER_ID') else None
+
+# Настройки базы данных
+DB_NAME = os.getenv('DB_NAME', 'wishlist.db')
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))
+DB_CACHE_SIZE = int(os.getenv('DB_CACHE_SIZE', '-16000'))
+DB_SYNCHRONOUS = os.getenv('DB_SYNCHRONOUS', 'NORMAL')
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', '5000'))
+DB_WRITE_BATCH_WINDOW = float(os.getenv('DB_WRITE_BATCH_WINDOW', '0.002'))
+DB_WRITE_BATCH_MAX = int(os.getenv('DB_WRITE_BATCH_MAX', '256'))
+# Профилирование запросов: статистика по формам запросов и журнал медленных запросов с планами
+DB_PROFILE = os.getenv('DB_PROFILE', '0') == '1'
+DB_SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+
+# Хранилище состояний FSM
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '10000'))
+FSM_IDLE_TTL = float(os.getenv('FSM_IDLE_TTL', '1800'))
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1.0'))
+FSM_EXPIRE_AFTER = float(os.getenv('FSM_EXPIRE_AFTER', str(30 * 24 * 3600)))
+
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Вебхук: публичный адрес бота (например https://bot.example.com) и локальный сервер
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+# Максимум одновременно обрабатываемых апдейтов и соединений Telegram к вебхуку (1-100)
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv('WEBHOOK_MAX_IN_FLIGHT', '256'))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+    raise ValueError('WEBHOOK_URL не задан. Он обязателен при BOT_MODE=webhook')
+
+# Процессы-обработчики: 0 - обрабатывать апдейты в этом процессе, N - в N процессах,
+# между которыми апдейты распределяются по чату. Ограничение одновременной обработки - на процесс
+WORKERS = int(os.getenv('WORKERS', '0'))
+WORKER_MAX_IN_FLIGHT = int(os.getenv('WORKER_MAX_IN_FLIGHT', '256'))
+
+# Планировщик исходящих сообщений: общий лимит (сообщений/с) и лимиты на чат
+SEND_RATE = float(os.getenv('SEND_RATE', '30'))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+SEND_CHAT_BURST = float(os.getenv('SEND_CHAT_BURST', '3'))
+SEND_GROUP_RATE = float(os.getenv('SEND_GROUP_RATE', str(20 / 60)))
+SEND_GROUP_BURST = float(os.getenv('SEND_GROUP_BURST', '3'))
+
+# Метрики обработчиков (METRICS=0 - отключить замеры). METRICS_PORT > 0 - отдавать их в формате Prometheus
+# на http://METRICS_HOST:METRICS_PORT/metrics (процессы-обработчики - на следующих портах)
+METRICS = os.getenv('METRICS', '1') == '1'
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Архив: завершённые и отменённые желания старше ARCHIVE_AFTER_DAYS дней переносятся в архивные таблицы
+# раз в ARCHIVE_INTERVAL секунд (задача обслуживания БД, см. ниже) батчами по ARCHIVE_BATCH_SIZE
+# с паузой ARCHIVE_BATCH_PAUSE (с). ARCHIVE_AFTER_DAYS=0 - не переносить
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '100'))
+ARCHIVE_BATCH_PAUSE = float(os.getenv('ARCHIVE_BATCH_PAUSE', '0.1'))
+
+
+# Обслуживание БД (см. db_maintenance), MAINTENANCE=0 - отключить. Задачи запускаются раз в свой интервал (с,
+# 0 - не запускать), когда за последние MAINTENANCE_IDLE_WINDOW секунд было не больше MAINTENANCE_MAX_RATE
+# обращений к БД в секунду и выполняется не больше MAINTENANCE_MAX_IN_FLIGHT запросов.
+# Один запуск - не дольше MAINTENANCE_MAX_RUN секунд, остаток доделывается в следующий простой
+MAINTENANCE = os.getenv('MAINTENANCE', '1') == '1'
+MAINTENANCE_IDLE_WINDOW = float(os.getenv('MAINTENANCE_IDLE_WINDOW', '5'))
+MAINTENANCE_MAX_RATE = float(os.getenv('MAINTENANCE_MAX_RATE', '2'))
+MAINTENANCE_MAX_IN_FLIGHT = int(os.getenv('MAINTENANCE_MAX_IN_FLIGHT', '1'))
+MAINTENANCE_MAX_RUN = float(os.getenv('MAINTENANCE_MAX_RUN', '30'))
+MAINTENANCE_ANALYZE_INTERVAL = float(os.getenv('MAINTENANCE_ANALYZE_INTERVAL', str(6 * 3600)))
+MAINTENANCE_FTS_MERGE_INTERVAL = float(os.getenv('MAINTENANCE_FTS_MERGE_INTERVAL', '3600'))
+MAINTENANCE_VACUUM_INTERVAL = float(os.getenv('MAINTENANCE_VACUUM_INTERVAL', '3600'))
+MAINTENANCE_CHECKPOINT_INTERVAL = float(os.getenv('MAINTENANCE_CHECKPOINT_INTERVAL', '600'))
+
+# Прогрев после запуска (в фоне, см. warmup), WARMUP=0 - отключить: файл БД читается в кэш ОС
+# (не больше WARMUP_MAX_BYTES байт), для WARMUP_RECENT недавно активных чатов загружаются состояния FSM,
+# пользователи и первые страницы просматриваемых списков желаний
+WARMUP = os.getenv('WARMUP', '1') == '1'
+WARMUP_MAX_BYTES = int(os.getenv('WARMUP_MAX_BYTES', str(DB_MMAP_SIZE)))
+WARMUP_RECENT = int(os.getenv('WARMUP_RECENT', '1000'))
@@ -0,0 +1,192 @@
+import asyncio
+import functools
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple
+
+import db_controller
+import metrics
+
+# Максимальное количество потоков, одновременно работающих с БД
+DB_WORKERS = 4
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+
+# Долгие выгрузки (/export) идут в отдельных потоках: они не занимают пул DB_WORKERS
+# и не считаются обращениями к БД в activity
+BULK_WORKERS = 1
+
+_bulk_executor = ThreadPoolExecutor(max_workers=BULK_WORKERS, thread_name_prefix='db-bulk')
+
+# Обращения к БД с запуска процесса и выполняющиеся сейчас (см. activity)
+_calls = 0
+_in_flight = 0
+
+
+def activity() -> Tuple[int, int]:
+    """Количество обращений к БД с запуска процесса и выполняющихся сейчас (обслуживание БД ждёт простоя)"""
+    return _calls, _in_flight
+
+
+async def run(func, *args, **kwargs):
+    """Выполнить синхронную функцию работы с БД в пуле потоков, не блокируя event loop"""
+    global _calls, _in_flight
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    _calls += 1
+    _in_flight += 1
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    finally:
+        _in_flight -= 1
+        metrics.add_db_time(time.perf_counter() - started)
+
+
+async def run_bulk(func, *args, **kwargs):
+    """Выполнить долгую синхронную операцию (выгрузку таблицы) в отдельном потоке, не занимая пул"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bulk_executor, functools.partial(func, *args, **kwargs))
+
+
+def _wrap(func):
+    """Сделать awaitable-версию функции из db_controller"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+def _wrap_mutation(func):
+    """Сделать awaitable-версию изменения из db_controller.
+
+    Изменение ставится прямо в очередь группового коммита, не занимая поток пула.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _calls, _in_flight
+        started = time.perf_counter()
+        _calls += 1
+        _in_flight += 1
+        try:
+            return await asyncio.wrap_future(func.submit(*args, **kwargs))
+        except func.errors:
+            return func.default
+        finally:
+            _in_flight -= 1
+            metrics.add_db_time(time.perf_counter() - started)
+    return wrapper
+
+
+def _take(rows: Iterator, count: int) -> List:
+    return list(itertools.islice(rows, count))
+
+
+def _wrap_iterator(func):
+    """Сделать асинхронный итератор из потоковой функции db_controller (iter_*).
+
+    Каждая порция из chunk_size строк читается отдельным обращением к пулу потоков, между порциями
+    поток свободен. Соединение закрывается, когда итератор дочитан или закрыт (aclose(),
+    contextlib.aclosing): выход из async for без этого закрывает его только при сборке мусора.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        chunk_size = kwargs.get('chunk_size', db_controller.STREAM_CHUNK_SIZE)
+        rows = func(*args, **kwargs)
+        fetch = None
+        try:
+            while True:
+                # Порция читается в задаче: при отмене итератора поток дочитывает её до конца,
+                # и генератор закрывается только после этого (его нельзя закрыть, пока он выполняется)
+                fetch = asyncio.ensure_future(run(_take, rows, chunk_size))
+                chunk = await asyncio.shield(fetch)
+                if not chunk:
+                    return
+                for row in chunk:
+                    yield row
+        finally:
+            if fetch is not None and not fetch.done():
+                await asyncio.wait([fetch])
+            rows.close()
+    return wrapper
+
+
+def shutdown():
+    """Дождаться завершения запросов и остановить пулы потоков"""
+    _executor.shutdown(wait=True)
+    _bulk_executor.shutdown(wait=True)
+
+
+init_db = _wrap(db_controller.init_db)
+
+# ============== USER функции ==============
+add_user = _wrap_mutation(db_controller.add_user)
+get_user = _wrap(db_controller.get_user)
+get_user_by_username = _wrap(db_controller.get_user_by_username)
+user_exists = _wrap(db_controller.user_exists)
+update_user = _wrap_mutation(db_controller.update_user)
+
+# ============== WISH функции ==============
+add_wish = _wrap_mutation(db_controller.add_wish)
+get_wish = _wrap(db_controller.get_wish)
+get_user_wishes = _wrap(db_controller.get_user_wishes)
+iter_user_wishes = _wrap_iterator(db_controller.iter_user_wishes)
+get_user_wishes_page = _wrap(db_controller.get_user_wishes_page)
+count_user_wishes = _wrap(db_controller.count_user_wishes)
+get_chat_wishes = _wrap(db_controller.get_chat_wishes)
+iter_chat_wishes = _wrap_iterator(db_controller.iter_chat_wishes)
+get_group_wishes_page = _wrap(db_controller.get_group_wishes_page)
+search_wishes = _wrap(db_controller.search_wishes)
+update_wish = _wrap_mutation(db_controller.update_wish)
+complete_wish = _wrap_mutation(db_controller.complete_wish)
+cancel_wish = _wrap_mutation(db_controller.cancel_wish)
+delete_wish = _wrap_mutation(db_controller.delete_wish)
+
+# ============== GROUP функции ==============
+add_group = _wrap_mutation(db_controller.add_group)
+get_group = _wrap(db_controller.get_group)
+group_exists = _wrap(db_controller.group_exists)
+update_group = _wrap_mutation(db_controller.update_group)
+delete_group = _wrap_mutation(db_controller.delete_group)
+
+# ============== GROUP_MEMBER функции ==============
+add_group_member = _wrap_mutation(db_controller.add_group_member)
+remove_group_member = _wrap_mutation(db_controller.remove_group_member)
+get_group_members = _wrap(db_controller.get_group_members)
+get_user_groups = _wrap(db_controller.get_user_groups)
+is_group_member = _wrap(db_controller.is_group_member)
+
+# ============== RESERVATION функции ==============
+add_reservation = _wrap_mutation(db_controller.add_reservation)
+get_reservation = _wrap(db_controller.get_reservation)
+get_wish_reservations = _wrap(db_controller.get_wish_reservations)
+iter_wish_reservations = _wrap_iterator(db_controller.iter_wish_reservations)
+get_user_reservations = _wrap(db_controller.get_user_reservations)
+iter_user_reservations = _wrap_iterator(db_controller.iter_user_reservations)
+get_active_reservation_for_wish = _wrap(db_controller.get_active_reservation_for_wish)
+get_active_reservations = _wrap(db_controller.get_active_reservations)
+update_reservation_status = _wrap_mutation(db_controller.update_reservation_status)
+delete_reservation = _wrap_mutation(db_controller.delete_reservation)
+
+
+async def cancel_reservation(reservation_id: int) -> bool:
+    """Отменить резервирование"""
+    return await update_reservation_status(reservation_id, 'cancelled')
+
+
+async def fulfill_reservation(reservation_id: int) -> bool:
+    """Отметить резервирование как выполненное"""
+    return await update_reservation_status(reservation_id, 'fulfilled')
+
+
+# ============== Счётчики желаний ==============
+get_wish_summary = _wrap(db_controller.get_wish_summary)
+check_wish_summary = _wrap(db_controller.check_wish_summary)
+rebuild_wish_summary = _wrap_mutation(db_controller.rebuild_wish_summary)
+
+
+# ============== FSM функции ==============
+get_fsm_record = _wrap(db_controller.get_fsm_record)
+save_fsm_records = _wrap_mutation(db_controller.save_fsm_records)
+delete_expired_fsm_records = _wrap_mutation(db_controller.delete_expired_fsm_records)
+get_recent_fsm_records = _wrap(db_controller.get_recent_fsm_records)
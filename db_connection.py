@@ -0,0 +1,110 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+from db_profiler import Profiler, ProfilingConnection
+
+
+class ConnectionManager:
+    """Долгоживущие соединения с БД: одно соединение-писатель и пул соединений-читателей.
+
+    БД переводится в режим WAL, поэтому читатели не ждут окончания записи.
+    Все записи идут через единственного писателя под блокировкой.
+    Если передан profiler, запросы всех соединений замеряются им (см. db_profiler).
+    """
+
+    def __init__(self, db_name: str, readers: int = 4, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -16000, synchronous: str = 'NORMAL', busy_timeout: int = 5000,
+                 profiler: Optional[Profiler] = None):
+        self.db_name = db_name
+        self.profiler = profiler
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.synchronous = synchronous
+        self.busy_timeout = busy_timeout
+
+        # Писатель создаётся первым: он создаёт файл БД и включает WAL.
+        # Новая БД создаётся с auto_vacuum=INCREMENTAL (свободные страницы возвращает db_maintenance),
+        # у существующей настройка меняется только полным VACUUM
+        self._writer = self._connect(readonly=False)
+        self._writer.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._writer.execute('PRAGMA journal_mode = WAL')
+        self._writer_lock = threading.Lock()
+
+        self._readers = queue.LifoQueue()
+        for _ in range(readers):
+            self._readers.put(self._connect(readonly=True))
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        """Открыть соединение и применить настройки PRAGMA"""
+        factory = ProfilingConnection if self.profiler is not None else sqlite3.Connection
+        if readonly:
+            uri = Path(self.db_name).absolute().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=self.busy_timeout / 1000,
+                                   check_same_thread=False, isolation_level=None, factory=factory)
+        else:
+            conn = sqlite3.connect(self.db_name, timeout=self.busy_timeout / 1000,
+                                   check_same_thread=False, isolation_level=None, factory=factory)
+        if self.profiler is not None:
+            conn.profiler = self.profiler
+        conn.row_factory = sqlite3.Row
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA mmap_size = {int(self.mmap_size)}')
+        conn.execute(f'PRAGMA cache_size = {int(self.cache_size)}')
+        if not readonly:
+            conn.execute(f'PRAGMA synchronous = {self.synchronous}')
+        return conn
+
+    @contextmanager
+    def reader(self):
+        """Взять соединение-читатель из пула на время блока with"""
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def open_reader(self) -> sqlite3.Connection:
+        """Открыть отдельное соединение-читатель с настройками пула (долгие чтения не занимают пул).
+        Соединение закрывает вызывающий
+        """
+        return self._connect(readonly=True)
+
+    @contextmanager
+    def writer(self):
+        """Открыть транзакцию на соединении-писателе.
+
+        При выходе из блока транзакция фиксируется, при исключении - откатывается.
+        """
+        with self._writer_lock:
+            conn = self._writer
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                try:
+                    conn.execute('COMMIT')
+                except BaseException:
+                    # Неудачный COMMIT (например, отложенный внешний ключ) оставляет транзакцию открытой
+                    if conn.in_transaction:
+                        conn.execute('ROLLBACK')
+                    raise
+
+    @contextmanager
+    def writer_connection(self):
+        """Получить соединение-писатель без открытия транзакции (миграции, обслуживание БД)"""
+        with self._writer_lock:
+            yield self._writer
+
+    def close(self):
+        """Закрыть все соединения"""
+        with self._writer_lock:
+            self._writer.close()
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
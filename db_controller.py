@@ -1,560 +1,1014 @@
+import functools
+import itertools
+import logging
+import re
 import sqlite3
-from datetime import datetime
-from typing import Optional, List, Tuple, Dict, Any
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from operator import attrgetter
+from typing import Optional, List, Tuple, Dict, Any, Callable, Iterable, Iterator, Mapping
+
+import db_migrations
+from cache import TTLCache
+from db_connection import ConnectionManager
+from db_profiler import Profiler
+from db_write_queue import WriteQueue, after_commit
+from records import Group, Reservation, User, Wish
+
+logger = logging.getLogger(__name__)
 
 DB_NAME = 'wishlist.db'
 
+# Настройки долгоживущих соединений (см. db_connection.ConnectionManager)
+DB_READERS = 4
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_SIZE = -16000  # отрицательное значение - размер в КиБ (~16 МБ на соединение)
+DB_SYNCHRONOUS = 'NORMAL'
+DB_BUSY_TIMEOUT = 5000  # мс
+
+# Групповой коммит: сколько ждать попутных изменений и сколько их максимум в одной транзакции
+WRITE_BATCH_WINDOW = 0.002  # с
+WRITE_BATCH_MAX = 256
+
+# Профилирование запросов (см. db_profiler): выключено по умолчанию; порог медленного запроса (с)
+DB_PROFILE = False
+DB_SLOW_QUERY_THRESHOLD = 0.1
+
+# Полнотекстовый поиск: слова запроса ищутся по первым SEARCH_TERM_LENGTH символам (так находятся
+# разные формы слова) - столько же, сколько самый длинный префиксный индекс wish_fts
+SEARCH_TERM_LENGTH = 6
+SEARCH_MAX_TERMS = 8
+# Слова запроса - как у токенизатора unicode61: буквы и цифры
+_SEARCH_TERM = re.compile(r'[^\W_]+')
+
+# Сортировки списка желаний группы: выражение ключа и направление. Желания без цены - в конце
+GROUP_WISH_SORTS = {
+    'priority': ('w.priority', 'DESC'),
+    'price': ('IFNULL(w.price, 1e308)', 'ASC'),
+}
+
+# Статусы, количество желаний в которых хранится в wish_summary, и допустимое расхождение суммы цен
+# при проверке (сумма накапливается триггерами в REAL)
+SUMMARY_STATUSES = ('active', 'completed', 'cancelled')
+SUMMARY_PRICE_TOLERANCE = 0.01
+
+# Сколько желаний переносить в архив за одну транзакцию:
+# пока идёт батч, остальные изменения ждут в очереди группового коммита
+ARCHIVE_BATCH_SIZE = 100
+
+# Сколько wish_id подставлять в один запрос get_active_reservations (ограничение на число параметров)
+RESERVATION_LOOKUP_CHUNK = 500
+
+# Сколько строк читать из БД за раз в потоковых iter_* функциях (в db_async - за одно обращение к пулу)
+STREAM_CHUNK_SIZE = 1000
+
+# Кэш поиска пользователей и групп: размер, время жизни записи и отрицательного результата (с)
+LOOKUP_CACHE_SIZE = 50000
+LOOKUP_CACHE_TTL = 300
+LOOKUP_NEGATIVE_TTL = 30
+
+_user_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_NEGATIVE_TTL)
+# Вторичный ключ - user_id: пользователь удаляется из кэша по username без перебора всех записей
+_username_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_NEGATIVE_TTL, index=attrgetter('user_id'))
+_group_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_NEGATIVE_TTL)
+_membership_cache = TTLCache(LOOKUP_CACHE_SIZE, LOOKUP_CACHE_TTL, LOOKUP_NEGATIVE_TTL)
+
+# Версии списков желаний по пользователям: при каждом изменении списка пользователь получает
+# следующее значение общего счётчика, по ним проверяется актуальность закэшированных страниц.
+# Хранятся версии последних WISH_LIST_VERSIONS_SIZE изменённых списков; у остальных версия равна
+# наибольшей вытесненной - она не меньше любой их прежней версии, поэтому устаревшая страница
+# не совпадёт с ней по версии
+WISH_LIST_VERSIONS_SIZE = 50000
+_wish_list_versions: 'OrderedDict[int, int]' = OrderedDict()
+_wish_list_versions_floor = 0
+_wish_list_version_counter = itertools.count(1)
+_wish_list_versions_lock = threading.Lock()
+
+# Слушатели инвалидаций кэшей этого процесса: listener(kind, args). Через них инвалидации
+# рассылаются другим процессам-обработчикам, работающим с той же БД (см. workers)
+_invalidation_listeners: List[Callable[[str, tuple], None]] = []
+
+_manager: Optional[ConnectionManager] = None
+_profiler: Optional[Profiler] = None
+_write_queue: Optional[WriteQueue] = None
+_manager_lock = threading.Lock()
+
 
 def get_connection():
-    """Получить соединение с БД"""
+    """Получить отдельное соединение с БД (для разовых операций)"""
     conn = sqlite3.connect(DB_NAME)
     conn.row_factory = sqlite3.Row
     return conn
 
 
-def init_db():
-    """Инициализировать БД и создать таблицы"""
-    conn = get_connection()
+def configure(db_name: Optional[str] = None, readers: Optional[int] = None,
+              mmap_size: Optional[int] = None, cache_size: Optional[int] = None,
+              synchronous: Optional[str] = None, busy_timeout: Optional[int] = None,
+              write_batch_window: Optional[float] = None, write_batch_max: Optional[int] = None,
+              profile: Optional[bool] = None, slow_query_threshold: Optional[float] = None):
+    """Изменить настройки соединений. Открытые соединения закрываются и пересоздаются при следующем запросе"""
+    global DB_NAME, DB_READERS, DB_MMAP_SIZE, DB_CACHE_SIZE, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT
+    global WRITE_BATCH_WINDOW, WRITE_BATCH_MAX, DB_PROFILE, DB_SLOW_QUERY_THRESHOLD, _profiler
+    if db_name is not None:
+        DB_NAME = db_name
+    if readers is not None:
+        DB_READERS = readers
+    if mmap_size is not None:
+        DB_MMAP_SIZE = mmap_size
+    if cache_size is not None:
+        DB_CACHE_SIZE = cache_size
+    if synchronous is not None:
+        DB_SYNCHRONOUS = synchronous
+    if busy_timeout is not None:
+        DB_BUSY_TIMEOUT = busy_timeout
+    if write_batch_window is not None:
+        WRITE_BATCH_WINDOW = write_batch_window
+    if write_batch_max is not None:
+        WRITE_BATCH_MAX = write_batch_max
+    if profile is not None:
+        DB_PROFILE = profile
+    if slow_query_threshold is not None:
+        DB_SLOW_QUERY_THRESHOLD = slow_query_threshold
+    if DB_PROFILE:
+        # Статистика профилировщика сохраняется при переподключении
+        if _profiler is None:
+            _profiler = Profiler(DB_SLOW_QUERY_THRESHOLD)
+        _profiler.slow_threshold = DB_SLOW_QUERY_THRESHOLD
+    close_connections()
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Профилировщик запросов или None, если профилирование выключено"""
+    return _profiler if DB_PROFILE else None
+
+
+def get_manager() -> ConnectionManager:
+    """Получить менеджер соединений (создаётся при первом обращении)"""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ConnectionManager(
+                    DB_NAME, readers=DB_READERS, mmap_size=DB_MMAP_SIZE, cache_size=DB_CACHE_SIZE,
+                    synchronous=DB_SYNCHRONOUS, busy_timeout=DB_BUSY_TIMEOUT, profiler=get_profiler()
+                )
+    return _manager
+
+
+def get_write_queue() -> WriteQueue:
+    """Получить очередь группового коммита (создаётся при первом обращении)"""
+    global _write_queue
+    if _write_queue is None:
+        manager = get_manager()
+        with _manager_lock:
+            if _write_queue is None:
+                _write_queue = WriteQueue(manager, window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_MAX)
+    return _write_queue
+
+
+def close_connections():
+    """Дописать очередь изменений и закрыть все долгоживущие соединения"""
+    global _manager, _write_queue
+    with _manager_lock:
+        if _write_queue is not None:
+            _write_queue.close()
+            _write_queue = None
+        if _manager is not None:
+            _manager.close()
+            _manager = None
+
+
+def _reader():
+    """Соединение-читатель из пула (используется в блоке with)"""
+    return get_manager().reader()
+
+
+def _select_list(record, prefix: str = '', **expressions: str) -> str:
+    """Столбцы SELECT в порядке полей записи record (см. records): столбцы таблицы с префиксом prefix,
+    необязательные поля - выражения из expressions, остальные необязательные - NULL
+    """
+    return ', '.join(expressions.get(field) or ('NULL' if field in record._field_defaults else prefix + field)
+                     for field in record._fields)
+
+
+def _fetch(conn, record, query: str, params=()) -> list:
+    """Строки запроса как записи record. Запрос выбирает столбцы в порядке полей (см. _select_list)"""
     cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица групп
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS "group" (
-            group_id INTEGER PRIMARY KEY,
-            title TEXT NOT NULL,
-            description TEXT
-        )
-    ''')
-    
-    # Таблица членов группы
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS group_member (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            group_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            FOREIGN KEY (group_id) REFERENCES "group"(group_id),
-            FOREIGN KEY (user_id) REFERENCES user(user_id),
-            UNIQUE(group_id, user_id)
-        )
-    ''')
-    
-    # Таблица желаний
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS wish (
-            wish_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            chat_id INTEGER NOT NULL,
-            wish_text TEXT NOT NULL,
-            description TEXT,
-            status TEXT DEFAULT 'active',
-            priority INTEGER DEFAULT 3,
-            create_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            complete_date TIMESTAMP,
-            image_url TEXT,
-            price REAL,
-            FOREIGN KEY (user_id) REFERENCES user(user_id)
-        )
-    ''')
-    
-    # Таблица резервирований
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS reservation (
-            reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            wish_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            reserved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'reserved',
-            FOREIGN KEY (wish_id) REFERENCES wish(wish_id),
-            FOREIGN KEY (user_id) REFERENCES user(user_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    # Строки - обычные кортежи без промежуточного sqlite3.Row. Через fetchall, а не перебором
+    # курсора: чтение строк тоже учитывается профилировщиком (db_profiler.ProfilingCursor)
+    cursor.row_factory = None
+    return list(map(record._make, cursor.execute(query, params).fetchall()))
 
 
-# ============== USER функции ==============
+def _fetch_one(conn, record, query: str, params=()):
+    """Первая строка запроса как запись record или None"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    row = cursor.execute(query, params).fetchone()
+    return record._make(row) if row else None
 
-def add_user(user_id: int, username: Optional[str] = None, 
-             first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
-    """Добавить нового пользователя"""
+
+def _stream(make: Callable[[tuple], Any], query: str, params, chunk_size: int) -> Iterator:
+    """Строки запроса, преобразованные make, порциями по chunk_size строк (fetchmany).
+
+    Запрос идёт на отдельном соединении, а не из пула: оно открывается при чтении первой строки
+    и закрывается, когда строки кончились или итератор закрыт (close(), contextlib.closing).
+    Пока итератор не дочитан, открыта транзакция чтения и контрольная точка не может очистить WAL,
+    поэтому брошенные итераторы лучше закрывать явно. Новое соединение заново разбирает схему
+    (~1 мс), поэтому небольшие списки дешевле читать функциями get_*.
+    """
+    conn = get_manager().open_reader()
     try:
-        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user (user_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
+        cursor.row_factory = None
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from map(make, rows)
+    finally:
         conn.close()
-        return False
 
 
-def get_user(user_id: int) -> Optional[Dict[str, Any]]:
-    """Получить информацию о пользователе"""
-    conn = get_connection()
+# Записи строк таблиц, которые читаются вместе с архивом ({table}_archive)
+_TABLE_RECORDS = {
+    'wish': Wish,
+    'reservation': Reservation,
+}
+
+
+def _table_query(table: str, where: str, params: tuple, order: str,
+                 include_archive: bool = False) -> Tuple[Any, str, tuple]:
+    """Запрос строк таблицы из _TABLE_RECORDS с условием where в порядке order: (запись, запрос, параметры).
+
+    include_archive=True - вместе со строками архива: у них archived_at - время переноса, у горячих - None.
+    """
+    record = _TABLE_RECORDS[table]
+    query = f'SELECT {_select_list(record)} FROM {table} WHERE {where}'
+    if include_archive:
+        query += (f' UNION ALL SELECT {_select_list(record, archived_at="archived_at")} '
+                  f'FROM {table}_archive WHERE {where}')
+        params = params * 2
+    return record, f'{query} ORDER BY {order}', params
+
+
+_USER_COLUMNS = _select_list(User)
+_GROUP_COLUMNS = _select_list(Group)
+_WISH_COLUMNS = _select_list(Wish)
+_RESERVATION_COLUMNS = _select_list(Reservation)
+
+
+def _mutation(default, errors=Exception):
+    """Декоратор изменения БД.
+
+    Функция принимает соединение-писатель первым аргументом и выполняется через
+    очередь группового коммита; вызывающий передаёт только остальные аргументы.
+    Если выполнение завершилось исключением из errors, возвращается default.
+    Метод submit() ставит изменение в очередь и возвращает Future без ожидания.
+    """
+    def decorator(statement):
+        def submit(*args, **kwargs) -> Future:
+            return get_write_queue().submit(statement, *args, **kwargs)
+
+        @functools.wraps(statement)
+        def wrapper(*args, **kwargs):
+            try:
+                return submit(*args, **kwargs).result()
+            except errors:
+                return default
+
+        wrapper.submit = submit
+        wrapper.default = default
+        wrapper.errors = errors
+        return wrapper
+    return decorator
+
+
+def cache_stats() -> Dict[str, Dict[str, int]]:
+    """Счётчики попаданий и промахов кэшей поиска"""
+    return {
+        'user': _user_cache.stats(),
+        'username': _username_cache.stats(),
+        'group': _group_cache.stats(),
+        'membership': _membership_cache.stats(),
+    }
+
+
+def clear_caches():
+    """Сбросить кэши поиска (например, после изменения БД в обход db_controller)"""
+    for cache in (_user_cache, _username_cache, _group_cache, _membership_cache):
+        cache.clear()
+
+
+def _forget_user(user_id: int, username: Optional[str] = None):
+    """Удалить пользователя из кэшей поиска"""
+    _user_cache.invalidate(user_id)
+    _username_cache.invalidate_indexed(user_id)
+    if username:
+        _username_cache.invalidate(username)
+
+
+def get_wish_list_version(user_id: int) -> int:
+    """Текущая версия списка желаний пользователя"""
+    with _wish_list_versions_lock:
+        return _wish_list_versions.get(user_id, _wish_list_versions_floor)
+
+
+def _bump_wish_list_version(user_id: int):
+    global _wish_list_versions_floor
+    with _wish_list_versions_lock:
+        _wish_list_versions[user_id] = next(_wish_list_version_counter)
+        _wish_list_versions.move_to_end(user_id)
+        while len(_wish_list_versions) > WISH_LIST_VERSIONS_SIZE:
+            _, version = _wish_list_versions.popitem(last=False)
+            _wish_list_versions_floor = max(_wish_list_versions_floor, version)
+
+
+def _wish_list_changed(conn, wish_id: int):
+    """Отметить, что после коммита изменится список владельца желания wish_id"""
+    row = conn.execute('SELECT user_id FROM wish WHERE wish_id = ?', (wish_id,)).fetchone()
+    if row:
+        after_commit(lambda: _invalidate('wish_list', row[0]))
+
+
+def _reservation_changed(conn, reservation_id: int):
+    """Отметить, что после коммита изменится отметка о резервировании в списке владельца желания"""
+    row = conn.execute('SELECT wish_id FROM reservation WHERE reservation_id = ?', (reservation_id,)).fetchone()
+    if row:
+        _wish_list_changed(conn, row[0])
+
+
+_INVALIDATORS = {
+    'user': _forget_user,
+    'group': lambda group_id: _group_cache.invalidate(group_id),
+    'membership': lambda group_id, user_id: _membership_cache.invalidate((group_id, user_id)),
+    'wish_list': _bump_wish_list_version,
+}
+
+
+def add_invalidation_listener(listener: Callable[[str, tuple], None]):
+    """Подписаться на инвалидации кэшей, выполняемые этим процессом после коммита"""
+    _invalidation_listeners.append(listener)
+
+
+def apply_invalidation(kind: str, args: tuple):
+    """Применить инвалидацию, полученную от другого процесса, не рассылая её дальше"""
+    _INVALIDATORS[kind](*args)
+
+
+def _invalidate(kind: str, *args):
+    """Инвалидировать кэши этого процесса и сообщить об этом слушателям"""
+    _INVALIDATORS[kind](*args)
+    for listener in _invalidation_listeners:
+        try:
+            listener(kind, args)
+        except Exception:
+            logger.exception('Ошибка в слушателе инвалидаций')
+
+
+def hot_queries() -> Dict[str, Tuple[str, Any]]:
+    """Горячие запросы с примерными параметрами: {имя: (запрос, параметры)}.
+
+    Запросы собираются теми же функциями, что и при работе бота, поэтому их планы проверяются
+    (init_db, tests/test_query_plans.py) для того же SQL, который выполняется на самом деле.
+    """
+    def without_record(built):
+        return built[1:]
+
+    return {
+        'get_user_by_username': (_USER_BY_USERNAME, ('name',)),
+        'get_user_wishes': without_record(_user_wishes_query(1, None, False)),
+        'get_user_wishes_status': without_record(_user_wishes_query(1, 'active', False)),
+        'get_user_wishes_page': _user_wishes_page_query(1, 5, None, False, False, None),
+        'get_user_wishes_page_next': _user_wishes_page_query(1, 5, ('', 0), False, False, None),
+        'get_user_wishes_page_back': _user_wishes_page_query(1, 5, ('', 0), True, False, None),
+        'get_chat_wishes': without_record(_chat_wishes_query(1, None, False)),
+        'get_chat_wishes_status': without_record(_chat_wishes_query(1, 'active', False)),
+        'get_user_reservations': without_record(_user_reservations_query(1, None, False)),
+        'get_user_reservations_status': without_record(_user_reservations_query(1, 'reserved', False)),
+        'get_active_reservation_for_wish': (_ACTIVE_RESERVATION_FOR_WISH, (1, 'reserved')),
+        'get_active_reservations': (_active_reservations_query(3), (1, 2, 3, 'reserved')),
+        'get_user_groups': (_USER_GROUPS, (1,)),
+        'archive_wishes': (_ARCHIVE_CANDIDATES, ('', ARCHIVE_BATCH_SIZE)),
+    }
+
+
+def init_db() -> int:
+    """Инициализировать БД: применить недостающие миграции схемы. Возвращает версию схемы"""
+    with get_manager().writer_connection() as conn:
+        version = db_migrations.migrate(conn)
+        scans = db_migrations.find_table_scans(conn, hot_queries())
+    for name, plan in scans.items():
+        logger.warning('Запрос %s выполняется без индекса: %s', name, '; '.join(plan))
+    return version
+
+
+# Файл БД читается при прогреве блоками этого размера (байт)
+PREFETCH_CHUNK = 1024 * 1024
+
+
+def prefetch_file(max_bytes: int) -> int:
+    """Прочитать файлы БД и WAL (не больше max_bytes байт), чтобы их страницы оказались в кэше ОС.
+
+    На холодном кэше после перезапуска первые запросы ждут диск, а чтение файла подряд занимает доли
+    секунды и прогревает страницы для всех соединений. Возвращает количество прочитанных байт.
+    """
+    db_name = get_manager().db_name
+    buffer = bytearray(PREFETCH_CHUNK)
+    total = 0
+    for path in (db_name, db_name + '-wal'):
+        try:
+            with open(path, 'rb', buffering=0) as file:
+                while total < max_bytes:
+                    read = file.readinto(buffer)
+                    if not read:
+                        break
+                    total += read
+        except FileNotFoundError:
+            continue
+    return total
+
+
+# ============== USER функции ==============
+
+@_mutation(False, errors=sqlite3.IntegrityError)
+def add_user(conn, user_id: int, username: Optional[str] = None, 
+                   first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+    """Добавить нового пользователя"""
     cursor = conn.cursor()
-    cursor.execute('SELECT * FROM user WHERE user_id = ?', (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    cursor.execute('''
+        INSERT INTO user (user_id, username, first_name, last_name)
+        VALUES (?, ?, ?, ?)
+    ''', (user_id, username, first_name, last_name))
+    after_commit(lambda: _invalidate('user', user_id, username))
+    return True
+
+
+def _load_user(user_id: int) -> Optional[User]:
+    with _reader() as conn:
+        return _fetch_one(conn, User, f'SELECT {_USER_COLUMNS} FROM user WHERE user_id = ?', (user_id,))
 
 
-def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
+_USER_BY_USERNAME = f'SELECT {_USER_COLUMNS} FROM user WHERE username = ?'
+
+
+def get_user(user_id: int) -> Optional[User]:
+    """Получить информацию о пользователе (через кэш)"""
+    # Записи неизменяемы, поэтому отдаются из кэша без копирования
+    return _user_cache.get_or_load(user_id, lambda: _load_user(user_id))
+
+
+def get_user_by_username(username: str) -> Optional[User]:
     """Получить информацию о пользователе по username"""
     # Убираем @ если присутствует
     if username.startswith('@'):
         username = username[1:]
     
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM user WHERE username = ?', (username,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    def load():
+        with _reader() as conn:
+            return _fetch_one(conn, User, _USER_BY_USERNAME, (username,))
+
+    # Отсутствующий username тоже кэшируется (на LOOKUP_NEGATIVE_TTL)
+    return _username_cache.get_or_load(username, load)
 
 
 def user_exists(user_id: int) -> bool:
-    """Проверить, существует ли пользователь"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM user WHERE user_id = ?', (user_id,))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
+    """Проверить, существует ли пользователь (через кэш)"""
+    return _user_cache.get_or_load(user_id, lambda: _load_user(user_id)) is not None
 
 
-def update_user(user_id: int, username: Optional[str] = None,
-                first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+@_mutation(False)
+def update_user(conn, user_id: int, username: Optional[str] = None,
+                      first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
     """Обновить информацию о пользователе"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if username is not None:
-            updates.append('username = ?')
-            params.append(username)
-        if first_name is not None:
-            updates.append('first_name = ?')
-            params.append(first_name)
-        if last_name is not None:
-            updates.append('last_name = ?')
-            params.append(last_name)
-        
-        if not updates:
-            conn.close()
-            return False
-        
-        params.append(user_id)
-        query = f'UPDATE user SET {", ".join(updates)} WHERE user_id = ?'
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
+    updates = []
+    params = []
+    
+    if username is not None:
+        updates.append('username = ?')
+        params.append(username)
+    if first_name is not None:
+        updates.append('first_name = ?')
+        params.append(first_name)
+    if last_name is not None:
+        updates.append('last_name = ?')
+        params.append(last_name)
+    
+    if not updates:
         return False
+    
+    params.append(user_id)
+    query = f'UPDATE user SET {", ".join(updates)} WHERE user_id = ?'
+    conn.execute(query, params)
+    after_commit(lambda: _invalidate('user', user_id, username))
+    return True
 
 
 # ============== WISH функции ==============
 
-def add_wish(user_id: int, chat_id: int, wish_text: str, 
-             description: Optional[str] = None, priority: int = 3,
-             image_url: Optional[str] = None, price: Optional[float] = None) -> Optional[int]:
+@_mutation(None)
+def add_wish(conn, user_id: int, chat_id: int, wish_text: str, 
+                   description: Optional[str] = None, priority: int = 3,
+                   image_url: Optional[str] = None, price: Optional[float] = None) -> Optional[int]:
     """Добавить новое желание. Возвращает ID желания"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO wish (user_id, chat_id, wish_text, description, priority, image_url, price)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, chat_id, wish_text, description, priority, image_url, price))
-        wish_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return wish_id
-    except Exception:
-        conn.close()
-        return None
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO wish (user_id, chat_id, wish_text, description, priority, image_url, price)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, chat_id, wish_text, description, priority, image_url, price))
+    wish_id = cursor.lastrowid
+    after_commit(lambda: _invalidate('wish_list', user_id))
+    return wish_id
 
 
-def get_wish(wish_id: int) -> Optional[Dict[str, Any]]:
-    """Получить информацию о желании"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM wish WHERE wish_id = ?', (wish_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+def get_wish(wish_id: int, include_archive: bool = False) -> Optional[Wish]:
+    """Получить информацию о желании. include_archive=True - искать и в архиве (с archived_at)"""
+    with _reader() as conn:
+        wish = _fetch_one(conn, Wish, f'SELECT {_WISH_COLUMNS} FROM wish WHERE wish_id = ?', (wish_id,))
+        if wish is None and include_archive:
+            wish = _fetch_one(conn, Wish, f'SELECT {_select_list(Wish, archived_at="archived_at")} '
+                                          f'FROM wish_archive WHERE wish_id = ?', (wish_id,))
+    return wish
 
 
-def get_user_wishes(user_id: int, status: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Получить все желания пользователя. Если status задан, то только с этим статусом"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status:
-        cursor.execute('SELECT * FROM wish WHERE user_id = ? AND status = ? ORDER BY create_date DESC', 
-                      (user_id, status))
-    else:
-        cursor.execute('SELECT * FROM wish WHERE user_id = ? ORDER BY create_date DESC', (user_id,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def _user_wishes_query(user_id: int, status: Optional[str], include_archive: bool):
+    where, params = ('user_id = ? AND status = ?', (user_id, status)) if status else ('user_id = ?', (user_id,))
+    return _table_query('wish', where, params, 'create_date DESC', include_archive)
 
 
-def get_chat_wishes(chat_id: int, status: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Получить все желания в чате"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status:
-        cursor.execute('SELECT * FROM wish WHERE chat_id = ? AND status = ? ORDER BY priority DESC, create_date DESC',
-                      (chat_id, status))
-    else:
-        cursor.execute('SELECT * FROM wish WHERE chat_id = ? ORDER BY priority DESC, create_date DESC', (chat_id,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_user_wishes(user_id: int, status: Optional[str] = None,
+                    include_archive: bool = False) -> List[Wish]:
+    """Получить все желания пользователя. Если status задан, то только с этим статусом.
+
+    include_archive=True - вместе с перенесёнными в архив (см. _table_query).
+    """
+    with _reader() as conn:
+        return _fetch(conn, *_user_wishes_query(user_id, status, include_archive))
+
+
+def iter_user_wishes(user_id: int, status: Optional[str] = None, include_archive: bool = False, *,
+                     chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Wish]:
+    """Желания пользователя, как get_user_wishes, но потоком: по chunk_size строк (см. _stream)"""
+    record, query, params = _user_wishes_query(user_id, status, include_archive)
+    return _stream(record._make, query, params, chunk_size)
 
 
-def update_wish(wish_id: int, wish_text: Optional[str] = None,
-                description: Optional[str] = None, status: Optional[str] = None,
-                priority: Optional[int] = None, price: Optional[float] = None) -> bool:
+def _user_wishes_page_query(user_id: int, limit: int, cursor: Optional[Tuple[str, int]],
+                            backward: bool, inclusive: bool, status: Optional[str]) -> Tuple[str, List[Any]]:
+    conditions = ['user_id = ?']
+    params: List[Any] = [user_id]
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if cursor:
+        op = '>' if backward else '<'
+        if inclusive:
+            op += '='
+        conditions.append(f'(create_date, wish_id) {op} (?, ?)')
+        params.extend(cursor)
+    order = 'ASC' if backward else 'DESC'
+    params.append(limit)
+    query = (f'SELECT {_WISH_COLUMNS} FROM wish WHERE {" AND ".join(conditions)} '
+             f'ORDER BY create_date {order}, wish_id {order} LIMIT ?')
+    return query, params
+
+
+def get_user_wishes_page(user_id: int, limit: int, cursor: Optional[Tuple[str, int]] = None,
+                         backward: bool = False, inclusive: bool = False,
+                         status: Optional[str] = None) -> List[Wish]:
+    """Получить страницу желаний пользователя (новые сначала) по ключу (create_date, wish_id).
+
+    cursor - ключ желания, после которого начинается страница (без cursor - первая страница).
+    backward=True - вернуть страницу перед cursor (для перехода назад).
+    inclusive=True - включить в страницу само желание с ключом cursor.
+    """
+    with _reader() as conn:
+        wishes = _fetch(conn, Wish, *_user_wishes_page_query(user_id, limit, cursor, backward, inclusive, status))
+    if backward:
+        wishes.reverse()
+    return wishes
+
+
+def count_user_wishes(user_id: int, status: Optional[str] = None, include_archive: bool = False) -> int:
+    """Получить количество желаний пользователя (для основных статусов - из wish_summary, без подсчёта).
+
+    include_archive=True - вместе с перенесёнными в архив.
+    """
+    if status is None or status in SUMMARY_STATUSES:
+        count = get_wish_summary(user_id=user_id)[status or 'total']
+    else:
+        with _reader() as conn:
+            count = conn.execute('SELECT COUNT(*) FROM wish WHERE user_id = ? AND status = ?',
+                                 (user_id, status)).fetchone()[0]
+    if include_archive:
+        with _reader() as conn:
+            if status:
+                row = conn.execute('SELECT COUNT(*) FROM wish_archive WHERE user_id = ? AND status = ?',
+                                   (user_id, status)).fetchone()
+            else:
+                row = conn.execute('SELECT COUNT(*) FROM wish_archive WHERE user_id = ?', (user_id,)).fetchone()
+        count += row[0]
+    return count
+
+
+def _chat_wishes_query(chat_id: int, status: Optional[str], include_archive: bool):
+    where, params = ('chat_id = ? AND status = ?', (chat_id, status)) if status else ('chat_id = ?', (chat_id,))
+    return _table_query('wish', where, params, 'priority DESC, create_date DESC', include_archive)
+
+
+def get_chat_wishes(chat_id: int, status: Optional[str] = None,
+                    include_archive: bool = False) -> List[Wish]:
+    """Получить все желания в чате. include_archive=True - вместе с перенесёнными в архив"""
+    with _reader() as conn:
+        return _fetch(conn, *_chat_wishes_query(chat_id, status, include_archive))
+
+
+def iter_chat_wishes(chat_id: int, status: Optional[str] = None, include_archive: bool = False, *,
+                     chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Wish]:
+    """Желания в чате, как get_chat_wishes, но потоком: по chunk_size строк (см. _stream)"""
+    record, query, params = _chat_wishes_query(chat_id, status, include_archive)
+    return _stream(record._make, query, params, chunk_size)
+
+
+def get_group_wishes_page(group_id: int, limit: int, sort: str = 'priority',
+                          cursor: Optional[Tuple[Any, int]] = None, backward: bool = False) -> List[Wish]:
+    """Получить страницу активных желаний участников группы одним запросом по group_member, wish и user.
+
+    sort - ключ из GROUP_WISH_SORTS, страницы - по ключу (значение сортировки, wish_id):
+    cursor - ключ желания, после которого начинается страница (без cursor - первая страница),
+    backward=True - вернуть страницу перед cursor. К желаниям добавляются sort_key и username владельца.
+    """
+    key, order = GROUP_WISH_SORTS[sort]
+    if backward:
+        order = 'ASC' if order == 'DESC' else 'DESC'
+    conditions = ['gm.group_id = ?']
+    params: List[Any] = [group_id]
+    if cursor:
+        conditions.append(f'({key}, w.wish_id) {"<" if order == "DESC" else ">"} (?, ?)')
+        params.extend(cursor)
+    params.append(limit)
+    # Сначала выбираются id страницы по индексу idx_wish_user_status_priority_price (сортируются
+    # только ключи), затем читаются строки одной страницы
+    query = f'''
+        SELECT {_select_list(Wish, 'w.', sort_key='page.sort_key', username='u.username')} FROM (
+            SELECT w.wish_id, {key} AS sort_key
+            FROM group_member gm
+            JOIN wish w ON w.user_id = gm.user_id AND w.status = 'active'
+            WHERE {" AND ".join(conditions)}
+            ORDER BY sort_key {order}, w.wish_id {order}
+            LIMIT ?
+        ) AS page
+        JOIN wish w ON w.wish_id = page.wish_id
+        LEFT JOIN user u ON u.user_id = w.user_id
+        ORDER BY page.sort_key {order}, w.wish_id {order}
+    '''
+
+    with _reader() as conn:
+        wishes = _fetch(conn, Wish, query, params)
+    if backward:
+        wishes.reverse()
+    return wishes
+
+
+def _search_expression(query: str) -> Optional[str]:
+    """FTS5-запрос из текста пользователя: слова (по первым SEARCH_TERM_LENGTH символам) через AND"""
+    terms = _SEARCH_TERM.findall(query)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    return ' '.join(f'"{term[:SEARCH_TERM_LENGTH]}"*' for term in terms)
+
+
+def _scope_token(prefix: str, value: int) -> str:
+    """Метка столбца scope в wish_fts (см. миграцию 5)"""
+    return f'{prefix}m{-value}' if value < 0 else f'{prefix}{value}'
+
+
+def search_wishes(query: str, user_id: Optional[int] = None, chat_id: Optional[int] = None,
+                  member_id: Optional[int] = None, status: Optional[str] = None,
+                  limit: int = 20) -> List[Wish]:
+    """Полнотекстовый поиск желаний по тексту и описанию, самые подходящие - первыми.
+
+    Ищется среди желаний пользователя user_id, желаний, добавленных в чате chat_id,
+    и желаний из групп, в которых состоит member_id (хотя бы одно условие обязательно).
+    К каждому желанию добавляется username владельца.
+    """
+    expression = _search_expression(query)
+    if expression is None:
+        return []
+    scope = []
+    if user_id is not None:
+        scope.append(_scope_token('u', user_id))
+    if chat_id is not None:
+        scope.append(_scope_token('c', chat_id))
+    if member_id is not None:
+        scope.extend(_scope_token('c', group_id) for group_id in get_user_groups(member_id))
+    if not scope:
+        return []
+
+    conditions = ['wish_fts MATCH ?']
+    params: List[Any] = [f'{{scope}} : ({" OR ".join(scope)}) AND {{wish_text description}} : ({expression})']
+    if status:
+        conditions.append('w.status = ?')
+        params.append(status)
+    params.append(limit)
+    with _reader() as conn:
+        return _fetch(conn, Wish, f'''
+            SELECT {_select_list(Wish, 'w.', username='u.username')} FROM wish_fts
+            JOIN wish w ON w.wish_id = wish_fts.rowid
+            LEFT JOIN user u ON u.user_id = w.user_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY bm25(wish_fts, 10.0, 1.0, 0.0)
+            LIMIT ?
+        ''', params)
+
+
+@_mutation(False)
+def update_wish(conn, wish_id: int, wish_text: Optional[str] = None,
+                      description: Optional[str] = None, status: Optional[str] = None,
+                      priority: Optional[int] = None, price: Optional[float] = None) -> bool:
     """Обновить информацию о желании"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if wish_text is not None:
-            updates.append('wish_text = ?')
-            params.append(wish_text)
-        if description is not None:
-            updates.append('description = ?')
-            params.append(description)
-        if status is not None:
-            updates.append('status = ?')
-            params.append(status)
-        if priority is not None:
-            updates.append('priority = ?')
-            params.append(priority)
-        if price is not None:
-            updates.append('price = ?')
-            params.append(price)
-        
-        if not updates:
-            conn.close()
-            return False
-        
-        params.append(wish_id)
-        query = f'UPDATE wish SET {", ".join(updates)} WHERE wish_id = ?'
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
+    updates = []
+    params = []
+    
+    if wish_text is not None:
+        updates.append('wish_text = ?')
+        params.append(wish_text)
+    if description is not None:
+        updates.append('description = ?')
+        params.append(description)
+    if status is not None:
+        updates.append('status = ?')
+        params.append(status)
+    if priority is not None:
+        updates.append('priority = ?')
+        params.append(priority)
+    if price is not None:
+        updates.append('price = ?')
+        params.append(price)
+    
+    if not updates:
         return False
+    
+    params.append(wish_id)
+    query = f'UPDATE wish SET {", ".join(updates)} WHERE wish_id = ?'
+    _wish_list_changed(conn, wish_id)
+    conn.execute(query, params)
+    return True
 
 
-def complete_wish(wish_id: int) -> bool:
+@_mutation(False)
+def complete_wish(conn, wish_id: int) -> bool:
     """Отметить желание как выполненное"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE wish SET status = 'completed', complete_date = CURRENT_TIMESTAMP
-            WHERE wish_id = ?
-        ''', (wish_id,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    _wish_list_changed(conn, wish_id)
+    cursor = conn.cursor()
+    cursor.execute('''
+        UPDATE wish SET status = 'completed', complete_date = CURRENT_TIMESTAMP
+        WHERE wish_id = ?
+    ''', (wish_id,))
+    return True
 
 
-def cancel_wish(wish_id: int) -> bool:
+@_mutation(False)
+def cancel_wish(conn, wish_id: int) -> bool:
     """Отменить желание"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE wish SET status = ? WHERE wish_id = ?', ('cancelled', wish_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    _wish_list_changed(conn, wish_id)
+    cursor = conn.cursor()
+    cursor.execute('UPDATE wish SET status = ? WHERE wish_id = ?', ('cancelled', wish_id))
+    return True
 
 
-def delete_wish(wish_id: int) -> bool:
+@_mutation(False)
+def delete_wish(conn, wish_id: int) -> bool:
     """Удалить желание"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM wish WHERE wish_id = ?', (wish_id,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    _wish_list_changed(conn, wish_id)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM wish WHERE wish_id = ?', (wish_id,))
+    return True
 
 
 # ============== GROUP функции ==============
 
-def add_group(group_id: int, title: str, description: Optional[str] = None) -> bool:
+@_mutation(False, errors=sqlite3.IntegrityError)
+def add_group(conn, group_id: int, title: str, description: Optional[str] = None) -> bool:
     """Добавить новую группу"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO "group" (group_id, title, description)
-            VALUES (?, ?, ?)
-        ''', (group_id, title, description))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO "group" (group_id, title, description)
+        VALUES (?, ?, ?)
+    ''', (group_id, title, description))
+    after_commit(lambda: _invalidate('group', group_id))
+    return True
 
 
-def get_group(group_id: int) -> Optional[Dict[str, Any]]:
-    """Получить информацию о группе"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM "group" WHERE group_id = ?', (group_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+def _load_group(group_id: int) -> Optional[Group]:
+    with _reader() as conn:
+        return _fetch_one(conn, Group, f'SELECT {_GROUP_COLUMNS} FROM "group" WHERE group_id = ?', (group_id,))
+
+
+def get_group(group_id: int) -> Optional[Group]:
+    """Получить информацию о группе (через кэш)"""
+    return _group_cache.get_or_load(group_id, lambda: _load_group(group_id))
 
 
 def group_exists(group_id: int) -> bool:
-    """Проверить, существует ли группа"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM "group" WHERE group_id = ?', (group_id,))
-    exists = cursor.fetchone() is not None
-    conn.close()
-    return exists
+    """Проверить, существует ли группа (через кэш)"""
+    return _group_cache.get_or_load(group_id, lambda: _load_group(group_id)) is not None
 
 
-def update_group(group_id: int, title: Optional[str] = None,
-                 description: Optional[str] = None) -> bool:
+@_mutation(False)
+def update_group(conn, group_id: int, title: Optional[str] = None,
+                       description: Optional[str] = None) -> bool:
     """Обновить информацию о группе"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        
-        updates = []
-        params = []
-        
-        if title is not None:
-            updates.append('title = ?')
-            params.append(title)
-        if description is not None:
-            updates.append('description = ?')
-            params.append(description)
-        
-        if not updates:
-            conn.close()
-            return False
-        
-        params.append(group_id)
-        query = f'UPDATE "group" SET {", ".join(updates)} WHERE group_id = ?'
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
+    updates = []
+    params = []
+    
+    if title is not None:
+        updates.append('title = ?')
+        params.append(title)
+    if description is not None:
+        updates.append('description = ?')
+        params.append(description)
+    
+    if not updates:
         return False
+    
+    params.append(group_id)
+    query = f'UPDATE "group" SET {", ".join(updates)} WHERE group_id = ?'
+    conn.execute(query, params)
+    after_commit(lambda: _invalidate('group', group_id))
+    return True
 
 
-def delete_group(group_id: int) -> bool:
+@_mutation(False)
+def delete_group(conn, group_id: int) -> bool:
     """Удалить группу"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM "group" WHERE group_id = ?', (group_id,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM "group" WHERE group_id = ?', (group_id,))
+    after_commit(lambda: _invalidate('group', group_id))
+    return True
 
 
 # ============== GROUP_MEMBER функции ==============
 
-def add_group_member(group_id: int, user_id: int) -> bool:
+@_mutation(False, errors=sqlite3.IntegrityError)
+def add_group_member(conn, group_id: int, user_id: int) -> bool:
     """Добавить пользователя в группу"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO group_member (group_id, user_id)
-            VALUES (?, ?)
-        ''', (group_id, user_id))
-        conn.commit()
-        conn.close()
-        return True
-    except sqlite3.IntegrityError:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO group_member (group_id, user_id)
+        VALUES (?, ?)
+    ''', (group_id, user_id))
+    after_commit(lambda: _invalidate('membership', group_id, user_id))
+    return True
 
 
-def remove_group_member(group_id: int, user_id: int) -> bool:
+@_mutation(False)
+def remove_group_member(conn, group_id: int, user_id: int) -> bool:
     """Удалить пользователя из группы"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            DELETE FROM group_member WHERE group_id = ? AND user_id = ?
-        ''', (group_id, user_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM group_member WHERE group_id = ? AND user_id = ?
+    ''', (group_id, user_id))
+    after_commit(lambda: _invalidate('membership', group_id, user_id))
+    return True
 
 
 def get_group_members(group_id: int) -> List[int]:
     """Получить список ID пользователей в группе"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM group_member WHERE group_id = ?', (group_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT user_id FROM group_member WHERE group_id = ?', (group_id,))
+        rows = cursor.fetchall()
     return [row[0] for row in rows]
 
 
+_USER_GROUPS = 'SELECT group_id FROM group_member WHERE user_id = ?'
+
+
 def get_user_groups(user_id: int) -> List[int]:
     """Получить список ID групп, в которых состоит пользователь"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT group_id FROM group_member WHERE user_id = ?', (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_USER_GROUPS, (user_id,))
+        rows = cursor.fetchall()
     return [row[0] for row in rows]
 
 
-def is_group_member(group_id: int, user_id: int) -> bool:
-    """Проверить, является ли пользователь членом группы"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT 1 FROM group_member WHERE group_id = ? AND user_id = ?', 
-                   (group_id, user_id))
-    exists = cursor.fetchone() is not None
-    conn.close()
+def _load_membership(group_id: int, user_id: int) -> bool:
+    with _reader() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM group_member WHERE group_id = ? AND user_id = ?', 
+                       (group_id, user_id))
+        exists = cursor.fetchone() is not None
     return exists
 
 
+def is_group_member(group_id: int, user_id: int) -> bool:
+    """Проверить, является ли пользователь членом группы (через кэш)"""
+    return _membership_cache.get_or_load((group_id, user_id), lambda: _load_membership(group_id, user_id))
+
+
 # ============== RESERVATION функции ==============
 
-def add_reservation(wish_id: int, user_id: int) -> Optional[int]:
+@_mutation(None)
+def add_reservation(conn, wish_id: int, user_id: int) -> Optional[int]:
     """Добавить резервирование. Возвращает ID резервирования"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO reservation (wish_id, user_id, status)
-            VALUES (?, ?, 'reserved')
-        ''', (wish_id, user_id))
-        reservation_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return reservation_id
-    except Exception:
-        conn.close()
-        return None
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO reservation (wish_id, user_id, status)
+        VALUES (?, ?, 'reserved')
+    ''', (wish_id, user_id))
+    reservation_id = cursor.lastrowid
+    _wish_list_changed(conn, wish_id)
+    return reservation_id
 
 
-def get_reservation(reservation_id: int) -> Optional[Dict[str, Any]]:
+def get_reservation(reservation_id: int) -> Optional[Reservation]:
     """Получить информацию о резервировании"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM reservation WHERE reservation_id = ?', (reservation_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    with _reader() as conn:
+        return _fetch_one(conn, Reservation, f'SELECT {_RESERVATION_COLUMNS} FROM reservation '
+                                             f'WHERE reservation_id = ?', (reservation_id,))
 
 
-def get_wish_reservations(wish_id: int) -> List[Dict[str, Any]]:
-    """Получить все резервирования для желания"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM reservation WHERE wish_id = ? ORDER BY reserved_at DESC', (wish_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def _wish_reservations_query(wish_id: int, include_archive: bool):
+    return _table_query('reservation', 'wish_id = ?', (wish_id,), 'reserved_at DESC', include_archive)
 
 
-def get_user_reservations(user_id: int, status: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Получить все резервирования пользователя"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    if status:
-        cursor.execute('SELECT * FROM reservation WHERE user_id = ? AND status = ? ORDER BY reserved_at DESC',
-                      (user_id, status))
-    else:
-        cursor.execute('SELECT * FROM reservation WHERE user_id = ? ORDER BY reserved_at DESC', (user_id,))
-    
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_wish_reservations(wish_id: int, include_archive: bool = False) -> List[Reservation]:
+    """Получить все резервирования для желания. include_archive=True - вместе с перенесёнными в архив"""
+    with _reader() as conn:
+        return _fetch(conn, *_wish_reservations_query(wish_id, include_archive))
+
+
+def iter_wish_reservations(wish_id: int, include_archive: bool = False, *,
+                           chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Reservation]:
+    """Резервирования желания, как get_wish_reservations, но потоком: по chunk_size строк (см. _stream)"""
+    record, query, params = _wish_reservations_query(wish_id, include_archive)
+    return _stream(record._make, query, params, chunk_size)
+
+
+def _user_reservations_query(user_id: int, status: Optional[str], include_archive: bool):
+    where, params = ('user_id = ? AND status = ?', (user_id, status)) if status else ('user_id = ?', (user_id,))
+    return _table_query('reservation', where, params, 'reserved_at DESC', include_archive)
 
 
-def get_active_reservation_for_wish(wish_id: int) -> Optional[Dict[str, Any]]:
+def get_user_reservations(user_id: int, status: Optional[str] = None,
+                          include_archive: bool = False) -> List[Reservation]:
+    """Получить все резервирования пользователя. include_archive=True - вместе с перенесёнными в архив"""
+    with _reader() as conn:
+        return _fetch(conn, *_user_reservations_query(user_id, status, include_archive))
+
+
+def iter_user_reservations(user_id: int, status: Optional[str] = None, include_archive: bool = False, *,
+                           chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Reservation]:
+    """Резервирования пользователя, как get_user_reservations, но потоком: по chunk_size строк (см. _stream)"""
+    record, query, params = _user_reservations_query(user_id, status, include_archive)
+    return _stream(record._make, query, params, chunk_size)
+
+
+_ACTIVE_RESERVATION_FOR_WISH = f'SELECT {_RESERVATION_COLUMNS} FROM reservation WHERE wish_id = ? AND status = ?'
+
+
+def get_active_reservation_for_wish(wish_id: int) -> Optional[Reservation]:
     """Получить активное резервирование для желания"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM reservation WHERE wish_id = ? AND status = ?', 
-                   (wish_id, 'reserved'))
-    row = cursor.fetchone()
-    conn.close()
-    return dict(row) if row else None
+    with _reader() as conn:
+        return _fetch_one(conn, Reservation, _ACTIVE_RESERVATION_FOR_WISH, (wish_id, 'reserved'))
 
 
-def update_reservation_status(reservation_id: int, status: str) -> bool:
+def _active_reservations_query(count: int) -> str:
+    placeholders = ', '.join('?' * count)
+    return f'SELECT {_RESERVATION_COLUMNS} FROM reservation WHERE wish_id IN ({placeholders}) AND status = ?'
+
+
+def get_active_reservations(wish_ids: Iterable[int]) -> Dict[int, Reservation]:
+    """Активные резервирования набора желаний одним запросом: {wish_id: резервирование}.
+
+    Желаний без активного резервирования в результате нет. Запрос идёт по индексу (wish_id, status),
+    поэтому время зависит только от количества желаний в наборе, а не от размера таблицы.
+    """
+    wish_ids = list(dict.fromkeys(wish_ids))
+    reservations: Dict[int, Reservation] = {}
+    with _reader() as conn:
+        for start in range(0, len(wish_ids), RESERVATION_LOOKUP_CHUNK):
+            chunk = wish_ids[start:start + RESERVATION_LOOKUP_CHUNK]
+            rows = _fetch(conn, Reservation, _active_reservations_query(len(chunk)), (*chunk, 'reserved'))
+            # Строки одного желания идут в порядке индекса, то есть по reservation_id: остаётся первое
+            for reservation in rows:
+                reservations.setdefault(reservation.wish_id, reservation)
+    return reservations
+
+
+@_mutation(False)
+def update_reservation_status(conn, reservation_id: int, status: str) -> bool:
     """Обновить статус резервирования (reserved, cancelled, fulfilled)"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('UPDATE reservation SET status = ? WHERE reservation_id = ?', 
-                       (status, reservation_id))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    _reservation_changed(conn, reservation_id)
+    cursor.execute('UPDATE reservation SET status = ? WHERE reservation_id = ?', 
+                   (status, reservation_id))
+    return True
 
 
 def cancel_reservation(reservation_id: int) -> bool:
@@ -567,15 +1021,254 @@ def fulfill_reservation(reservation_id: int) -> bool:
     return update_reservation_status(reservation_id, 'fulfilled')
 
 
-def delete_reservation(reservation_id: int) -> bool:
+@_mutation(False)
+def delete_reservation(conn, reservation_id: int) -> bool:
     """Удалить резервирование"""
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM reservation WHERE reservation_id = ?', (reservation_id,))
-        conn.commit()
-        conn.close()
-        return True
-    except Exception:
-        conn.close()
-        return False
+    cursor = conn.cursor()
+    _reservation_changed(conn, reservation_id)
+    cursor.execute('DELETE FROM reservation WHERE reservation_id = ?', (reservation_id,))
+    return True
+
+
+
+# ============== Счётчики желаний ==============
+
+def get_wish_summary(user_id: Optional[int] = None, chat_id: Optional[int] = None) -> Dict[str, Any]:
+    """Получить счётчики желаний пользователя (user_id) или чата (chat_id) одной строкой wish_summary.
+
+    Возвращает количество желаний всего (total) и по статусам, количество желаний с ценой (priced),
+    сумму и среднюю цену (price_sum, avg_price) и количество активных резервирований (reserved).
+    """
+    kind, key = ('u', user_id) if user_id is not None else ('c', chat_id)
+    with _reader() as conn:
+        row = conn.execute(f'SELECT {", ".join(db_migrations.SUMMARY_COLUMNS)} FROM wish_summary '
+                           'WHERE kind = ? AND id = ?', (kind, key)).fetchone()
+    summary = dict(row) if row else dict.fromkeys(db_migrations.SUMMARY_COLUMNS, 0)
+    summary['avg_price'] = summary['price_sum'] / summary['priced'] if summary['priced'] else None
+    return summary
+
+
+def check_wish_summary() -> List[Dict[str, Any]]:
+    """Сравнить wish_summary с подсчётом по wish и reservation.
+
+    Возвращает расхождения: kind, id, сохранённые (stored, None - строки нет) и ожидаемые (expected) значения.
+    Читает все желания, поэтому предназначена для обслуживания, а не для обработчиков.
+    """
+    columns = db_migrations.SUMMARY_COLUMNS
+    with _reader() as conn:
+        # Оба запроса - в одной транзакции чтения, чтобы видеть одно и то же состояние БД
+        conn.execute('BEGIN')
+        try:
+            expected = {(row[0], row[1]): row[2:] for row in conn.execute(db_migrations.WISH_SUMMARY_SELECT)}
+            stored = {(row[0], row[1]): row[2:]
+                      for row in conn.execute(f'SELECT kind, id, {", ".join(columns)} FROM wish_summary')}
+        finally:
+            conn.execute('COMMIT')
+
+    zeros = (0,) * len(columns)
+    price_sum = columns.index('price_sum')
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        want, have = expected.get(key, zeros), stored.get(key)
+        got = have or zeros
+        differs = any(abs(a - b) > SUMMARY_PRICE_TOLERANCE if index == price_sum else a != b
+                      for index, (a, b) in enumerate(zip(got, want)))
+        if differs:
+            mismatches.append({
+                'kind': key[0],
+                'id': key[1],
+                'stored': dict(zip(columns, have)) if have else None,
+                'expected': dict(zip(columns, want)),
+            })
+    return mismatches
+
+
+@_mutation(None)
+def rebuild_wish_summary(conn) -> int:
+    """Пересчитать wish_summary по wish и reservation. Возвращает количество строк счётчиков"""
+    conn.execute('DELETE FROM wish_summary')
+    cursor = conn.execute(f'INSERT INTO wish_summary (kind, id, {", ".join(db_migrations.SUMMARY_COLUMNS)}) '
+                          f'{db_migrations.WISH_SUMMARY_SELECT}')
+    return cursor.rowcount
+
+
+# ============== FSM функции ==============
+
+def get_fsm_record(key: str) -> Optional[Tuple[Optional[str], Any]]:
+    """Получить сохранённое состояние FSM: (state, закодированные данные)"""
+    with _reader() as conn:
+        row = conn.execute('SELECT state, data FROM fsm_state WHERE key = ?', (key,)).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+@_mutation(False)
+def save_fsm_records(conn, records: List[Tuple[str, Optional[str], Any, float]]) -> bool:
+    """Сохранить пачку состояний FSM: (key, state, закодированные данные, время изменения).
+    Записи без состояния и данных удаляются"""
+    empty = [(key,) for key, state, data, _ in records if state is None and data is None]
+    filled = [record for record in records if record[1] is not None or record[2] is not None]
+    if empty:
+        conn.executemany('DELETE FROM fsm_state WHERE key = ?', empty)
+    if filled:
+        conn.executemany('''
+            INSERT INTO fsm_state (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data,
+                                           updated_at = excluded.updated_at
+        ''', filled)
+    return True
+
+
+@_mutation(0)
+def delete_expired_fsm_records(conn, before: float) -> int:
+    """Удалить состояния FSM, не изменявшиеся с момента before. Возвращает количество удалённых"""
+    return conn.execute('DELETE FROM fsm_state WHERE updated_at < ?', (before,)).rowcount
+
+
+def get_recent_fsm_records(limit: int) -> List[Tuple[str, Optional[str], Any]]:
+    """Последние изменённые состояния FSM: (key, state, закодированные данные), новые сначала"""
+    with _reader() as conn:
+        rows = conn.execute('SELECT key, state, data FROM fsm_state ORDER BY updated_at DESC LIMIT ?',
+                            (limit,)).fetchall()
+    return [tuple(row) for row in rows]
+
+
+# ============== Массовый импорт и экспорт ==============
+
+class BulkTable:
+    """Таблица для массового импорта и экспорта: столбцы и значения по умолчанию для пустых полей"""
+    __slots__ = ('table', 'key', 'columns', 'defaults')
+
+    def __init__(self, table: str, key: str, columns: Tuple[str, ...], defaults: Dict[str, str]):
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.defaults = defaults
+
+
+BULK_TABLES = {
+    'users': BulkTable('user', 'user_id', ('user_id', 'username', 'first_name', 'last_name', 'registration_date'),
+                       {'registration_date': 'CURRENT_TIMESTAMP'}),
+    'wishes': BulkTable('wish', 'wish_id', ('wish_id', 'user_id', 'chat_id', 'wish_text', 'description', 'status',
+                                            'priority', 'create_date', 'complete_date', 'image_url', 'price'),
+                        {'status': "'active'", 'priority': '3', 'create_date': 'CURRENT_TIMESTAMP'}),
+    'reservations': BulkTable('reservation', 'reservation_id',
+                              ('reservation_id', 'wish_id', 'user_id', 'reserved_at', 'status'),
+                              {'reserved_at': 'CURRENT_TIMESTAMP', 'status': "'reserved'"}),
+}
+
+# Сколько строк читать из БД за раз при экспорте и записывать в одной транзакции при импорте
+BULK_CHUNK_SIZE = 5000
+
+
+def iter_table(name: str, chunk_size: int = BULK_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Строки таблицы из BULK_TABLES по порядку ключа. Читает порциями, не загружая таблицу в память"""
+    spec = BULK_TABLES[name]
+    columns = spec.columns
+    return _stream(lambda row: dict(zip(columns, row)),
+                   f'SELECT {", ".join(columns)} FROM {spec.table} ORDER BY {spec.key}', (), chunk_size)
+
+
+def _bulk_insert_query(spec: BulkTable) -> str:
+    values = ', '.join(f'COALESCE(?, {spec.defaults[column]})' if column in spec.defaults else '?'
+                       for column in spec.columns)
+    updates = ', '.join(f'{column} = excluded.{column}' for column in spec.columns if column != spec.key)
+    return (f'INSERT INTO {spec.table} ({", ".join(spec.columns)}) VALUES ({values}) '
+            f'ON CONFLICT({spec.key}) DO UPDATE SET {updates}')
+
+
+def import_rows(name: str, rows: Iterable[Mapping[str, Any]], chunk_size: int = BULK_CHUNK_SIZE,
+                progress: Optional[Callable[[int], None]] = None) -> int:
+    """Загрузить строки в таблицу из BULK_TABLES. Возвращает количество загруженных строк.
+
+    Строки с существующим ключом заменяют сохранённые, строки без ключа добавляются.
+    Каждые chunk_size строк записываются одной транзакцией, после неё вызывается progress(всего).
+    """
+    spec = BULK_TABLES[name]
+    query = _bulk_insert_query(spec)
+    manager = get_manager()
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = [tuple(row.get(column) for column in spec.columns) for row in itertools.islice(rows, chunk_size)]
+        if not chunk:
+            break
+        with manager.writer() as conn:
+            conn.executemany(query, chunk)
+        total += len(chunk)
+        _invalidate_imported(name, spec, chunk)
+        if progress is not None:
+            progress(total)
+    return total
+
+
+def _invalidate_imported(name: str, spec: BulkTable, chunk: List[tuple]):
+    if name == 'users':
+        for user_id, username, *_ in chunk:
+            _invalidate('user', user_id, username)
+    elif name == 'wishes':
+        owner = spec.columns.index('user_id')
+        for user_id in {row[owner] for row in chunk}:
+            _invalidate('wish_list', user_id)
+    elif name == 'reservations':
+        # Отметки о резервировании входят в отрисованные страницы списка владельца желания
+        wish = spec.columns.index('wish_id')
+        wish_ids = list({row[wish] for row in chunk})
+        owners = set()
+        with _reader() as conn:
+            for start in range(0, len(wish_ids), RESERVATION_LOOKUP_CHUNK):
+                part = wish_ids[start:start + RESERVATION_LOOKUP_CHUNK]
+                owners.update(user_id for user_id, in conn.execute(
+                    f'SELECT DISTINCT user_id FROM wish WHERE wish_id IN ({", ".join("?" * len(part))})', part))
+        for user_id in owners:
+            _invalidate('wish_list', user_id)
+
+
+# ============== Архив ==============
+# Столбцы горячих таблиц, которые копируются в архив (в архиве ещё есть archived_at)
+_ARCHIVE_COLUMNS = {
+    'wish': BULK_TABLES['wishes'].columns,
+    'reservation': BULK_TABLES['reservations'].columns,
+}
+
+
+def archive_cutoff(older_than_days: float) -> str:
+    """Граница переноса в архив в формате CURRENT_TIMESTAMP: желания, законченные раньше, переносятся"""
+    return (datetime.now(timezone.utc) - timedelta(days=older_than_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Кандидаты в архив. Индекс указан явно: пока кандидатов много, планировщик выбирает полный просмотр,
+# а когда архив догнал историю, просмотр читал бы всю горячую таблицу ради нескольких строк
+_ARCHIVE_CANDIDATES = ("SELECT wish_id, user_id FROM wish INDEXED BY idx_wish_finished "
+                       "WHERE status IN ('completed', 'cancelled') AND COALESCE(complete_date, create_date) < ? "
+                       "LIMIT ?")
+
+
+@_mutation(0)
+def archive_wishes(conn, before: str, limit: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Перенести в архив до limit завершённых и отменённых желаний, законченных раньше before
+    (по complete_date, у отменённых без неё - по create_date), вместе с их резервированиями.
+
+    Возвращает количество перенесённых желаний. Один вызов - одна транзакция, поэтому большой
+    архив переносится батчами (см. db_maintenance.archive), не задерживая остальные изменения.
+    """
+    rows = conn.execute(_ARCHIVE_CANDIDATES, (before, limit)).fetchall()
+    if not rows:
+        return 0
+    wish_ids = [row[0] for row in rows]
+    # Списки id - частями, как в get_active_reservations: число параметров запроса ограничено
+    for start in range(0, len(wish_ids), RESERVATION_LOOKUP_CHUNK):
+        chunk = wish_ids[start:start + RESERVATION_LOOKUP_CHUNK]
+        placeholders = ', '.join('?' * len(chunk))
+        for table in ('reservation', 'wish'):
+            columns = ', '.join(_ARCHIVE_COLUMNS[table])
+            conn.execute(f'INSERT OR REPLACE INTO {table}_archive ({columns}) '
+                         f'SELECT {columns} FROM {table} WHERE wish_id IN ({placeholders})', chunk)
+            conn.execute(f'DELETE FROM {table} WHERE wish_id IN ({placeholders})', chunk)
+    owners = {row[1] for row in rows}
+
+    def invalidate():
+        for user_id in owners:
+            _invalidate('wish_list', user_id)
+    after_commit(invalidate)
+    return len(rows)
+
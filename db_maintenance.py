@@ -0,0 +1,439 @@
+"""Фоновое обслуживание БД: статистика планировщика запросов (ANALYZE, PRAGMA optimize), слияние сегментов
+полнотекстового индекса, возврат свободных страниц (incremental vacuum), контрольные точки WAL и перенос
+старых желаний в архив.
+
+Задачи выполняются короткими шагами: соединение-писатель берётся на один шаг и сразу освобождается,
+поэтому изменения бота ждут не дольше одного шага. MaintenanceScheduler запускает задачи по расписанию
+и только пока бот простаивает или почти не нагружен, прерывая задачу, как только нагрузка выросла.
+
+Запуск вручную: python -m db_maintenance run [analyze fts_merge vacuum checkpoint archive] [--db wishlist.db]
+                python -m db_maintenance vacuum-full [--db wishlist.db]   (бот должен быть остановлен)
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import db_controller
+from db_connection import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+# Приблизительный ANALYZE: столько строк просматривается в каждом индексе (0 - все строки)
+ANALYSIS_LIMIT = 1000
+# Страниц полнотекстового индекса, сливаемых за один шаг
+FTS_MERGE_PAGES = 200
+# Страниц, возвращаемых системе за один шаг incremental vacuum
+VACUUM_STEP_PAGES = 256
+# Сколько TRUNCATE-контрольная точка ждёт читателей старого снимка, мс
+CHECKPOINT_BUSY_TIMEOUT = 50
+
+
+def _disk_size(db_name: str) -> int:
+    """Размер файлов БД и WAL на диске, байт"""
+    return sum(os.path.getsize(path) for path in (db_name, db_name + '-wal') if os.path.exists(path))
+
+
+class MaintenanceRun:
+    """Один запуск задачи обслуживания. Функция задачи делает шаги, пока proceed() возвращает True,
+    и берёт соединение-писатель на один шаг через writer().
+    """
+
+    def __init__(self, manager: ConnectionManager, proceed: Optional[Callable[[], bool]] = None,
+                 on_step: Optional[Callable[[], None]] = None):
+        self.manager = manager
+        self._proceed = proceed
+        self._on_step = on_step
+        self.steps = 0
+        # Дольше всего писатель был занят одним шагом, с
+        self.longest_step = 0.0
+        self.interrupted = False
+        # Длительность запуска, с, и показатели задачи (заполняет планировщик)
+        self.seconds = 0.0
+        self.result: Dict[str, int] = {}
+
+    def proceed(self) -> bool:
+        """Можно ли сделать следующий шаг. False - задачу нужно прервать и доделать в следующий простой"""
+        if self._proceed is None or self._proceed():
+            return True
+        self.interrupted = True
+        return False
+
+    def step_done(self, seconds: float = 0.0):
+        """Отметить выполненный шаг длительностью seconds (собственные изменения не считаются нагрузкой бота)"""
+        self.steps += 1
+        self.longest_step = max(self.longest_step, seconds)
+        if self._on_step is not None:
+            self._on_step()
+
+    @contextmanager
+    def writer(self):
+        """Соединение-писатель без транзакции на время одного шага"""
+        with self.manager.writer_connection() as conn:
+            started = time.perf_counter()
+            yield conn
+            seconds = time.perf_counter() - started
+        self.step_done(seconds)
+
+
+# ============== Задачи ==============
+# Функция задачи получает MaintenanceRun и возвращает показатели запуска,
+# в том числе 'reclaimed' - освобождённые байты
+
+def analyze(run: MaintenanceRun) -> Dict[str, int]:
+    """Обновить статистику планировщика запросов: приблизительный ANALYZE по одной таблице за шаг,
+    затем PRAGMA optimize
+    """
+    with run.manager.reader() as conn:
+        rows = conn.execute("SELECT name, sql LIKE 'CREATE VIRTUAL TABLE%' FROM sqlite_master "
+                            "WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()
+    # Служебные таблицы полнотекстового индекса читаются только по ключу, а без индексов ANALYZE
+    # просматривает их целиком
+    virtual = tuple(name + '_' for name, is_virtual in rows if is_virtual)
+    tables = [name for name, is_virtual in rows if not is_virtual and not name.startswith(virtual)]
+    # PRAGMA optimize тоже под ограничением: иначе таблицы, чьи запросы разбирались на соединении-писателе
+    # (например, проверка планов в init_db), анализируются целиком
+    statements = [f'ANALYZE "{table}"' for table in tables] + ['PRAGMA optimize']
+    analyzed = 0
+    for statement in statements:
+        if not run.proceed():
+            break
+        with run.writer() as conn:
+            conn.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+            try:
+                conn.execute(statement)
+            finally:
+                conn.execute('PRAGMA analysis_limit = 0')
+        analyzed += 1
+    return {'reclaimed': 0, 'tables': min(analyzed, len(tables))}
+
+
+def fts_merge(run: MaintenanceRun) -> Dict[str, int]:
+    """Слить сегменты полнотекстового индекса wish_fts (и выбросить из них удалённые записи)
+    шагами по FTS_MERGE_PAGES страниц. Освобождённые страницы остаются в файле до vacuum
+    """
+    used_before = _used_bytes(run.manager)
+    while run.proceed():
+        with run.writer() as conn:
+            changes = conn.total_changes
+            conn.execute("INSERT INTO wish_fts(wish_fts, rank) VALUES('merge', ?)", (FTS_MERGE_PAGES,))
+            # Если сливать нечего, команда меняет не больше одной строки
+            merged = conn.total_changes - changes > 1
+        if not merged:
+            break
+    return {'reclaimed': used_before - _used_bytes(run.manager)}
+
+
+def _used_bytes(manager: ConnectionManager) -> int:
+    """Байт в занятых страницах БД"""
+    with manager.reader() as conn:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        used = conn.execute('PRAGMA page_count').fetchone()[0] - conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return used * page_size
+
+
+_vacuum_warned = False
+
+
+def vacuum(run: MaintenanceRun) -> Dict[str, int]:
+    """Вернуть системе свободные страницы шагами по VACUUM_STEP_PAGES (PRAGMA incremental_vacuum).
+
+    Файл уменьшается при следующей контрольной точке WAL. Работает только при auto_vacuum=INCREMENTAL:
+    так создаются новые БД, а существующую нужно один раз перевести командой vacuum-full.
+    """
+    global _vacuum_warned
+    with run.manager.reader() as conn:
+        auto_vacuum = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if auto_vacuum != 2:
+        if free and not _vacuum_warned:
+            _vacuum_warned = True
+            logger.warning('В БД %s свободных страниц (%s байт), но auto_vacuum не INCREMENTAL: вернуть их '
+                           'можно только командой python -m db_maintenance vacuum-full', free, free * page_size)
+        return {'reclaimed': 0, 'pages': 0}
+    pages = 0
+    while free and run.proceed():
+        with run.writer() as conn:
+            conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+            left = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        pages += free - left
+        free = left
+    return {'reclaimed': pages * page_size, 'pages': pages}
+
+
+def checkpoint(run: MaintenanceRun) -> Dict[str, int]:
+    """Перенести WAL в файл БД (PASSIVE, не ждёт читателей) и, если перенесён весь журнал, обнулить его
+    (TRUNCATE). Заодно файл БД уменьшается на страницы, возвращённые vacuum
+    """
+    before = _disk_size(run.manager.db_name)
+    busy, frames, copied = 0, 0, 0
+    if run.proceed():
+        with run.writer() as conn:
+            busy, frames, copied = conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+        if not busy and frames == copied and run.proceed():
+            with run.writer() as conn:
+                # Читатели старого снимка не дают обнулить WAL: ждём их недолго, чтобы не держать писателя
+                conn.execute(f'PRAGMA busy_timeout = {CHECKPOINT_BUSY_TIMEOUT}')
+                try:
+                    busy = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()[0]
+                finally:
+                    conn.execute(f'PRAGMA busy_timeout = {int(run.manager.busy_timeout)}')
+    return {'reclaimed': before - _disk_size(run.manager.db_name), 'frames': copied, 'busy': busy}
+
+
+def archive(run: MaintenanceRun, older_than_days: float, batch_size: int = db_controller.ARCHIVE_BATCH_SIZE,
+            pause: float = 0.0) -> Dict[str, int]:
+    """Перенести в архив завершённые и отменённые желания старше older_than_days дней (см.
+    db_controller.archive_wishes). Батч - отдельное изменение в очереди группового коммита
+    """
+    before = db_controller.archive_cutoff(older_than_days)
+    moved = 0
+    while run.proceed():
+        started = time.perf_counter()
+        count = db_controller.archive_wishes.submit(before, batch_size).result()
+        # Вместе с ожиданием в очереди: батч коммитится вместе с изменениями бота
+        run.step_done(time.perf_counter() - started)
+        moved += count
+        if count < batch_size:
+            break
+        time.sleep(pause)
+    return {'reclaimed': 0, 'moved': moved}
+
+
+TASKS = {
+    'analyze': analyze,
+    'fts_merge': fts_merge,
+    'vacuum': vacuum,
+    'checkpoint': checkpoint,
+}
+
+
+# ============== Планировщик ==============
+class MaintenanceTask:
+    """Задача обслуживания с интервалом запуска (с)"""
+    __slots__ = ('name', 'interval', 'func', 'next_run')
+
+    def __init__(self, name: str, interval: float, func: Callable[[MaintenanceRun], Dict[str, int]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        # Первый запуск - в первый простой после старта
+        self.next_run = 0.0
+
+
+class MaintenanceScheduler:
+    """Запускает задачи обслуживания БД, когда бот простаивает или почти не нагружен.
+
+    Нагрузка - обращения к БД за последние idle_window секунд: запросы этого процесса (db_async.activity),
+    других процессов, которые их сообщают (add_activity_source, например процессы-обработчики workers),
+    и изменения из других соединений (PRAGMA data_version).
+    Задача запускается и продолжается, пока в среднем было не больше max_rate обращений в секунду
+    и выполняется не больше max_in_flight запросов. Один запуск длится не дольше max_run секунд,
+    прерванная задача доделывается в следующий простой. Задачи выполняются по очереди в отдельном потоке.
+    """
+
+    def __init__(self, idle_window: float = 5.0, max_rate: float = 2.0, max_in_flight: int = 1,
+                 max_run: float = 30.0, tick: float = 1.0):
+        self.idle_window = idle_window
+        self.max_rate = max_rate
+        self.max_in_flight = max_in_flight
+        self.max_run = max_run
+        self.tick = tick
+        self._tasks: Dict[str, MaintenanceTask] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._samples = deque()
+        self._probe: Optional[sqlite3.Connection] = None
+        self._data_version = 0
+        self._foreign_writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-maintenance')
+        self._closing: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # Источники обращений к БД: (всего с запуска, выполняются сейчас)
+        self._activity_sources: List[Callable[[], Tuple[int, int]]] = []
+
+    def add(self, name: str, interval: float, func: Callable[[MaintenanceRun], Dict[str, int]]):
+        """Добавить задачу (задачи выполняются в порядке добавления). interval=0 - не запускать"""
+        if interval > 0:
+            self._tasks[name] = MaintenanceTask(name, interval, func)
+            self._stats[name] = {'runs': 0, 'interrupted': 0, 'errors': 0, 'seconds': 0.0,
+                                 'reclaimed_bytes': 0, 'longest_step_seconds': 0.0}
+
+    def add_activity_source(self, source: Callable[[], Tuple[int, int]]):
+        """Учитывать в нагрузке обращения к БД source() (всего с запуска, выполняются сейчас), например
+        запросы процессов-обработчиков: их чтения не видны ни в этом процессе, ни в data_version
+        """
+        self._activity_sources.append(source)
+
+    def _activity(self) -> Tuple[int, int]:
+        calls = in_flight = 0
+        for source in self._activity_sources:
+            source_calls, source_in_flight = source()
+            calls += source_calls
+            in_flight += source_in_flight
+        return calls, in_flight
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Показатели задач для метрик"""
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def _read_data_version(self) -> int:
+        return self._probe.execute('PRAGMA data_version').fetchone()[0]
+
+    def _rebase(self):
+        """Не считать нагрузкой собственные изменения: запомнить data_version после шага задачи"""
+        self._data_version = self._read_data_version()
+
+    def is_quiet(self) -> bool:
+        """Простаивает ли бот (см. описание класса)"""
+        now = time.monotonic()
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self._foreign_writes += 1
+        calls, in_flight = self._activity()
+        activity = calls + self._foreign_writes
+        self._samples.append((now, activity))
+        while len(self._samples) > 1 and self._samples[1][0] <= now - self.idle_window:
+            self._samples.popleft()
+        since, activity_then = self._samples[0]
+        if now - since < self.idle_window:
+            return False
+        return in_flight <= self.max_in_flight and (activity - activity_then) / (now - since) <= self.max_rate
+
+    def _run_sync(self, task: MaintenanceTask) -> MaintenanceRun:
+        """Выполнить задачу в потоке обслуживания"""
+        deadline = time.monotonic() + self.max_run
+
+        def proceed() -> bool:
+            return not self._closing.is_set() and time.monotonic() < deadline and self.is_quiet()
+
+        run = MaintenanceRun(db_controller.get_manager(), proceed, self._rebase)
+        started = time.perf_counter()
+        run.result = task.func(run)
+        run.seconds = time.perf_counter() - started
+        return run
+
+    async def run_task(self, task: MaintenanceTask):
+        """Выполнить задачу и записать в лог длительность и освобождённые байты"""
+        loop = asyncio.get_running_loop()
+        stats = self._stats[task.name]
+        try:
+            run = await loop.run_in_executor(self._executor, self._run_sync, task)
+        except Exception:
+            stats['errors'] += 1
+            task.next_run = time.monotonic() + task.interval
+            logger.exception('Ошибка обслуживания БД: %s', task.name)
+            return
+        result = run.result
+        stats['runs'] += 1
+        stats['seconds'] += run.seconds
+        stats['reclaimed_bytes'] += result.get('reclaimed', 0)
+        stats['longest_step_seconds'] = max(stats['longest_step_seconds'], run.longest_step)
+        if run.interrupted:
+            # Доделать в следующий простой
+            stats['interrupted'] += 1
+        else:
+            task.next_run = time.monotonic() + task.interval
+        details = ''.join(f', {key}={value}' for key, value in result.items() if key != 'reclaimed')
+        logger.info('Обслуживание БД: %s за %.3f с, освобождено %s байт, шагов %s, '
+                    'писатель занят до %.1f мс%s%s', task.name, run.seconds, result.get('reclaimed', 0),
+                    run.steps, run.longest_step * 1000, details, ' (прервано, продолжится в следующий простой)' if run.interrupted else '')
+
+    async def _loop(self):
+        while not self._closing.is_set():
+            now = time.monotonic()
+            due = [task for task in self._tasks.values() if task.next_run <= now]
+            # is_quiet вызывается на каждом такте, чтобы окно нагрузки было заполнено замерами
+            if self.is_quiet():
+                for task in due:
+                    if self._closing.is_set() or not self.is_quiet():
+                        break
+                    await self.run_task(task)
+            try:
+                await asyncio.wait_for(self._closing.wait(), self.tick)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Запустить планировщик в текущем event loop"""
+        # db_async импортирует aiogram (через metrics), а командам python -m db_maintenance он не нужен
+        import db_async
+        self._activity_sources.insert(0, db_async.activity)
+        uri = Path(db_controller.DB_NAME).absolute().as_uri() + '?mode=ro'
+        self._probe = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+        self._rebase()
+        self._closing = asyncio.Event()
+        self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        """Остановить планировщик: текущий шаг задачи завершается, следующие не начинаются"""
+        if self._task is None:
+            return
+        self._closing.set()
+        await self._task
+        self._task = None
+        self._executor.shutdown(wait=True)
+        self._probe.close()
+
+
+def run_now(func: Callable[[MaintenanceRun], Dict[str, int]]) -> Dict[str, Any]:
+    """Выполнить задачу сразу, без ожидания простоя"""
+    run = MaintenanceRun(db_controller.get_manager())
+    started = time.perf_counter()
+    result = func(run)
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    result['steps'] = run.steps
+    return result
+
+
+def vacuum_full() -> Dict[str, int]:
+    """Пересобрать БД (VACUUM) и перевести её на auto_vacuum=INCREMENTAL.
+
+    Писатель занят на всё время пересборки, поэтому запускать только при остановленном боте.
+    """
+    manager = db_controller.get_manager()
+    before = _disk_size(manager.db_name)
+    with manager.writer_connection() as conn:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return {'reclaimed': before - _disk_size(manager.db_name)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('run', 'vacuum-full'))
+    parser.add_argument('tasks', nargs='*', help=f"задачи для run: {', '.join(TASKS)}, archive "
+                                                 "(по умолчанию - все, кроме archive)")
+    parser.add_argument('--db', help='файл БД (по умолчанию - DB_NAME из окружения или wishlist.db)')
+    parser.add_argument('--archive-after-days', type=float, default=float(os.getenv('ARCHIVE_AFTER_DAYS', '90')),
+                        help='возраст желаний для задачи archive, дней')
+    args = parser.parse_args()
+    unknown = set(args.tasks) - set(TASKS) - {'archive'}
+    if unknown:
+        parser.error(f"неизвестные задачи: {', '.join(sorted(unknown))}")
+
+    db_controller.configure(db_name=args.db or os.getenv('DB_NAME', 'wishlist.db'))
+    db_controller.init_db()
+    try:
+        if args.command == 'vacuum-full':
+            print(f"vacuum-full: освобождено {vacuum_full()['reclaimed']} байт", file=sys.stderr)
+            return
+        for name in args.tasks or TASKS:
+            func = TASKS.get(name) or (lambda run: archive(run, args.archive_after_days))
+            print(f'{name}: {run_now(func)}', file=sys.stderr)
+    finally:
+        db_controller.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+import logging
+import sqlite3
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+def _fts_columns(row: str) -> str:
+    """Значения столбцов wish_fts для строки wish (row - wish, new или old).
+
+    Одинаковые выражения используются при добавлении в индекс и при удалении из него:
+    FTS5 с внешним содержимым требует удалять ровно те значения, которые были добавлены.
+    """
+    def unescape(column):
+        return f"REPLACE(REPLACE(REPLACE({row}.{column}, '&lt;', '<'), '&gt;', '>'), '&amp;', '&')"
+    scope = f"'u' || {row}.user_id || ' c' || REPLACE({row}.chat_id, '-', 'm')"
+    return f'{unescape("wish_text")}, {unescape("description")}, {scope}'
+
+
+# Счётчики таблицы wish_summary. Строка на владельца желаний (kind 'u', id - user_id) и на чат,
+# в котором желания добавлены (kind 'c', id - chat_id). Средняя цена - price_sum / priced,
+# reserved - количество активных резервирований желаний
+SUMMARY_COLUMNS = ('total', 'active', 'completed', 'cancelled', 'priced', 'price_sum', 'reserved')
+
+# Ожидаемые значения wish_summary, посчитанные по wish и reservation (для заполнения и проверки)
+WISH_SUMMARY_SELECT = '''
+    WITH rows AS (
+        SELECT w.user_id, w.chat_id, w.status, w.price,
+               (SELECT COUNT(*) FROM reservation r WHERE r.wish_id = w.wish_id AND r.status = 'reserved') AS reserved
+        FROM wish w
+    )
+    SELECT 'u' AS kind, user_id AS id, COUNT(*) AS total, SUM(status = 'active') AS active,
+           SUM(status = 'completed') AS completed, SUM(status = 'cancelled') AS cancelled,
+           COUNT(price) AS priced, TOTAL(price) AS price_sum, SUM(reserved) AS reserved
+    FROM rows GROUP BY user_id
+    UNION ALL
+    SELECT 'c', chat_id, COUNT(*), SUM(status = 'active'), SUM(status = 'completed'), SUM(status = 'cancelled'),
+           COUNT(price), TOTAL(price), SUM(reserved)
+    FROM rows GROUP BY chat_id
+'''
+
+
+def _summary_wish(row: str, sign: str) -> str:
+    """Добавить (sign '+') или вычесть (sign '-') строку wish (row - new или old) из счётчиков
+    её владельца и чата"""
+    values = (f"{sign}1, {sign}({row}.status = 'active'), {sign}({row}.status = 'completed'), "
+              f"{sign}({row}.status = 'cancelled'), {sign}({row}.price IS NOT NULL), {sign}IFNULL({row}.price, 0), "
+              f"{sign}(SELECT COUNT(*) FROM reservation WHERE wish_id = {row}.wish_id AND status = 'reserved')")
+    updates = ', '.join(f'{column} = {column} + excluded.{column}' for column in SUMMARY_COLUMNS)
+    return '\n'.join(
+        f"INSERT INTO wish_summary (kind, id, {', '.join(SUMMARY_COLUMNS)}) VALUES ('{kind}', {row}.{column}, {values}) "
+        f"ON CONFLICT (kind, id) DO UPDATE SET {updates};"
+        for kind, column in (('u', 'user_id'), ('c', 'chat_id'))
+    )
+
+
+def _summary_reservation(row: str, sign: str) -> str:
+    """Изменить на 1 счётчик reserved владельца и чата желания, к которому относится резервирование row"""
+    wish = f'FROM wish WHERE wish_id = {row}.wish_id'
+    return (f"UPDATE wish_summary SET reserved = reserved {sign} 1 "
+            f"WHERE {row}.status = 'reserved' AND ((kind = 'u' AND id = (SELECT user_id {wish})) "
+            f"OR (kind = 'c' AND id = (SELECT chat_id {wish})));")
+
+
+# Миграции схемы: (версия, описание, шаги). Шаг - SQL-запрос или функция, принимающая соединение.
+# Миграции применяются строго по возрастанию версии, каждая в своей транзакции.
+# Уже выпущенные миграции не изменяются - для новых изменений добавляется новая версия.
+MIGRATIONS = [
+    (1, 'Начальная схема', [
+        '''
+        CREATE TABLE IF NOT EXISTS user (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS "group" (
+            group_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            description TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS group_member (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            FOREIGN KEY (group_id) REFERENCES "group"(group_id),
+            FOREIGN KEY (user_id) REFERENCES user(user_id),
+            UNIQUE(group_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS wish (
+            wish_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            wish_text TEXT NOT NULL,
+            description TEXT,
+            status TEXT DEFAULT 'active',
+            priority INTEGER DEFAULT 3,
+            create_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            complete_date TIMESTAMP,
+            image_url TEXT,
+            price REAL,
+            FOREIGN KEY (user_id) REFERENCES user(user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reservation (
+            reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            wish_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reserved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            status TEXT DEFAULT 'reserved',
+            FOREIGN KEY (wish_id) REFERENCES wish(wish_id),
+            FOREIGN KEY (user_id) REFERENCES user(user_id)
+        )
+        ''',
+    ]),
+    (2, 'Индексы для горячих запросов', [
+        # get_user_by_username
+        'CREATE INDEX IF NOT EXISTS idx_user_username ON user(username)',
+        # get_user_wishes без статуса и со статусом (сортировка по create_date берётся из индекса)
+        'CREATE INDEX IF NOT EXISTS idx_wish_user_date ON wish(user_id, create_date)',
+        'CREATE INDEX IF NOT EXISTS idx_wish_user_status_date ON wish(user_id, status, create_date)',
+        # get_chat_wishes без статуса и со статусом
+        'CREATE INDEX IF NOT EXISTS idx_wish_chat_priority_date ON wish(chat_id, priority, create_date)',
+        'CREATE INDEX IF NOT EXISTS idx_wish_chat_status_priority_date '
+        'ON wish(chat_id, status, priority, create_date)',
+        # get_active_reservation_for_wish, get_active_reservations
+        'CREATE INDEX IF NOT EXISTS idx_reservation_wish_status ON reservation(wish_id, status)',
+        # get_user_groups
+        'CREATE INDEX IF NOT EXISTS idx_group_member_user ON group_member(user_id)',
+    ]),
+    (3, 'Хранилище состояний FSM', [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data BLOB,
+            updated_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_at)',
+    ]),
+    # С этой версии текст и описание желаний хранятся экранированными для parse_mode=HTML
+    # (renderer.escape при сохранении). Экранируем уже сохранённые желания так же: &, <, >.
+    (4, 'Экранирование текста желаний для HTML', [
+        '''
+        UPDATE wish SET
+            wish_text = REPLACE(REPLACE(REPLACE(wish_text, '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+            description = REPLACE(REPLACE(REPLACE(description, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')
+        WHERE wish_text GLOB '*[&<>]*' OR description GLOB '*[&<>]*'
+        ''',
+    ]),
+    (5, 'Полнотекстовый поиск по желаниям', [
+        # Индексируется текст без HTML-экранирования, а также служебный столбец scope с метками
+        # владельца (u<id>) и чата (c<id>, cm<id> для отрицательных id групп): поиск в пределах
+        # пользователя или чатов - это AND с этими метками внутри FTS-запроса
+        f'''
+        CREATE VIEW IF NOT EXISTS wish_fts_source (wish_id, wish_text, description, scope) AS
+        SELECT wish_id, {_fts_columns('wish')} FROM wish
+        ''',
+        # Префиксные индексы до 6 символов: слова запроса ищутся по первым 6 символам (формы слова)
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS wish_fts USING fts5(
+            wish_text, description, scope,
+            content='wish_fts_source', content_rowid='wish_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6'
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_fts_insert AFTER INSERT ON wish BEGIN
+            INSERT INTO wish_fts (rowid, wish_text, description, scope)
+            VALUES (new.wish_id, {_fts_columns('new')});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_fts_delete AFTER DELETE ON wish BEGIN
+            INSERT INTO wish_fts (wish_fts, rowid, wish_text, description, scope)
+            VALUES ('delete', old.wish_id, {_fts_columns('old')});
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_fts_update AFTER UPDATE OF wish_text, description, user_id, chat_id
+        ON wish BEGIN
+            INSERT INTO wish_fts (wish_fts, rowid, wish_text, description, scope)
+            VALUES ('delete', old.wish_id, {_fts_columns('old')});
+            INSERT INTO wish_fts (rowid, wish_text, description, scope)
+            VALUES (new.wish_id, {_fts_columns('new')});
+        END
+        ''',
+        "INSERT INTO wish_fts (wish_fts) VALUES ('rebuild')",
+    ]),
+    (6, 'Индекс для списка желаний группы', [
+        # get_group_wishes_page: ключи сортировки берутся из индекса без чтения строк желаний
+        'CREATE INDEX IF NOT EXISTS idx_wish_user_status_priority_price ON wish(user_id, status, priority, price)',
+    ]),
+    # Счётчики желаний по владельцам и чатам поддерживаются триггерами, поэтому количество желаний
+    # и статистика читаются одной строкой вместо COUNT/SUM по всем желаниям
+    (7, 'Счётчики желаний по пользователям и чатам', [
+        '''
+        CREATE TABLE IF NOT EXISTS wish_summary (
+            kind TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            active INTEGER NOT NULL DEFAULT 0,
+            completed INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0,
+            priced INTEGER NOT NULL DEFAULT 0,
+            price_sum REAL NOT NULL DEFAULT 0,
+            reserved INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, id)
+        ) WITHOUT ROWID
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_summary_insert AFTER INSERT ON wish BEGIN
+            {_summary_wish('new', '+')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_summary_delete AFTER DELETE ON wish BEGIN
+            {_summary_wish('old', '-')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS wish_summary_update AFTER UPDATE OF status, price, user_id, chat_id ON wish
+        WHEN old.status IS NOT new.status OR old.price IS NOT new.price
+             OR old.user_id != new.user_id OR old.chat_id != new.chat_id
+        BEGIN
+            {_summary_wish('old', '-')}
+            {_summary_wish('new', '+')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS reservation_summary_insert AFTER INSERT ON reservation BEGIN
+            {_summary_reservation('new', '+')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS reservation_summary_delete AFTER DELETE ON reservation BEGIN
+            {_summary_reservation('old', '-')}
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS reservation_summary_update AFTER UPDATE OF status, wish_id ON reservation
+        WHEN old.status IS NOT new.status OR old.wish_id != new.wish_id
+        BEGIN
+            {_summary_reservation('old', '-')}
+            {_summary_reservation('new', '+')}
+        END
+        ''',
+        f'INSERT INTO wish_summary (kind, id, {", ".join(SUMMARY_COLUMNS)}) {WISH_SUMMARY_SELECT}',
+    ]),
+    # Старые завершённые и отменённые желания вместе с резервированиями переносятся в архив
+    # (db_controller.archive_wishes), поэтому горячие таблицы и их индексы растут вместе с активными
+    # данными, а не с историей. Перенос - это удаление из wish: FTS и wish_summary описывают
+    # только горячие желания
+    (8, 'Архив желаний и резервирований', [
+        '''
+        CREATE TABLE IF NOT EXISTS wish_archive (
+            wish_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            wish_text TEXT NOT NULL,
+            description TEXT,
+            status TEXT,
+            priority INTEGER,
+            create_date TIMESTAMP,
+            complete_date TIMESTAMP,
+            image_url TEXT,
+            price REAL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_wish_archive_user_date ON wish_archive(user_id, create_date)',
+        'CREATE INDEX IF NOT EXISTS idx_wish_archive_chat_priority_date ON wish_archive(chat_id, priority, create_date)',
+        '''
+        CREATE TABLE IF NOT EXISTS reservation_archive (
+            reservation_id INTEGER PRIMARY KEY,
+            wish_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            reserved_at TIMESTAMP,
+            status TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_reservation_archive_wish ON reservation_archive(wish_id)',
+        'CREATE INDEX IF NOT EXISTS idx_reservation_archive_user ON reservation_archive(user_id)',
+        # Кандидаты в архив: частичный индекс только по завершённым и отменённым желаниям
+        '''
+        CREATE INDEX IF NOT EXISTS idx_wish_finished ON wish(COALESCE(complete_date, create_date))
+        WHERE status IN ('completed', 'cancelled')
+        ''',
+    ]),
+    (9, 'Индекс резервирований пользователя', [
+        # get_user_reservations без статуса и со статусом (сортировка по reserved_at берётся из индекса)
+        'CREATE INDEX IF NOT EXISTS idx_reservation_user_date ON reservation(user_id, reserved_at)',
+    ]),
+]
+
+
+def _ensure_version_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Получить текущую версию схемы (0 - схема ещё не создана)"""
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    ).fetchone()
+    if not row:
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применить недостающие миграции. Соединение должно быть в режиме autocommit.
+
+    Возвращает версию схемы после применения.
+    """
+    version = get_schema_version(conn)
+    latest = MIGRATIONS[-1][0]
+    if version >= latest:
+        return version
+
+    _ensure_version_table(conn)
+    for migration_version, description, steps in MIGRATIONS:
+        if migration_version <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Повторная проверка внутри транзакции: миграцию мог применить другой процесс
+            if get_schema_version(conn) >= migration_version:
+                conn.execute('ROLLBACK')
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (migration_version, description))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        logger.info('Применена миграция %s: %s', migration_version, description)
+    return latest
+
+
+def explain(conn: sqlite3.Connection, query: str, params=()) -> List[str]:
+    """Получить план выполнения запроса (EXPLAIN QUERY PLAN) в виде списка строк"""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+def find_table_scans(conn: sqlite3.Connection,
+                     queries: Mapping[str, Tuple[str, Sequence[Any]]]) -> Dict[str, List[str]]:
+    """Проверить планы запросов queries ({имя: (запрос, параметры)}, см. db_controller.hot_queries).
+
+    Возвращает запросы, в плане которых есть SCAN или временная сортировка.
+    """
+    problems = {}
+    for name, (query, params) in queries.items():
+        plan = explain(conn, query, params)
+        bad = [step for step in plan if step.startswith('SCAN') or 'USE TEMP B-TREE' in step]
+        if bad:
+            problems[name] = bad
+    return problems
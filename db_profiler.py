@@ -0,0 +1,219 @@
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Запросы, для которых запрашивается план выполнения (EXPLAIN QUERY PLAN)
+_EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?')
+_IN_LIST = re.compile(r'IN \(\?(?: ?, ?\?)*\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize(sql: str) -> str:
+    """Форма запроса: без лишних пробелов, литералы заменены на ?, списки IN (?, ?, ...) - на IN (...)"""
+    shape = _SPACES.sub(' ', sql).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    shape = shape.replace('( ', '(').replace(' )', ')').replace(' ,', ',')
+    return _IN_LIST.sub('IN (...)', shape)
+
+
+def has_full_scan(plan: List[str]) -> bool:
+    """Есть ли в плане полный просмотр таблицы (SCAN без индекса)"""
+    return any(step.startswith('SCAN ') and ' USING ' not in step for step in plan)
+
+
+class StatementStats:
+    """Накопленная статистика одной формы запроса"""
+    __slots__ = ('calls', 'seconds', 'max_seconds', 'slow', 'plan')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.slow = 0
+        self.plan: Optional[List[str]] = None
+
+
+class Profiler:
+    """Профилировщик запросов к SQLite.
+
+    Для каждой формы запроса (см. normalize) считает вызовы и суммарное время, включая
+    получение строк. План выполнения запрашивается один раз для каждой формы. Запросы
+    дольше slow_threshold секунд пишутся в лог и в журнал медленных запросов вместе с планом.
+    """
+
+    def __init__(self, slow_threshold: float = 0.1, slow_log_size: int = 100):
+        self.slow_threshold = slow_threshold
+        self._stats: Dict[str, StatementStats] = {}
+        self._slow: Deque[Dict[str, Any]] = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def _get(self, shape: str) -> StatementStats:
+        stats = self._stats.get(shape)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(shape, StatementStats())
+        return stats
+
+    def record(self, conn: sqlite3.Connection, sql: str, params, seconds: float, call: bool) -> StatementStats:
+        """Учесть время выполнения (call=True) или получения строк (call=False) запроса"""
+        shape = normalize(sql)
+        stats = self._get(shape)
+        if stats.plan is None:
+            stats.plan = self._explain(conn, sql, params)
+        with self._lock:
+            if call:
+                stats.calls += 1
+            stats.seconds += seconds
+        return stats
+
+    def record_slow(self, sql: str, stats: StatementStats, seconds: float):
+        """Записать медленный запрос в журнал"""
+        entry = {
+            'statement': normalize(sql),
+            'seconds': seconds,
+            'plan': stats.plan,
+            'at': time.time(),
+        }
+        with self._lock:
+            stats.slow += 1
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            self._slow.append(entry)
+        logger.warning('Медленный запрос (%.1f мс): %s\nПлан: %s', seconds * 1000, entry['statement'],
+                       '; '.join(stats.plan) or '-')
+
+    @staticmethod
+    def _explain(conn: sqlite3.Connection, sql: str, params) -> List[str]:
+        if not sql.lstrip().upper().startswith(_EXPLAINED):
+            return []
+        try:
+            # Обычный курсор, чтобы сам EXPLAIN не попадал в статистику
+            cursor = sqlite3.Connection.cursor(conn, sqlite3.Cursor)
+            rows = cursor.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        except sqlite3.Error as e:
+            return [f'(план недоступен: {e})']
+        return [row[3] for row in rows]
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Статистика по формам запросов, самые затратные по суммарному времени - первыми"""
+        with self._lock:
+            items = list(self._stats.items())
+        result = [{
+            'statement': shape,
+            'calls': stats.calls,
+            'seconds': stats.seconds,
+            'mean': stats.seconds / stats.calls if stats.calls else 0.0,
+            'slow': stats.slow,
+            'max_slow_seconds': stats.max_seconds,
+            'full_scan': has_full_scan(stats.plan or []),
+            'plan': stats.plan,
+        } for shape, stats in items]
+        result.sort(key=lambda row: row['seconds'], reverse=True)
+        return result
+
+    def slow_queries(self) -> List[Dict[str, Any]]:
+        """Журнал медленных запросов, последние - в конце"""
+        with self._lock:
+            return list(self._slow)
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+
+    def report(self, limit: int = 20) -> str:
+        """Текстовый отчёт: самые затратные формы запросов, полные просмотры таблиц отмечены *"""
+        lines = [f'{"всего, мс":>10} {"вызовов":>8} {"средн., мс":>10}  запрос']
+        for row in self.stats()[:limit]:
+            mark = '*' if row['full_scan'] else ' '
+            lines.append(f'{row["seconds"] * 1000:10.1f} {row["calls"]:8} {row["mean"] * 1000:10.3f} {mark}'
+                         f'{row["statement"]}')
+        return '\n'.join(lines)
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Курсор, передающий время выполнения запросов и получения строк в профилировщик соединения"""
+
+    _sql: Optional[str] = None
+    _params: Any = ()
+    _elapsed = 0.0
+    _logged = False
+
+    def _record(self, seconds: float, call: bool):
+        profiler = self.connection.profiler
+        stats = profiler.record(self.connection, self._sql, self._params, seconds, call)
+        self._elapsed += seconds
+        if not self._logged and self._elapsed >= profiler.slow_threshold:
+            self._logged = True
+            profiler.record_slow(self._sql, stats, self._elapsed)
+
+    def _start(self, sql: str, params):
+        self._sql = sql
+        self._params = params
+        self._elapsed = 0.0
+        self._logged = False
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(time.perf_counter() - started, True)
+
+    def executemany(self, sql, seq_of_parameters):
+        # План запрашивается без параметров: NULL вместо каждого ?
+        self._start(sql, (None,) * sql.count('?'))
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(time.perf_counter() - started, True)
+
+    def _fetch(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            if self._sql is not None:
+                self._record(time.perf_counter() - started, False)
+
+    def fetchone(self):
+        return self._fetch(sqlite3.Cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(sqlite3.Cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(sqlite3.Cursor.fetchall)
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """Соединение, все курсоры которого (в том числе у conn.execute) - ProfilingCursor.
+
+    Создаётся через sqlite3.connect(..., factory=ProfilingConnection), после чего
+    в атрибут profiler записывается профилировщик.
+    """
+
+    profiler: Profiler
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    # Connection.execute создаёт курсор в обход cursor(), поэтому переопределяется отдельно
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,138 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db_connection import ConnectionManager
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_local = threading.local()
+
+
+def after_commit(callback):
+    """Выполнить callback после коммита транзакции, в которой выполняется текущее изменение.
+
+    Вызывается из statement. Если изменение откатилось, callback не выполняется.
+    Вне очереди группового коммита callback выполняется сразу.
+    """
+    callbacks = getattr(_local, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+class WriteQueue:
+    """Групповой коммит изменений БД.
+
+    Изменения от разных обработчиков собираются в течение короткого окна и
+    фиксируются одной транзакцией на соединении-писателе. Каждое изменение
+    выполняется в своей точке сохранения (SAVEPOINT), поэтому ошибка одного
+    изменения не откатывает остальные, а вызывающий получает свой результат.
+    """
+
+    def __init__(self, manager: ConnectionManager, window: float = 0.002, max_batch: int = 256):
+        self._manager = manager
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-write-queue', daemon=True)
+        self._thread.start()
+
+    def submit(self, statement, *args, **kwargs) -> Future:
+        """Поставить изменение в очередь.
+
+        statement вызывается как statement(conn, *args, **kwargs) внутри общей транзакции.
+        Возвращаемый Future завершается результатом statement после коммита пачки.
+        """
+        future = Future()
+        self._queue.put((future, statement, args, kwargs))
+        return future
+
+    def close(self):
+        """Зафиксировать уже поставленные изменения и остановить поток записи"""
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    timeout = deadline - time.monotonic()
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._commit(batch)
+            except Exception as e:
+                # Ошибка одной пачки не должна останавливать поток записи: иначе все следующие изменения зависнут
+                logger.exception('Ошибка группового коммита')
+                self._fail(batch, e)
+
+    @staticmethod
+    def _fail(batch, error: BaseException):
+        """Завершить ошибкой error ещё не завершённые изменения пачки"""
+        for future, *_ in batch:
+            # Отменённые уже помечены set_running_or_notify_cancel, повторный вызов - RuntimeError
+            if future.done():
+                continue
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _commit(self, batch):
+        """Выполнить пачку изменений в одной транзакции и раздать результаты"""
+        outcomes = []
+        callbacks = []
+        try:
+            with self._manager.writer() as conn:
+                for future, statement, args, kwargs in batch:
+                    if not future.set_running_or_notify_cancel():
+                        outcomes.append(None)
+                        continue
+                    conn.execute('SAVEPOINT mutation')
+                    _local.callbacks = []
+                    try:
+                        result = statement(conn, *args, **kwargs)
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO mutation')
+                        conn.execute('RELEASE mutation')
+                        outcomes.append((False, e))
+                    else:
+                        conn.execute('RELEASE mutation')
+                        outcomes.append((True, result))
+                        callbacks.extend(_local.callbacks)
+                    finally:
+                        _local.callbacks = None
+        except Exception as e:
+            # Не удалось зафиксировать транзакцию - ошибка у всех участников пачки
+            self._fail(batch, e)
+            return
+
+        # Колбэки выполняются до выдачи результатов, чтобы вызывающий уже видел их эффект
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('Ошибка в обработчике after_commit')
+
+        for (future, *_), outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue
+            ok, value = outcome
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
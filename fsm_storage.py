@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import db_async
+
+logger = logging.getLogger(__name__)
+
+# Данные длиннее этого порога (в байтах) сжимаются перед записью в БД
+COMPRESS_THRESHOLD = 512
+
+
+def encode_data(data: Mapping[str, Any]) -> Optional[Any]:
+    """Закодировать данные FSM: компактный JSON, длинные значения - в сжатом виде (BLOB)"""
+    if not data:
+        return None
+    encoded = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    raw = encoded.encode()
+    if len(raw) > COMPRESS_THRESHOLD:
+        return zlib.compress(raw)
+    return encoded
+
+
+def decode_data(value: Any) -> Dict[str, Any]:
+    """Раскодировать данные FSM, сохранённые encode_data"""
+    if value is None:
+        return {}
+    if isinstance(value, bytes):
+        value = zlib.decompress(value).decode()
+    return json.loads(value)
+
+
+def build_key(key: StorageKey) -> str:
+    """Строковый ключ записи FSM"""
+    return (f'{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ""}:'
+            f'{key.business_connection_id or ""}:{key.destiny}')
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'touched_at')
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.touched_at = time.monotonic()
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в SQLite.
+
+    Перед БД стоит LRU-кэш ограниченного размера. Изменения пишутся в БД не сразу,
+    а пачкой раз в flush_interval секунд (write-behind). Чаты, не активные дольше
+    idle_ttl секунд, вытесняются из памяти, а записи старше expire_after секунд
+    удаляются из БД.
+    """
+
+    def __init__(self, max_size: int = 10000, idle_ttl: float = 1800, flush_interval: float = 1.0,
+                 expire_after: Optional[float] = 30 * 24 * 3600):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.expire_after = expire_after
+        self._cache: 'OrderedDict[str, _Entry]' = OrderedDict()
+        # Изменённые записи, ещё не записанные в БД (в том числе уже вытесненные из кэша)
+        self._dirty: Dict[str, _Entry] = {}
+        # Записи, которые сейчас записываются в БД: до окончания записи читаются отсюда,
+        # иначе вытесненный из кэша чат прочитал бы из БД предыдущее состояние
+        self._in_flight: Dict[str, _Entry] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._last_expire = 0.0
+
+    async def _get_entry(self, key: StorageKey) -> _Entry:
+        str_key = build_key(key)
+        entry = self._cache.get(str_key)
+        if entry is not None:
+            self._cache.move_to_end(str_key)
+        else:
+            entry = self._dirty.get(str_key) or self._in_flight.get(str_key)
+            if entry is None:
+                record = await db_async.get_fsm_record(str_key)
+                entry = _Entry(record[0], decode_data(record[1])) if record else _Entry(None, {})
+            # Пока шёл запрос, запись могла появиться в кэше
+            entry = self._cache.setdefault(str_key, entry)
+            self._evict()
+        entry.touched_at = time.monotonic()
+        return entry
+
+    def preload(self, records: Iterable[Tuple[str, Optional[str], Dict[str, Any]]]):
+        """Заранее загрузить в кэш записи (строковый ключ, состояние, раскодированные данные), новые
+        сначала, - например, недавно активные чаты после перезапуска. Записи, уже загруженные
+        обработчиками, не заменяются
+        """
+        for str_key, state, data in itertools.islice(records, self.max_size):
+            if str_key in self._cache or str_key in self._dirty or str_key in self._in_flight:
+                continue
+            self._cache[str_key] = _Entry(state, data)
+            # В начало: предзагруженные вытесняются раньше загруженных обработчиками, старые - раньше новых
+            self._cache.move_to_end(str_key, last=False)
+        self._evict()
+
+    def _mark_dirty(self, key: StorageKey, entry: _Entry):
+        self._dirty[build_key(key)] = entry
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _evict(self):
+        """Вытеснить из памяти давно неактивные чаты и лишние записи сверх max_size"""
+        deadline = time.monotonic() - self.idle_ttl
+        while self._cache:
+            str_key, entry = next(iter(self._cache.items()))
+            if len(self._cache) <= self.max_size and entry.touched_at >= deadline:
+                break
+            # Несохранённые записи остаются в _dirty до ближайшей записи в БД
+            del self._cache[str_key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._get_entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = await self._get_entry(key)
+        return entry.state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f'Data must be a dict, not {type(data).__name__}')
+        entry = await self._get_entry(key)
+        entry.data = data.copy()
+        self._mark_dirty(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = await self._get_entry(key)
+        return entry.data.copy()
+
+    async def flush(self):
+        """Записать накопленные изменения в БД одной пачкой"""
+        # Пачки пишутся по одной (flush из close может совпасть с фоновой записью)
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            self._in_flight = dirty
+            now = time.time()
+            records = []
+            for str_key, entry in dirty.items():
+                try:
+                    records.append((str_key, entry.state, encode_data(entry.data), now))
+                except (TypeError, ValueError):
+                    logger.exception('Не удалось сохранить данные FSM для %s', str_key)
+            saved = False
+            try:
+                saved = await db_async.save_fsm_records(records)
+            finally:
+                if not saved:
+                    # Вернём записи в очередь, если после снимка их не изменили повторно
+                    for str_key, entry in dirty.items():
+                        self._dirty.setdefault(str_key, entry)
+                self._in_flight = {}
+            if not saved:
+                logger.error('Не удалось записать %s состояний FSM в БД', len(records))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                self._evict()
+                await self._expire()
+            except Exception:
+                logger.exception('Ошибка фоновой записи состояний FSM')
+
+    async def _expire(self):
+        """Удалить из БД состояния чатов, не активных дольше expire_after (не чаще раза в час)"""
+        if self.expire_after is None or time.monotonic() - self._last_expire < 3600:
+            return
+        self._last_expire = time.monotonic()
+        removed = await db_async.delete_expired_fsm_records(time.time() - self.expire_after)
+        if removed:
+            logger.info('Удалено %s устаревших состояний FSM', removed)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
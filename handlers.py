@@ -1,9 +1,19 @@
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 
+import db_async
 import db_controller
+import page_cache
+import renderer
+import send_scheduler
+import wishlist_io
+from records import Wish
 from states import *
 
 router = Router()
@@ -12,20 +22,16 @@ router = Router()
 @router.message(Command(commands=["start"]))
 async def start(message: Message):
     # Добавляем пользователя в БД если его еще нет
-    user_exists = db_controller.user_exists(message.from_user.id)
+    user_exists = await db_async.user_exists(message.from_user.id)
     if not user_exists:
-        db_controller.add_user(
+        await db_async.add_user(
             user_id=message.from_user.id,
             username=message.from_user.username,
             first_name=message.from_user.first_name,
             last_name=message.from_user.last_name
         )
     
-    main_menu = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎁 Добавить желание", callback_data="add_wish_start")],
-        [InlineKeyboardButton(text="📋 Посмотреть мои желания", callback_data="show_my_wishes")]
-    ])
-    await message.answer("Добро пожаловать в WishList! 🎉", reply_markup=main_menu)
+    await message.answer("Добро пожаловать в WishList! 🎉", reply_markup=renderer.MAIN_MENU_KB)
 
 
 # ============== Get User Wishes Command ==============
@@ -40,18 +46,20 @@ async def get_wish_list(message: Message, state: FSMContext):
         return
     
     username = args[1]
+    if message.chat.type != "private":
+        await register_group_member(message)
     
     # Ищем пользователя по username
-    target_user = db_controller.get_user_by_username(username)
+    target_user = await db_async.get_user_by_username(username)
     
     if not target_user:
         await message.answer(f"❌ Пользователь {username} не найден 😔")
         return
     
-    # Получаем желания пользователя
-    wishes = db_controller.get_user_wishes(target_user['user_id'])
+    # Проверяем, есть ли у пользователя желания
+    wishes_count = await db_async.count_user_wishes(target_user.user_id)
     
-    if not wishes:
+    if not wishes_count:
         await message.answer(
             f"📋 У пользователя {username} еще нет желаний 😔"
         )
@@ -66,12 +74,13 @@ async def get_wish_list(message: Message, state: FSMContext):
             parse_mode="HTML"
         )
         
-        # Сохраняем данные в состояние и показываем список
+        # Сохраняем в состояние только владельца списка и позицию, страницы читаются из БД
         await state.update_data(
-            wishes_list=wishes, 
-            current_page=0, 
+            wishes_owner_id=target_user.user_id,
+            current_page=0,
+            page_cursor=None,
             is_owner=False,
-            target_username=username
+            target_username=f"@{target_user.username}"
         )
         await state.set_state(ViewWishStates.viewing_other_wishes)
         
@@ -80,11 +89,11 @@ async def get_wish_list(message: Message, state: FSMContext):
             def __init__(self, msg):
                 self.message = msg
                 self.from_user = message.from_user
-            async def answer(self):
+            async def answer(self, *args, **kwargs):
                 pass
         
         fake_callback = FakeCallback(sent_message)
-        await show_wishes_page_other(fake_callback, state, 0, username)
+        await show_wishes_page_other(fake_callback, state, 0, f"@{target_user.username}")
         
         # Ответ в группе
         await message.reply(
@@ -94,6 +103,109 @@ async def get_wish_list(message: Message, state: FSMContext):
         await message.answer(f"❌ Ошибка при отправке: {str(e)}")
 
 
+# ============== Search Command ==============
+@router.message(Command(commands=["search"]))
+async def search(message: Message):
+    """Поиск желаний: в личке - свои и из групп пользователя, в группе - добавленные в этой группе"""
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer("❌ Использование: /search текст")
+        return
+
+    query = args[1]
+    if message.chat.type == "private":
+        wishes = await db_async.search_wishes(query, user_id=message.from_user.id, member_id=message.from_user.id)
+    else:
+        await register_group_member(message)
+        wishes = await db_async.search_wishes(query, chat_id=message.chat.id)
+    await message.answer(renderer.render_search_results(query, wishes), parse_mode="HTML",
+                         reply_markup=renderer.MAIN_MENU_KB)
+
+
+# ============== Group Wishes Command ==============
+GROUP_WISHES_PER_PAGE = 10
+
+
+async def register_group_member(message: Message):
+    """Запомнить группу и автора сообщения как её участника (проверки идут через кэш, запись - только новых)"""
+    chat_id, user_id = message.chat.id, message.from_user.id
+    if not await db_async.group_exists(chat_id):
+        await db_async.add_group(chat_id, message.chat.title or str(chat_id))
+    if not await db_async.is_group_member(chat_id, user_id):
+        await db_async.add_group_member(chat_id, user_id)
+
+
+async def render_group_page(group_id: int, title: str, sort: str, page: int,
+                            cursor: Optional[Tuple[float, int]] = None, backward: bool = False):
+    """Загрузить и отрисовать страницу желаний группы"""
+    limit = GROUP_WISHES_PER_PAGE
+    # Вперёд читаем на одно желание больше - так известно, есть ли следующая страница
+    wishes = await db_async.get_group_wishes_page(group_id, limit if backward else limit + 1, sort, cursor, backward)
+    if backward and not wishes:
+        # Предыдущие желания удалены - показываем первую страницу
+        return await render_group_page(group_id, title, sort, 0)
+    has_next = backward or len(wishes) > limit
+    return renderer.render_group_wishes_page(title, wishes[:limit], page, limit, sort, has_next)
+
+
+@router.message(Command(commands=["group_wishes"]))
+async def group_wishes(message: Message):
+    """Активные желания всех участников группы: /group_wishes [price]"""
+    if message.chat.type == "private":
+        await message.answer("❌ Команда работает только в группах")
+        return
+
+    await register_group_member(message)
+    args = message.text.split()
+    sort = args[1] if len(args) > 1 and args[1] in db_controller.GROUP_WISH_SORTS else "priority"
+    text, keyboard = await render_group_page(message.chat.id, message.chat.title, sort, 0)
+    await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("group_wishes_"))
+async def page_group_wishes(callback: CallbackQuery):
+    """Переключить страницу или сортировку желаний группы (ключ страницы - в callback_data)"""
+    _, _, sort, page, direction, key, wish_id = callback.data.split("_")
+    if sort not in db_controller.GROUP_WISH_SORTS:
+        await callback.answer()
+        return
+
+    cursor = (float(key), int(wish_id)) if key else None
+    chat = callback.message.chat
+    text, keyboard = await render_group_page(chat.id, chat.title, sort, int(page), cursor, direction == "p")
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
+# ============== Export Command ==============
+@router.message(Command(commands=["export"]))
+async def export_data(message: Message, owner_id: Optional[int] = None):
+    """Выгрузить таблицу файлом: /export users|wishes|reservations [csv]. Только для владельца бота"""
+    if owner_id is None or message.from_user.id != owner_id:
+        await message.answer("❌ Команда доступна только владельцу бота")
+        return
+
+    args = message.text.split()
+    tables = "|".join(db_controller.BULK_TABLES)
+    if len(args) < 2 or args[1] not in db_controller.BULK_TABLES:
+        await message.answer(f"❌ Использование: /export {tables} [csv]")
+        return
+
+    table = args[1]
+    fmt = "csv" if len(args) > 2 and args[2] == "csv" else "jsonl"
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}.gz")
+    os.close(fd)
+    try:
+        count = await db_async.run_bulk(wishlist_io.export_file, table, path)
+        with send_scheduler.bulk():
+            await message.answer_document(
+                FSInputFile(path, filename=f"{table}.{fmt}.gz"),
+                caption=f"📦 {table}: {count} строк"
+            )
+    finally:
+        os.remove(path)
+
+
 # ============== Add Wish Flow ==============
 @router.callback_query(F.data == "add_wish_start")
 async def add_wish_start(callback: CallbackQuery, state: FSMContext):
@@ -114,14 +226,10 @@ async def wish_text_received(message: Message, state: FSMContext):
     
     await state.update_data(wish_text=message.text)
     await state.set_state(AddWishStates.waiting_for_description)
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Пропустить", callback_data="skip_description")]
-    ])
     await message.answer(
         f"✅ Записал: \"{message.text}\"\n\n"
         "📝 Добавьте описание (опционально) или нажмите 'Пропустить':",
-        reply_markup=keyboard
+        reply_markup=renderer.SKIP_DESCRIPTION_KB
     )
 
 
@@ -131,16 +239,9 @@ async def skip_description(callback: CallbackQuery, state: FSMContext):
     await state.update_data(description=None)
     await state.set_state(AddWishStates.waiting_for_priority)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="1⭐", callback_data="priority_1"),
-         InlineKeyboardButton(text="2⭐", callback_data="priority_2"),
-         InlineKeyboardButton(text="3⭐", callback_data="priority_3")],
-        [InlineKeyboardButton(text="4⭐", callback_data="priority_4"),
-         InlineKeyboardButton(text="5⭐", callback_data="priority_5")]
-    ])
     await callback.message.edit_text(
         "⭐ Выберите приоритет желания (1 = низкий, 5 = высокий):",
-        reply_markup=keyboard
+        reply_markup=renderer.PRIORITY_KB
     )
     await callback.answer()
 
@@ -153,16 +254,9 @@ async def description_received(message: Message, state: FSMContext):
     
     await state.set_state(AddWishStates.waiting_for_priority)
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="1⭐", callback_data="priority_1"),
-         InlineKeyboardButton(text="2⭐", callback_data="priority_2"),
-         InlineKeyboardButton(text="3⭐", callback_data="priority_3")],
-        [InlineKeyboardButton(text="4⭐", callback_data="priority_4"),
-         InlineKeyboardButton(text="5⭐", callback_data="priority_5")]
-    ])
     await message.answer(
         "⭐ Выберите приоритет желания (1 = низкий, 5 = высокий):",
-        reply_markup=keyboard
+        reply_markup=renderer.PRIORITY_KB
     )
 
 
@@ -172,14 +266,10 @@ async def priority_selected(callback: CallbackQuery, state: FSMContext):
     priority = int(callback.data.split("_")[1])
     await state.update_data(priority=priority)
     await state.set_state(AddWishStates.waiting_for_price)
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Пропустить", callback_data="skip_price")]
-    ])
     await callback.message.edit_text(
         f"✅ Приоритет установлен на {priority}⭐\n\n"
         "💰 Укажите стоимость в рублях (опционально) или нажмите 'Пропустить':",
-        reply_markup=keyboard
+        reply_markup=renderer.SKIP_PRICE_KB
     )
     await callback.answer()
 
@@ -226,16 +316,11 @@ async def confirm_wish_data(obj: Message | CallbackQuery, state: FSMContext):
         f"Все правильно?"
     )
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Сохранить", callback_data="confirm_save_wish"),
-         InlineKeyboardButton(text="❌ Отменить", callback_data="cancel_wish")]
-    ])
-    
     if isinstance(obj, CallbackQuery):
-        await obj.message.edit_text(confirmation_text, reply_markup=keyboard)
+        await obj.message.edit_text(confirmation_text, reply_markup=renderer.CONFIRM_WISH_KB)
         await obj.answer()
     else:
-        await obj.answer(confirmation_text, reply_markup=keyboard)
+        await obj.answer(confirmation_text, reply_markup=renderer.CONFIRM_WISH_KB)
     
     await state.set_state(AddWishStates.confirm_wish)
 
@@ -246,11 +331,12 @@ async def save_wish(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     
     try:
-        wish_id = db_controller.add_wish(
+        wish_id = await db_async.add_wish(
             user_id=callback.from_user.id,
             chat_id=callback.message.chat.id,
-            wish_text=data["wish_text"],
-            description=data.get("description"),
+            # Текст хранится уже экранированным для HTML, чтобы не экранировать его при каждом показе
+            wish_text=renderer.escape(data["wish_text"]),
+            description=renderer.escape(data.get("description")),
             priority=data.get("priority", 3),
             price=data.get("price")
         )
@@ -260,12 +346,7 @@ async def save_wish(callback: CallbackQuery, state: FSMContext):
                 f"✅ Желание успешно добавлено! (ID: {wish_id})\n\n"
                 "Вы можете добавить еще одно желание или вернуться в главное меню."
             )
-            
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="➕ Добавить еще", callback_data="add_wish_start")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
-            await callback.message.edit_reply_markup(reply_markup=keyboard)
+            await callback.message.edit_reply_markup(reply_markup=renderer.AFTER_SAVE_KB)
         else:
             await callback.message.edit_text("❌ Ошибка при сохранении желания. Попробуйте снова.")
     except Exception as e:
@@ -280,11 +361,8 @@ async def cancel_wish(callback: CallbackQuery, state: FSMContext):
     """Отмена добавления желания"""
     await state.clear()
     
-    main_menu = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎁 Добавить желание", callback_data="add_wish_start")],
-        [InlineKeyboardButton(text="📋 Посмотреть мои желания", callback_data="show_my_wishes")]
-    ])
-    await callback.message.edit_text("❌ Добавление желания отменено.\n\nЧто вы хотите сделать?", reply_markup=main_menu)
+    await callback.message.edit_text("❌ Добавление желания отменено.\n\nЧто вы хотите сделать?",
+                                     reply_markup=renderer.MAIN_MENU_KB)
     await callback.answer()
 
 
@@ -292,157 +370,130 @@ async def cancel_wish(callback: CallbackQuery, state: FSMContext):
 async def main_menu(callback: CallbackQuery, state: FSMContext):
     """Возврат в главное меню"""
     await state.clear()
-    
-    main_menu_kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🎁 Добавить желание", callback_data="add_wish_start")],
-        [InlineKeyboardButton(text="📋 Посмотреть мои желания", callback_data="show_my_wishes")]
-    ])
-    await callback.message.edit_text("Главное меню:", reply_markup=main_menu_kb)
+    await callback.message.edit_text("Главное меню:", reply_markup=renderer.MAIN_MENU_KB)
     await callback.answer()
 
 
 # ============== View Wishes Flow ==============
 WISHES_PER_PAGE = 5
 
+
+async def load_wishes_page(state: FSMContext, page: int) -> Tuple[List[Wish], int, int]:
+    """Загрузить из БД страницу желаний, используя курсор из FSM.
+
+    В FSM хранятся только владелец списка, номер текущей страницы и ключи (create_date, wish_id)
+    её первого и последнего желания. Соседние страницы читаются по ключу без OFFSET.
+    Возвращает (желания страницы, номер страницы, всего желаний).
+    """
+    data = await state.get_data()
+    owner_id = data["wishes_owner_id"]
+    total = await db_async.count_user_wishes(owner_id)
+    if not total:
+        return [], 0, 0
+    
+    total_pages = (total + WISHES_PER_PAGE - 1) // WISHES_PER_PAGE
+    page = min(max(page, 0), total_pages - 1)
+    
+    current_page = data.get("current_page", 0)
+    page_cursor = data.get("page_cursor")
+    wishes = []
+    if page_cursor:
+        first_key, last_key = page_cursor
+        if page == current_page + 1:
+            wishes = await db_async.get_user_wishes_page(owner_id, WISHES_PER_PAGE, cursor=last_key)
+        elif page == current_page - 1:
+            wishes = await db_async.get_user_wishes_page(owner_id, WISHES_PER_PAGE, cursor=first_key,
+                                                         backward=True)
+        elif page == current_page:
+            wishes = await db_async.get_user_wishes_page(owner_id, WISHES_PER_PAGE, cursor=first_key,
+                                                         inclusive=True)
+    
+    if not wishes:
+        # Курсора для этой страницы нет (первый показ или кнопка из старого сообщения) - читаем с начала
+        wishes = await db_async.get_user_wishes_page(owner_id, WISHES_PER_PAGE * (page + 1))
+        wishes = wishes[page * WISHES_PER_PAGE:]
+    
+    if wishes:
+        await state.update_data(current_page=page, page_cursor=get_page_cursor(wishes))
+    return wishes, page, total
+
+
+def get_page_cursor(wishes: List[Wish]) -> List[Tuple[str, int]]:
+    """Ключи (create_date, wish_id) первого и последнего желания страницы.
+
+    В FSM ключи сохраняются массивами без имён полей: [[create_date, wish_id], [create_date, wish_id]]
+    """
+    return [wishes[0].key, wishes[-1].key]
+
+
+async def show_cached_page(callback: CallbackQuery, state: FSMContext, rendered: page_cache.RenderedPage):
+    """Показать страницу из кэша отрисовки, переставив на неё курсор FSM"""
+    await state.update_data(current_page=rendered.page, page_cursor=rendered.page_cursor)
+    await callback.message.edit_text(rendered.text, reply_markup=rendered.keyboard, parse_mode="HTML")
+    await callback.answer()
+
+
 @router.callback_query(F.data == "show_my_wishes")
 async def show_my_wishes(callback: CallbackQuery, state: FSMContext):
     """Показать все желания пользователя"""
     user_id = callback.from_user.id
-    wishes = db_controller.get_user_wishes(user_id)
+    wishes_count = await db_async.count_user_wishes(user_id)
     
-    if not wishes:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🎁 Добавить желание", callback_data="add_wish_start")],
-            [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-        ])
+    if not wishes_count:
         await callback.message.edit_text(
             "📋 У вас еще нет желаний.\n\n"
             "Создайте первое желание и оно появится здесь!",
-            reply_markup=keyboard
+            reply_markup=renderer.NO_WISHES_KB
         )
         await callback.answer()
         return
     
-    # Сохраняем список желаний и показываем первую страницу
-    await state.update_data(wishes_list=wishes, current_page=0, is_owner=True)
+    # Сохраняем владельца списка и показываем первую страницу
+    await state.update_data(wishes_owner_id=user_id, current_page=0, page_cursor=None, is_owner=True)
     await state.set_state(ViewWishStates.viewing_wishes)
     await show_wishes_page(callback, state, 0, is_owner=True)
 
 
 async def show_wishes_page(callback: CallbackQuery, state: FSMContext, page: int, is_owner: bool = True):
     """Показать страницу со списком желаний. is_owner=True показывает кнопки удаления"""
-    data = await state.get_data()
-    wishes = data.get("wishes_list", [])
-    
-    if not wishes:
-        return
-    
-    # Вычисляем индексы для этой страницы
-    start_idx = page * WISHES_PER_PAGE
-    end_idx = start_idx + WISHES_PER_PAGE
-    page_wishes = wishes[start_idx:end_idx]
-    total_pages = (len(wishes) + WISHES_PER_PAGE - 1) // WISHES_PER_PAGE
-    
-    # Формируем список желаний
-    title = "📋 <b>Ваши желания:</b>\n\n" if is_owner else "📋 <b>Желания:</b>\n\n"
-    wishes_text = title
-    for idx, wish in enumerate(page_wishes, 1):
-        wish_number = start_idx + idx
-        priority_stars = "⭐" * wish["priority"]
-        price_text = f"₽{wish['price']:.2f}" if wish["price"] else "—"
-        
-        wishes_text += (
-            f"{wish_number}. <b>{wish['wish_text']}</b>\n"
-            f"   🌟 {priority_stars} | 💰 {price_text} | 📅 {wish['status']}\n"
-        )
-        if wish["description"]:
-            # Обрезаем длинное описание
-            desc = wish["description"][:40] + "..." if len(wish["description"]) > 40 else wish["description"]
-            wishes_text += f"   📝 {desc}\n"
-        wishes_text += "\n"
-    
-    # Кнопки удаления (только для владельца)
-    keyboard_buttons = []
-    if is_owner:
-        for idx, wish in enumerate(page_wishes):
-            wish_number = start_idx + idx + 1
-            keyboard_buttons.append([
-                InlineKeyboardButton(text=f"🗑️ Удалить #{wish_number}", callback_data=f"wish_delete_{wish['wish_id']}")
-            ])
-    
-    # Кнопки навигации между страницами
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_wishes_{page - 1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"page_wishes_{page + 1}"))
-    
-    if nav_buttons:
-        keyboard_buttons.append(nav_buttons)
-    
-    # Главное меню
-    keyboard_buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")])
-    
-    # Добавляем информацию о странице если страниц больше одной
-    if total_pages > 1:
-        wishes_text += f"\n📄 Страница {page + 1} из {total_pages}"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    await callback.message.edit_text(wishes_text, reply_markup=keyboard, parse_mode="HTML")
-    await callback.answer()
+    await show_page(callback, state, page, "owner" if is_owner else "guest")
 
 
 async def show_wishes_page_other(callback: CallbackQuery, state: FSMContext, page: int, username: str):
     """Показать страницу со списком желаний другого пользователя (без кнопок удаления)"""
+    await show_page(callback, state, page, "other", username)
+
+
+async def show_page(callback: CallbackQuery, state: FSMContext, page: int, role: str,
+                    username: Optional[str] = None):
+    """Показать страницу списка желаний в роли role (см. renderer.ROLES)"""
     data = await state.get_data()
-    wishes = data.get("wishes_list", [])
+    owner_id = data["wishes_owner_id"]
     
-    if not wishes:
+    # Страница этой версии списка уже отрисована - не обращаемся к БД
+    version = page_cache.list_version(owner_id)
+    rendered = page_cache.get_page(owner_id, role, page, version)
+    if rendered:
+        await show_cached_page(callback, state, rendered)
         return
     
-    # Вычисляем индексы для этой страницы
-    start_idx = page * WISHES_PER_PAGE
-    end_idx = start_idx + WISHES_PER_PAGE
-    page_wishes = wishes[start_idx:end_idx]
-    total_pages = (len(wishes) + WISHES_PER_PAGE - 1) // WISHES_PER_PAGE
-    
-    # Формируем список желаний
-    wishes_text = f"📋 <b>Желания пользователя {username}:</b>\n\n"
-    for idx, wish in enumerate(page_wishes, 1):
-        wish_number = start_idx + idx
-        priority_stars = "⭐" * wish["priority"]
-        price_text = f"₽{wish['price']:.2f}" if wish["price"] else "—"
-        
-        wishes_text += (
-            f"{wish_number}. <b>{wish['wish_text']}</b>\n"
-            f"   🌟 {priority_stars} | 💰 {price_text} | 📅 {wish['status']}\n"
-        )
-        if wish["description"]:
-            # Обрезаем длинное описание
-            desc = wish["description"][:40] + "..." if len(wish["description"]) > 40 else wish["description"]
-            wishes_text += f"   📝 {desc}\n"
-        wishes_text += "\n"
-    
-    # Кнопки навигации между страницами (без кнопок удаления)
-    keyboard_buttons = []
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"page_other_wishes_{page - 1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"page_other_wishes_{page + 1}"))
-    
-    if nav_buttons:
-        keyboard_buttons.append(nav_buttons)
-    
-    # Главное меню
-    keyboard_buttons.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")])
-    
-    # Добавляем информацию о странице если страниц больше одной
-    if total_pages > 1:
-        wishes_text += f"\n📄 Страница {page + 1} из {total_pages}"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-    await callback.message.edit_text(wishes_text, reply_markup=keyboard, parse_mode="HTML")
+    requested_page = page
+    page_wishes, page, total = await load_wishes_page(state, page)
+    
+    if not page_wishes:
+        await callback.answer("📋 Список желаний пуст")
+        return
+    
+    # Отметки о резервировании для всей страницы - одним запросом, а не запросом на каждое желание
+    reservations = None
+    if renderer.shows_reservations(role):
+        reservations = await db_async.get_active_reservations([wish.wish_id for wish in page_wishes])
+    
+    text, keyboard = renderer.render_wishes_page(role, page_wishes, page, total, WISHES_PER_PAGE, username,
+                                                 reservations)
+    page_cache.put_page(owner_id, role, requested_page, version,
+                        page_cache.RenderedPage(text, keyboard, page, get_page_cursor(page_wishes)))
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
     await callback.answer()
 
 
@@ -452,7 +503,6 @@ async def page_other_wishes(callback: CallbackQuery, state: FSMContext):
     page = int(callback.data.split("_")[3])
     data = await state.get_data()
     username = data.get("target_username")
-    await state.update_data(current_page=page)
     await show_wishes_page_other(callback, state, page, username)
 
 
@@ -462,7 +512,6 @@ async def page_wishes(callback: CallbackQuery, state: FSMContext):
     page = int(callback.data.split("_")[2])
     data = await state.get_data()
     is_owner = data.get("is_owner", True)
-    await state.update_data(current_page=page)
     await show_wishes_page(callback, state, page, is_owner=is_owner)
 
 
@@ -470,7 +519,7 @@ async def page_wishes(callback: CallbackQuery, state: FSMContext):
 async def wish_delete_confirm(callback: CallbackQuery, state: FSMContext):
     """Подтверждение удаления желания"""
     wish_id = int(callback.data.split("_")[2])
-    wish = db_controller.get_wish(wish_id)
+    wish = await db_async.get_wish(wish_id)
     
     if not wish:
         await callback.answer("❌ Желание не найдено", show_alert=True)
@@ -481,16 +530,11 @@ async def wish_delete_confirm(callback: CallbackQuery, state: FSMContext):
     
     confirm_text = (
         f"⚠️ <b>Вы уверены, что хотите удалить это желание?</b>\n\n"
-        f"🎁 <b>{wish['wish_text']}</b>\n\n"
+        f"🎁 <b>{wish.wish_text}</b>\n\n"
         f"Это действие нельзя отменить!"
     )
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, удалить", callback_data="confirm_delete_wish"),
-         InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_delete_wish")]
-    ])
-    
-    await callback.message.edit_text(confirm_text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.message.edit_text(confirm_text, reply_markup=renderer.CONFIRM_DELETE_KB, parse_mode="HTML")
     await callback.answer()
 
 
@@ -500,32 +544,21 @@ async def confirm_delete_wish(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     wish_id = data.get("wish_to_delete")
     
-    if db_controller.delete_wish(wish_id):
+    if await db_async.delete_wish(wish_id):
         await callback.answer("✅ Желание удалено!", show_alert=False)
         
-        # Обновляем список желаний
+        # Показываем ту же страницу (load_wishes_page сам перейдёт на предыдущую, если эта опустела)
         user_id = callback.from_user.id
-        remaining_wishes = db_controller.get_user_wishes(user_id)
+        remaining_count = await db_async.count_user_wishes(user_id)
         
-        if remaining_wishes:
-            # Проверяем, нужно ли переходить на предыдущую страницу
+        if remaining_count:
             current_page = data.get("current_page", 0)
-            total_pages = (len(remaining_wishes) + WISHES_PER_PAGE - 1) // WISHES_PER_PAGE
-            
-            if current_page >= total_pages:
-                current_page = total_pages - 1
-            
-            await state.update_data(wishes_list=remaining_wishes, current_page=current_page)
             await state.set_state(ViewWishStates.viewing_wishes)
             await show_wishes_page(callback, state, current_page)
         else:
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🎁 Добавить желание", callback_data="add_wish_start")],
-                [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-            ])
             await callback.message.edit_text(
                 "📋 У вас больше нет желаний.",
-                reply_markup=keyboard
+                reply_markup=renderer.NO_WISHES_KB
             )
             await state.clear()
     else:
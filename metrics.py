@@ -0,0 +1,260 @@
+import bisect
+import contextvars
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Router
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени (с)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Метка событий, для которых не нашлось обработчика
+UNHANDLED = 'unhandled'
+
+
+class Histogram:
+    """Гистограмма времени с фиксированными корзинами (как histogram в Prometheus)"""
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля: верхняя граница корзины, в которую он попадает"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        total = 0
+        for index, count in enumerate(self.counts):
+            total += count
+            if total >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else float('inf')
+        return float('inf')
+
+
+class HandlerStats:
+    """Счётчики одного обработчика: вызовы, ошибки, время и его доля в БД и Telegram API"""
+    __slots__ = ('errors', 'latency', 'db_seconds', 'api_seconds')
+
+    def __init__(self):
+        self.errors = 0
+        self.latency = Histogram()
+        self.db_seconds = 0.0
+        self.api_seconds = 0.0
+
+
+class _Sample:
+    """Замер текущего события: обработчик и накопленное время в БД и Telegram API"""
+    __slots__ = ('handler', 'db_seconds', 'api_seconds')
+
+    def __init__(self):
+        self.handler = UNHANDLED
+        self.db_seconds = 0.0
+        self.api_seconds = 0.0
+
+
+_sample: contextvars.ContextVar[Optional[_Sample]] = contextvars.ContextVar('metrics_sample', default=None)
+
+_handlers: Dict[str, HandlerStats] = {}
+_requests: Dict[str, Histogram] = {}
+_collectors: List[Tuple[str, Optional[str], Callable[[], Dict[str, Any]]]] = []
+
+
+def add_db_time(seconds: float):
+    """Учесть время запроса к БД в замере текущего события"""
+    sample = _sample.get()
+    if sample is not None:
+        sample.db_seconds += seconds
+
+
+def add_collector(name: str, func: Callable[[], Dict[str, Any]], label: Optional[str] = None):
+    """Добавить к метрикам значения func() (например, статистику очередей или кэшей).
+
+    func возвращает {показатель: число}, а если задан label - {значение метки: {показатель: число}}.
+    """
+    _collectors.append((name, label, func))
+
+
+def reset():
+    """Сбросить накопленные метрики"""
+    _handlers.clear()
+    _requests.clear()
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Замер времени обработки событий роутера (outer middleware).
+
+    Внешний middleware видит и события, не дошедшие до обработчика, но ещё не знает,
+    какой обработчик выберут фильтры: имя обработчика записывает в замер внутренний
+    middleware. Работает в потоке event loop, поэтому обходится без блокировок.
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        sample = _Sample()
+        token = _sample.set(sample)
+        started = time.perf_counter()
+        failed = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            _sample.reset(token)
+            stats = _handlers.get(sample.handler)
+            if stats is None:
+                stats = _handlers[sample.handler] = HandlerStats()
+            stats.latency.observe(elapsed)
+            stats.db_seconds += sample.db_seconds
+            stats.api_seconds += sample.api_seconds
+            if failed:
+                stats.errors += 1
+
+
+async def _label_handler(handler, event: TelegramObject, data: Dict[str, Any]) -> Any:
+    """Внутренний middleware: записать в замер имя выбранного обработчика"""
+    sample = _sample.get()
+    if sample is not None:
+        sample.handler = data['handler'].callback.__name__
+    return await handler(event, data)
+
+
+def setup(router: Router):
+    """Подключить замеры ко всем типам событий, для которых в роутере есть обработчики"""
+    middleware = MetricsMiddleware()
+    for name, observer in router.observers.items():
+        if name != 'error' and observer.handlers:
+            observer.outer_middleware(middleware)
+            observer.middleware(_label_handler)
+
+
+class ApiTimer(BaseRequestMiddleware):
+    """Замер запросов к Telegram API (middleware сессии бота).
+
+    Подключается первым, до планировщика отправки: время включает ожидание в его очереди,
+    то есть всё время, которое обработчик ждал Telegram.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            name = method.__api_method__
+            histogram = _requests.get(name)
+            if histogram is None:
+                histogram = _requests[name] = Histogram()
+            histogram.observe(elapsed)
+            sample = _sample.get()
+            if sample is not None:
+                sample.api_seconds += elapsed
+
+
+def _histogram_snapshot(histogram: Histogram) -> Dict[str, float]:
+    return {
+        'count': histogram.count,
+        'seconds': histogram.sum,
+        'mean': histogram.sum / histogram.count if histogram.count else 0.0,
+        'p50': histogram.quantile(0.5),
+        'p99': histogram.quantile(0.99),
+    }
+
+
+def snapshot() -> Dict[str, Any]:
+    """Текущие метрики: обработчики, запросы к Telegram API и подключённые показатели"""
+    handlers = {}
+    for name, stats in _handlers.items():
+        handlers[name] = _histogram_snapshot(stats.latency)
+        handlers[name].update(errors=stats.errors, db_seconds=stats.db_seconds, api_seconds=stats.api_seconds)
+    return {
+        'handlers': handlers,
+        'telegram': {name: _histogram_snapshot(histogram) for name, histogram in _requests.items()},
+        'collected': {name: func() for name, _, func in _collectors},
+    }
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _histogram_lines(metric: str, label: str, value: str, histogram: Histogram) -> List[str]:
+    labels = f'{label}="{_escape(value)}"'
+    lines = []
+    total = 0
+    for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+        total += count
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {total}')
+    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum!r}')
+    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def render_prometheus() -> str:
+    """Метрики в текстовом формате Prometheus"""
+    lines = [
+        '# HELP wishlist_handler_seconds Время обработки события.',
+        '# TYPE wishlist_handler_seconds histogram',
+    ]
+    for name, stats in _handlers.items():
+        lines.extend(_histogram_lines('wishlist_handler_seconds', 'handler', name, stats.latency))
+    for metric, help_text, attr in (
+        ('wishlist_handler_errors_total', 'Обработки, завершившиеся исключением.', 'errors'),
+        ('wishlist_handler_db_seconds_total', 'Время обработчиков в запросах к БД.', 'db_seconds'),
+        ('wishlist_handler_api_seconds_total', 'Время обработчиков в запросах к Telegram API.', 'api_seconds'),
+    ):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} counter')
+        for name, stats in _handlers.items():
+            lines.append(f'{metric}{{handler="{_escape(name)}"}} {getattr(stats, attr)!r}')
+
+    lines.append('# HELP wishlist_telegram_request_seconds Время запроса к Telegram API, включая очередь отправки.')
+    lines.append('# TYPE wishlist_telegram_request_seconds histogram')
+    for name, histogram in _requests.items():
+        lines.extend(_histogram_lines('wishlist_telegram_request_seconds', 'method', name, histogram))
+
+    for name, label, func in _collectors:
+        try:
+            values = func()
+        except Exception:
+            logger.exception('Ошибка получения показателей %s', name)
+            continue
+        rows = values.items() if label else [(None, values)]
+        for label_value, row in rows:
+            labels = f'{{{label}="{_escape(str(label_value))}"}}' if label else ''
+            for key, value in row.items():
+                lines.append(f'wishlist_{name}_{key}{labels} {float(value)!r}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_prometheus().encode(),
+                        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+async def start_server(host: str = '127.0.0.1', port: int = 9090) -> web.AppRunner:
+    """Запустить HTTP-сервер с метриками Prometheus (GET /metrics). Остановка - runner.cleanup()"""
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info('Метрики доступны на http://%s:%s/metrics', host, port)
+    return runner
@@ -0,0 +1,46 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup
+
+import db_controller
+from cache import MISSING, TTLCache
+
+# Размер кэша отрисованных страниц и время жизни записи (с)
+PAGE_CACHE_SIZE = 5000
+PAGE_CACHE_TTL = 600
+
+
+class RenderedPage(NamedTuple):
+    """Готовая страница списка желаний"""
+    text: str
+    keyboard: InlineKeyboardMarkup
+    page: int
+    page_cursor: List[Tuple[str, int]]
+
+
+_pages = TTLCache(PAGE_CACHE_SIZE, PAGE_CACHE_TTL)
+
+
+def list_version(owner_id: int) -> int:
+    """Версия списка желаний владельца. Читать до загрузки страницы из БД"""
+    return db_controller.get_wish_list_version(owner_id)
+
+
+def get_page(owner_id: int, role: str, page: int, version: int) -> Optional[RenderedPage]:
+    """Получить страницу, отрисованную для этой версии списка, или None"""
+    rendered = _pages.get((owner_id, role, page, version))
+    return None if rendered is MISSING else rendered
+
+
+def put_page(owner_id: int, role: str, page: int, version: int, rendered: RenderedPage):
+    """Сохранить отрисованную страницу.
+
+    version должна быть прочитана до загрузки данных: если список изменился во время
+    отрисовки, страница сохранится под устаревшей версией и не будет выдана.
+    """
+    _pages.set((owner_id, role, page, version), rendered)
+
+
+def stats():
+    """Счётчики попаданий и промахов"""
+    return _pages.stats()
@@ -0,0 +1,54 @@
+"""Записи, которые возвращают функции чтения db_controller.
+
+Это неизменяемые кортежи без __dict__ (NamedTuple): строка занимает меньше памяти, чем словарь,
+создаётся быстрее и может храниться в кэшах без копирования. Поля без значения по умолчанию -
+столбцы таблицы в порядке схемы, поля со значением по умолчанию заполняют только запросы,
+которые их выбирают (см. db_controller._select_list).
+"""
+from typing import Any, NamedTuple, Optional, Tuple
+
+
+class User(NamedTuple):
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    registration_date: str
+
+
+class Group(NamedTuple):
+    group_id: int
+    title: str
+    description: Optional[str]
+
+
+class Wish(NamedTuple):
+    wish_id: int
+    user_id: int
+    chat_id: int
+    wish_text: str
+    description: Optional[str]
+    status: str
+    priority: int
+    create_date: str
+    complete_date: Optional[str]
+    image_url: Optional[str]
+    price: Optional[float]
+    # username владельца (поиск, желания группы), ключ сортировки страницы группы, время переноса в архив
+    username: Optional[str] = None
+    sort_key: Any = None
+    archived_at: Optional[str] = None
+
+    @property
+    def key(self) -> Tuple[str, int]:
+        """Ключ желания в списке владельца (см. db_controller.get_user_wishes_page)"""
+        return self.create_date, self.wish_id
+
+
+class Reservation(NamedTuple):
+    reservation_id: int
+    wish_id: int
+    user_id: int
+    reserved_at: str
+    status: str
+    archived_at: Optional[str] = None
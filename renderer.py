@@ -0,0 +1,209 @@
+import html
+from functools import lru_cache
+from typing import Container, List, Optional, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from records import Wish
+
+# Длина описания в списке желаний, длиннее - обрезается
+DESCRIPTION_PREVIEW = 40
+
+
+def _markup(*rows) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[list(row) for row in rows])
+
+
+def _button(text: str, callback_data: str) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=callback_data)
+
+
+# ============== Клавиатуры ==============
+# Постоянные клавиатуры собираются один раз при импорте и переиспользуются всеми сообщениями.
+# aiogram не запрещает изменять их объекты, поэтому менять клавиатуры после создания нельзя.
+MAIN_MENU_BUTTON = _button("🏠 Главное меню", "main_menu")
+
+MAIN_MENU_KB = _markup(
+    [_button("🎁 Добавить желание", "add_wish_start")],
+    [_button("📋 Посмотреть мои желания", "show_my_wishes")],
+)
+SKIP_DESCRIPTION_KB = _markup([_button("Пропустить", "skip_description")])
+PRIORITY_KB = _markup(
+    [_button(f"{priority}⭐", f"priority_{priority}") for priority in (1, 2, 3)],
+    [_button(f"{priority}⭐", f"priority_{priority}") for priority in (4, 5)],
+)
+SKIP_PRICE_KB = _markup([_button("Пропустить", "skip_price")])
+CONFIRM_WISH_KB = _markup([_button("✅ Сохранить", "confirm_save_wish"), _button("❌ Отменить", "cancel_wish")])
+AFTER_SAVE_KB = _markup([_button("➕ Добавить еще", "add_wish_start")], [MAIN_MENU_BUTTON])
+NO_WISHES_KB = _markup([_button("🎁 Добавить желание", "add_wish_start")], [MAIN_MENU_BUTTON])
+CONFIRM_DELETE_KB = _markup(
+    [_button("✅ Да, удалить", "confirm_delete_wish"), _button("❌ Отмена", "cancel_delete_wish")]
+)
+
+
+# ============== Фрагменты текста ==============
+STARS = tuple("⭐" * priority for priority in range(6))
+
+
+def escape(text: Optional[str]) -> Optional[str]:
+    """Экранировать пользовательский текст для parse_mode=HTML. Выполняется один раз при сохранении"""
+    return html.escape(text, quote=False) if text else text
+
+
+def stars(priority: int) -> str:
+    """Звёзды приоритета"""
+    return STARS[priority] if 0 <= priority < len(STARS) else "⭐" * priority
+
+
+@lru_cache(maxsize=4096)
+def format_price(price: Optional[float]) -> str:
+    """Цена для списка желаний"""
+    return f"₽{price:.2f}" if price else "—"
+
+
+def preview(description: str) -> str:
+    """Начало уже экранированного описания, не разрывающее HTML-сущности вроде &amp;"""
+    if len(description) <= DESCRIPTION_PREVIEW:
+        return description
+    cut = description[:DESCRIPTION_PREVIEW]
+    amp = cut.rfind("&")
+    if amp != -1 and ";" not in cut[amp:]:
+        cut = cut[:amp]
+    return cut + "..."
+
+
+# ============== Страницы списка желаний ==============
+# Роль просмотра: (заголовок, префикс кнопок навигации, кнопки удаления, отметки о резервировании).
+# Владельцу резервирования не показываются, чтобы не раскрывать сюрприз
+ROLES = {
+    "owner": ("📋 <b>Ваши желания:</b>\n\n", "page_wishes_", True, False),
+    "guest": ("📋 <b>Желания:</b>\n\n", "page_wishes_", False, True),
+    "other": ("📋 <b>Желания пользователя {username}:</b>\n\n", "page_other_wishes_", False, True),
+}
+RESERVED_BADGE = " | 🔒 забронировано"
+FREE_BADGE = " | 🟢 свободно"
+
+
+@lru_cache(maxsize=1024)
+def _nav_row(prefix: str, page: int, total_pages: int) -> Tuple[InlineKeyboardButton, ...]:
+    """Кнопки перехода между страницами"""
+    buttons = []
+    if page > 0:
+        buttons.append(_button("⬅️ Назад", f"{prefix}{page - 1}"))
+    if page < total_pages - 1:
+        buttons.append(_button("Далее ➡️", f"{prefix}{page + 1}"))
+    return tuple(buttons)
+
+
+@lru_cache(maxsize=4096)
+def _delete_button(number: int, wish_id: int) -> InlineKeyboardButton:
+    return _button(f"🗑️ Удалить #{number}", f"wish_delete_{wish_id}")
+
+
+def shows_reservations(role: str) -> bool:
+    """Показываются ли в роли role отметки о резервировании"""
+    return ROLES[role][3]
+
+
+def render_wishes_page(role: str, wishes: Sequence[Wish], page: int, total: int, per_page: int,
+                       username: Optional[str] = None,
+                       reservations: Optional[Container[int]] = None) -> Tuple[str, InlineKeyboardMarkup]:
+    """Отрисовать страницу списка желаний: текст (HTML) и клавиатуру.
+
+    Текст желаний должен быть уже экранирован (см. escape). reservations - id желаний с активным
+    резервированием (см. db_controller.get_active_reservations), нужны ролям с отметками о резервировании.
+    """
+    title, nav_prefix, with_delete, with_reservations = ROLES[role]
+    start_idx = page * per_page
+    total_pages = (total + per_page - 1) // per_page
+
+    parts: List[str] = [title.format(username=escape(username) or "")]
+    rows = []
+    for number, wish in enumerate(wishes, start_idx + 1):
+        parts += (f"{number}. <b>", wish.wish_text, "</b>\n   🌟 ", stars(wish.priority),
+                  " | 💰 ", format_price(wish.price), " | 📅 ", wish.status)
+        if with_reservations and reservations is not None and wish.status == "active":
+            parts.append(RESERVED_BADGE if wish.wish_id in reservations else FREE_BADGE)
+        parts.append("\n")
+        if wish.description:
+            parts += ("   📝 ", preview(wish.description), "\n")
+        parts.append("\n")
+        if with_delete:
+            rows.append([_delete_button(number, wish.wish_id)])
+
+    if total_pages > 1:
+        parts.append(f"\n📄 Страница {page + 1} из {total_pages}")
+
+    nav_row = _nav_row(nav_prefix, page, total_pages)
+    if nav_row:
+        rows.append(nav_row)
+    rows.append([MAIN_MENU_BUTTON])
+    return "".join(parts), _markup(*rows)
+
+
+# ============== Результаты поиска ==============
+def render_search_results(query: str, wishes: Sequence[Wish]) -> str:
+    """Отрисовать результаты поиска (HTML). К желаниям должен быть добавлен username владельца"""
+    if not wishes:
+        return f"🔍 По запросу «{escape(query)}» ничего не найдено"
+    parts: List[str] = [f"🔍 <b>Найдено по запросу «{escape(query)}»:</b>\n\n"]
+    for number, wish in enumerate(wishes, 1):
+        parts += (f"{number}. <b>", wish.wish_text, "</b>")
+        if wish.username:
+            parts += (" — @", escape(wish.username))
+        parts += ("\n   🌟 ", stars(wish.priority), " | 💰 ", format_price(wish.price),
+                  " | 📅 ", wish.status, "\n")
+        if wish.description:
+            parts += ("   📝 ", preview(wish.description), "\n")
+        parts.append("\n")
+    return "".join(parts)
+
+
+# ============== Желания группы ==============
+GROUP_SORT_TITLES = {"priority": "по приоритету", "price": "по цене"}
+
+
+def group_page_data(sort: str, page: int, direction: str = "", wish: Optional[Wish] = None) -> str:
+    """callback_data страницы желаний группы. Ключ страницы передаётся в самой кнопке:
+    direction "n" - страница после желания wish, "p" - перед ним, без wish - первая страница
+    """
+    if wish is None:
+        return f"group_wishes_{sort}_{page}___"
+    return f"group_wishes_{sort}_{page}_{direction}_{wish.sort_key!r}_{wish.wish_id}"
+
+
+GROUP_SORT_ROW = (
+    _button("⭐ По приоритету", group_page_data("priority", 0)),
+    _button("💰 По цене", group_page_data("price", 0)),
+)
+
+
+def render_group_wishes_page(title: str, wishes: Sequence[Wish], page: int, per_page: int, sort: str,
+                             has_next: bool) -> Tuple[str, InlineKeyboardMarkup]:
+    """Отрисовать страницу желаний участников группы: текст (HTML) и клавиатуру.
+
+    К желаниям должны быть добавлены sort_key и username владельца (см. db_controller.get_group_wishes_page).
+    """
+    header = f"🎁 <b>Желания участников группы {escape(title)}</b> ({GROUP_SORT_TITLES[sort]}):\n\n"
+    if not wishes:
+        return header + "Пока нет активных желаний", _markup(GROUP_SORT_ROW)
+    parts: List[str] = [header]
+    for number, wish in enumerate(wishes, page * per_page + 1):
+        parts += (f"{number}. <b>", wish.wish_text, "</b>")
+        if wish.username:
+            parts += (" — @", escape(wish.username))
+        parts += ("\n   🌟 ", stars(wish.priority), " | 💰 ", format_price(wish.price), "\n")
+        if wish.description:
+            parts += ("   📝 ", preview(wish.description), "\n")
+        parts.append("\n")
+    if page > 0 or has_next:
+        parts.append(f"\n📄 Страница {page + 1}")
+
+    nav_row = []
+    if page > 0:
+        nav_row.append(_button("⬅️ Назад", group_page_data(sort, page - 1, "p", wishes[0])))
+    if has_next:
+        nav_row.append(_button("Далее ➡️", group_page_data(sort, page + 1, "n", wishes[-1])))
+    rows = [nav_row] if nav_row else []
+    rows.append(GROUP_SORT_ROW)
+    return "".join(parts), _markup(*rows)
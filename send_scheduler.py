@@ -0,0 +1,278 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, DeleteMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText, ForwardMessage,
+    SendDocument, SendMediaGroup, SendMessage, SendPhoto, TelegramMethod
+)
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше. Ответы пользователю идут впереди массовых рассылок
+INTERACTIVE = 0
+BULK = 1
+
+# Методы, которые отправляют или меняют сообщения в чате и подпадают под лимиты Telegram
+SCHEDULED_METHODS = (
+    SendMessage, EditMessageText, EditMessageReplyMarkup, EditMessageCaption, DeleteMessage,
+    SendPhoto, SendDocument, SendMediaGroup, ForwardMessage, CopyMessage
+)
+# Правки, из которых в очереди остаётся только последняя для каждого сообщения
+COALESCED_METHODS = (EditMessageText, EditMessageReplyMarkup, EditMessageCaption)
+
+# Сколько раз повторять запрос после ответа Telegram "Too Many Requests"
+MAX_RETRIES = 3
+# Сколько последних времён ожидания учитывать в статистике
+WAIT_SAMPLES = 1000
+# Как часто забывать простаивающие чаты (с)
+PRUNE_INTERVAL = 60
+
+_priority = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def bulk():
+    """Отправлять запросы внутри блока с низким приоритетом (массовые рассылки, выгрузки)"""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """Ограничение частоты: rate токенов в секунду, не больше capacity подряд"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена (0 - токен есть)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return max(self.updated_at - now, 0.0) + (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        """Не выдавать токены seconds секунд (после ответа Telegram "Too Many Requests")"""
+        self.tokens = 0
+        self.updated_at = max(self.updated_at, now + seconds)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Request:
+    __slots__ = ('make_request', 'bot', 'method', 'future', 'priority', 'seq', 'enqueued_at', 'retries',
+                 'coalesce_key')
+
+    def __init__(self, make_request, bot: Bot, method: TelegramMethod, priority: int, seq: int,
+                 coalesce_key: Optional[Tuple]):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = asyncio.get_running_loop().create_future()
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.retries = 0
+        self.coalesce_key = coalesce_key
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Telegram (middleware сессии бота).
+
+    Отправка сообщений ограничивается общим ограничителем частоты и ограничителем
+    каждого чата (в группах лимит строже). Запросы одного чата уходят по очереди
+    в порядке вызова, между чатами первыми идут запросы с более высоким приоритетом
+    (см. bulk). Если правка сообщения ещё ждёт в очереди, новая правка того же
+    сообщения заменяет её: быстрые нажатия "Далее" дают один запрос с последней страницей.
+    Остальные методы (ответы на callback, getUpdates и т.п.) выполняются сразу.
+    """
+
+    def __init__(self, rate: float = 30, burst: float = 30, chat_rate: float = 1, chat_burst: float = 3,
+                 group_rate: float = 20 / 60, group_burst: float = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self._global = TokenBucket(rate, burst)
+        self._buckets: Dict[Any, TokenBucket] = {}
+        self._queues: Dict[Any, Deque[_Request]] = {}
+        # Чаты, готовые к отправке: (приоритет, номер, чат); ждущие своего лимита: (время, чат)
+        self._ready: List[Tuple[int, int, Any]] = []
+        self._delayed: List[Tuple[float, Any]] = []
+        self._scheduled: Set[Any] = set()
+        self._busy: Set[Any] = set()
+        self._pending_edits: Dict[Tuple, _Request] = {}
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pruned_at = time.monotonic()
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or not isinstance(method, SCHEDULED_METHODS):
+            return await make_request(bot, method)
+        return await asyncio.shield(self._enqueue(make_request, bot, method, chat_id))
+
+    def _enqueue(self, make_request, bot: Bot, method: TelegramMethod, chat_id) -> asyncio.Future:
+        queue = self._queues.setdefault(chat_id, deque())
+        coalesce_key = None
+        if isinstance(method, COALESCED_METHODS) and method.message_id is not None:
+            coalesce_key = (type(method), chat_id, method.message_id)
+            pending = self._pending_edits.get(coalesce_key)
+            # Заменяем только последнюю правку в очереди чата, чтобы не менять порядок запросов
+            if pending is not None and queue and queue[-1] is pending:
+                pending.method = method
+                self.coalesced += 1
+                return pending.future
+
+        request = _Request(make_request, bot, method, _priority.get(), next(self._seq), coalesce_key)
+        queue.append(request)
+        if coalesce_key is not None:
+            self._pending_edits[coalesce_key] = request
+        if chat_id not in self._busy and chat_id not in self._scheduled:
+            self._schedule(chat_id, time.monotonic())
+
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return request.future
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _schedule(self, chat_id, now: float):
+        """Поставить чат с непустой очередью в готовые или ждущие своего лимита"""
+        delay = self._bucket(chat_id).delay(now)
+        if delay > 0:
+            heapq.heappush(self._delayed, (now + delay, chat_id))
+        else:
+            head = self._queues[chat_id][0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        self._scheduled.add(chat_id)
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                _, chat_id = heapq.heappop(self._delayed)
+                self._scheduled.discard(chat_id)
+                self._schedule(chat_id, now)
+
+            if now - self._pruned_at > PRUNE_INTERVAL:
+                self._prune(now)
+
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.delay(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            self._scheduled.discard(chat_id)
+            request = self._queues[chat_id].popleft()
+            if request.coalesce_key is not None and self._pending_edits.get(request.coalesce_key) is request:
+                del self._pending_edits[request.coalesce_key]
+            self._global.consume(now)
+            self._bucket(chat_id).consume(now)
+            self._waits.append(now - request.enqueued_at)
+            self._busy.add(chat_id)
+            asyncio.create_task(self._send(chat_id, request))
+
+    def _prune(self, now: float):
+        """Забыть простаивающие чаты: без очереди и с полным ограничителем они не отличаются от новых"""
+        self._pruned_at = now
+        for chat_id in [chat_id for chat_id, queue in self._queues.items() if not queue]:
+            if chat_id not in self._busy and self._bucket(chat_id).is_full(now):
+                del self._queues[chat_id]
+                del self._buckets[chat_id]
+
+    async def _send(self, chat_id, request: _Request):
+        try:
+            result = await request.make_request(request.bot, request.method)
+        except TelegramRetryAfter as e:
+            if request.retries < MAX_RETRIES:
+                request.retries += 1
+                self.retried += 1
+                logger.warning('Лимит Telegram для чата %s, повтор через %s с', chat_id, e.retry_after)
+                self._bucket(chat_id).block(time.monotonic(), e.retry_after)
+                self._queues[chat_id].appendleft(request)
+            else:
+                request.future.set_exception(e)
+        except Exception as e:
+            request.future.set_exception(e)
+        else:
+            self.sent += 1
+            request.future.set_result(result)
+        finally:
+            self._busy.discard(chat_id)
+            now = time.monotonic()
+            if self._queues[chat_id]:
+                self._schedule(chat_id, now)
+                self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очередей, время ожидания отправки (с) и счётчики запросов"""
+        depth = {INTERACTIVE: 0, BULK: 0}
+        for queue in self._queues.values():
+            for request in queue:
+                depth[request.priority] += 1
+        waits = sorted(self._waits)
+        return {
+            'queue_depth': depth[INTERACTIVE] + depth[BULK],
+            'queue_depth_interactive': depth[INTERACTIVE],
+            'queue_depth_bulk': depth[BULK],
+            'chats_waiting': len(self._scheduled),
+            'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+            'wait_p99': waits[min(len(waits) - 1, int(len(waits) * 0.99))] if waits else 0.0,
+            'wait_max': waits[-1] if waits else 0.0,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+        }
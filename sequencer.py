@@ -0,0 +1,77 @@
+import asyncio
+import functools
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> Optional[int]:
+    """Ключ очереди апдейта: id чата (как у FSMStrategy.CHAT), а без чата - id пользователя"""
+    context = UserContextMiddleware.resolve_event_context(update)
+    if context.chat is not None:
+        return context.chat.id
+    if context.user is not None:
+        return context.user.id
+    return None
+
+
+class ChatSequencer:
+    """Конкурентная обработка апдейтов с сохранением порядка внутри чата.
+
+    Апдейты с одним ключом обрабатываются строго по очереди в порядке вызова submit,
+    поэтому состояние FSM чата не меняется параллельно. Одновременно обрабатывается не больше
+    max_in_flight апдейтов; место занимается только после обработки предыдущего апдейта чата,
+    поэтому очередь одного активного чата не держит места, нужные остальным чатам.
+    Всего принимается не больше max_pending апдейтов (по умолчанию 4 * max_in_flight):
+    дальше submit ждёт, пока очередь не разберётся.
+    """
+
+    def __init__(self, max_in_flight: int = 256, max_pending: Optional[int] = None):
+        self.max_in_flight = max_in_flight
+        self.max_pending = max_pending or 4 * max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._pending = asyncio.Semaphore(self.max_pending)
+        # Последняя принятая задача каждого чата: следующая задача чата ждёт её завершения
+        self._tails: Dict[Any, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        """Количество принятых и ещё не обработанных апдейтов"""
+        return len(self._tasks)
+
+    async def submit(self, key: Optional[Any], handler: Callable[..., Awaitable[Any]], *args) -> asyncio.Task:
+        """Поставить handler(*args) в очередь чата key (None - без очереди)"""
+        await self._pending.acquire()
+        previous = self._tails.get(key) if key is not None else None
+        task = asyncio.create_task(self._run(previous, handler, args))
+        if key is not None:
+            self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._on_done, key))
+        return task
+
+    def _on_done(self, key: Optional[Any], task: asyncio.Task):
+        self._tasks.discard(task)
+        self._pending.release()
+        if key is not None and self._tails.get(key) is task:
+            del self._tails[key]
+
+    async def _run(self, previous: Optional[asyncio.Task], handler, args):
+        if previous is not None:
+            # Ошибка в предыдущем апдейте чата не останавливает обработку следующих
+            await asyncio.wait((previous,))
+        async with self._slots:
+            try:
+                await handler(*args)
+            except Exception:
+                logger.exception('Ошибка обработки апдейта')
+
+    async def join(self):
+        """Дождаться обработки всех принятых апдейтов"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
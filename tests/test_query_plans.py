@@ -0,0 +1,35 @@
+"""Планы горячих запросов db_controller на схеме после всех миграций: ни один не читает таблицу целиком"""
+import sqlite3
+
+import pytest
+
+import db_controller
+import db_migrations
+
+HOT_QUERIES = db_controller.hot_queries()
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    conn = sqlite3.connect(tmp_path_factory.mktemp('plans') / 'wishlist.db', isolation_level=None)
+    db_migrations.migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_no_table_scan(conn, name):
+    query, params = HOT_QUERIES[name]
+    plan = db_migrations.explain(conn, query, params)
+    assert not [step for step in plan if step.startswith('SCAN')], plan
+
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_no_temp_sort(conn, name):
+    query, params = HOT_QUERIES[name]
+    plan = db_migrations.explain(conn, query, params)
+    assert not [step for step in plan if 'USE TEMP B-TREE' in step], plan
+
+
+def test_find_table_scans_clean(conn):
+    assert db_migrations.find_table_scans(conn, HOT_QUERIES) == {}
@@ -0,0 +1,161 @@
+"""Групповой коммит (db_write_queue.WriteQueue) и его awaitable-обёртка db_async._wrap_mutation"""
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import db_async
+from db_connection import ConnectionManager
+from db_write_queue import WriteQueue, after_commit
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ConnectionManager(str(tmp_path / 'queue.db'), readers=1)
+    with manager.writer_connection() as conn:
+        conn.execute('PRAGMA foreign_keys = ON')
+        conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, value TEXT UNIQUE)')
+        conn.execute('CREATE TABLE child (id INTEGER PRIMARY KEY, item_id INTEGER '
+                     'REFERENCES item(id) DEFERRABLE INITIALLY DEFERRED)')
+    yield manager
+    manager.close()
+
+
+@pytest.fixture
+def write_queue(manager):
+    # Длинное окно: всё, что поставлено в тесте до его окончания, попадает в одну пачку
+    write_queue = WriteQueue(manager, window=0.2)
+    yield write_queue
+    write_queue.close()
+
+
+def insert(conn, value):
+    return conn.execute('INSERT INTO item (value) VALUES (?)', (value,)).lastrowid
+
+
+def insert_orphan(conn):
+    # Нарушение отложенного внешнего ключа обнаруживается только при COMMIT
+    conn.execute('INSERT INTO child (item_id) VALUES (12345)')
+
+
+def values(manager):
+    with manager.reader() as conn:
+        return [row[0] for row in conn.execute('SELECT value FROM item ORDER BY id')]
+
+
+def blocked(write_queue):
+    """Занять поток записи, пока не установлено возвращённое событие (следующие изменения копятся)"""
+    started, release = threading.Event(), threading.Event()
+
+    def wait(conn):
+        started.set()
+        release.wait(5)
+
+    write_queue.submit(wait)
+    assert started.wait(5)
+    return release
+
+
+def test_results_per_caller(write_queue, manager):
+    futures = [write_queue.submit(insert, f'v{i}') for i in range(3)]
+    assert [future.result(5) for future in futures] == [1, 2, 3]
+    assert values(manager) == ['v0', 'v1', 'v2']
+
+
+def test_failing_mutation_rolls_back_alone(write_queue, manager):
+    def insert_two(conn, first, second):
+        insert(conn, first)
+        insert(conn, second)
+
+    ok = write_queue.submit(insert, 'a')
+    failing = write_queue.submit(insert_two, 'b', 'a')
+    after = write_queue.submit(insert, 'c')
+    assert ok.result(5) == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        failing.result(5)
+    after.result(5)
+    # Первая вставка упавшего изменения ('b') откатилась вместе с ним
+    assert values(manager) == ['a', 'c']
+
+
+def test_after_commit_order(write_queue, manager):
+    calls = []
+
+    def mutation(conn, name, fail=False):
+        after_commit(lambda: calls.append((name, values(manager))))
+        insert(conn, name)
+        if fail:
+            raise ValueError(name)
+
+    futures = [write_queue.submit(mutation, 'x'), write_queue.submit(mutation, 'y', fail=True),
+               write_queue.submit(mutation, 'z')]
+    futures[0].result(5)
+    # Колбэки - в порядке изменений, после коммита (видят записанное), без откатившегося изменения
+    assert calls == [('x', ['x', 'z']), ('z', ['x', 'z'])]
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+
+
+def test_cancelled_future_skipped(write_queue, manager):
+    release = blocked(write_queue)
+    cancelled = write_queue.submit(insert, 'cancelled')
+    kept = write_queue.submit(insert, 'kept')
+    assert cancelled.cancel()
+    release.set()
+    kept.result(5)
+    assert values(manager) == ['kept']
+
+
+def test_failed_commit_with_cancelled_future(write_queue, manager):
+    release = blocked(write_queue)
+    cancelled = write_queue.submit(insert, 'cancelled')
+    first = write_queue.submit(insert, 'rolled back')
+    orphan = write_queue.submit(insert_orphan)
+    assert cancelled.cancel()
+    release.set()
+    for future in (first, orphan):
+        with pytest.raises(sqlite3.IntegrityError):
+            future.result(5)
+    assert cancelled.cancelled()
+    # Поток записи жив, транзакция откатилась
+    assert write_queue.submit(insert, 'next').result(5) == 1
+    assert values(manager) == ['next']
+
+
+def test_writer_survives_unexpected_error(write_queue, manager, monkeypatch):
+    original = WriteQueue._commit
+    failures = [RuntimeError('boom')]
+
+    def commit(self, batch):
+        if failures:
+            raise failures.pop()
+        original(self, batch)
+
+    monkeypatch.setattr(WriteQueue, '_commit', commit)
+    lost = write_queue.submit(insert, 'lost')
+    with pytest.raises(RuntimeError):
+        lost.result(5)
+    assert write_queue.submit(insert, 'next').result(5) == 1
+
+
+def test_wrap_mutation(write_queue, manager):
+    def mutation(conn, value):
+        return insert(conn, value)
+    mutation.submit = lambda *args, **kwargs: write_queue.submit(mutation, *args, **kwargs)
+    mutation.default = None
+    mutation.errors = (sqlite3.IntegrityError,)
+    wrapped = db_async._wrap_mutation(mutation)
+
+    async def main():
+        release = blocked(write_queue)
+        task = asyncio.create_task(wrapped('cancelled'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        # Ошибка из errors превращается в default
+        return await wrapped('a'), await wrapped('a')
+
+    assert asyncio.run(main()) == (1, None)
+    assert values(manager) == ['a']
@@ -0,0 +1,55 @@
+"""Прогрев после запуска, чтобы первые сообщения после деплоя не ждали диск и не промахивались мимо кэшей.
+
+Файл БД читается в кэш ОС, а для недавно активных чатов (по сохранённым состояниям FSM) заранее
+загружаются их состояния, пользователи и первые страницы просматриваемых списков желаний.
+Прогрев занимает один поток пула БД и идёт в фоне, не задерживая обработку апдейтов.
+"""
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import db_async
+import db_controller
+from fsm_storage import SQLiteStorage, decode_data
+
+
+def _warm_caches(records: List[Tuple[str, Optional[str], Dict[str, Any]]], per_page: int) -> Dict[str, int]:
+    """Загрузить в кэши пользователей чатов records и первые страницы списков, которые они смотрели"""
+    users, usernames, owners = set(), set(), set()
+    for str_key, _, data in records:
+        # Ключ - bot_id:chat_id:user_id:... (см. fsm_storage.build_key)
+        users.add(int(str_key.split(':')[2]))
+        if data.get('target_username'):
+            usernames.add(data['target_username'])
+        if data.get('wishes_owner_id'):
+            owners.add(data['wishes_owner_id'])
+    for user_id in users:
+        db_controller.get_user(user_id)
+    for username in usernames:
+        db_controller.get_user_by_username(username)
+    for owner_id in owners:
+        db_controller.count_user_wishes(owner_id)
+        db_controller.get_user_wishes_page(owner_id, per_page)
+    return {'users': len(users) + len(usernames), 'lists': len(owners)}
+
+
+async def warm_up(max_bytes: int, recent: int, per_page: int,
+                  storage: Optional[SQLiteStorage] = None) -> Dict[str, float]:
+    """Прогреть кэш ОС (не больше max_bytes байт файла БД) и кэши recent недавно активных чатов.
+
+    storage - хранилище FSM этого процесса; None - апдейты обрабатывают другие процессы
+    и прогревается только файл БД. Возвращает показатели прогрева.
+    """
+    stats: Dict[str, float] = {}
+    if max_bytes:
+        started = time.perf_counter()
+        stats['file_bytes'] = await db_async.run(db_controller.prefetch_file, max_bytes)
+        stats['file_seconds'] = time.perf_counter() - started
+    if storage is not None and recent:
+        started = time.perf_counter()
+        records = [(str_key, state, decode_data(data))
+                   for str_key, state, data in await db_async.get_recent_fsm_records(recent)]
+        storage.preload(records)
+        stats['chats'] = len(records)
+        stats.update(await db_async.run(_warm_caches, records, per_page))
+        stats['cache_seconds'] = time.perf_counter() - started
+    return stats
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import Any, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from sequencer import ChatSequencer, chat_key
+
+logger = logging.getLogger(__name__)
+
+
+class OrderedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука: сразу отвечает Telegram и обрабатывает апдейты конкурентно.
+
+    Порядок и ограничение одновременной обработки - как у sequencer.ChatSequencer. Когда
+    очередь принятых апдейтов заполнена, запрос вебхука ждёт, и Telegram сам притормаживает отправку.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int = 256, **data: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **data)
+        self.sequencer = ChatSequencer(max_in_flight)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = Update.model_validate(await request.json(loads=bot.session.json_loads), context={"bot": bot})
+        await self.sequencer.submit(chat_key(update), self._process, bot, update)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _process(self, bot: Bot, update: Update):
+        result = await self.dispatcher.feed_update(bot, update, **self.data)
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(bot=bot, result=result)
+
+    async def close(self) -> None:
+        """Дождаться обработки принятых апдейтов и закрыть сессию бота"""
+        await self.sequencer.join()
+        await super().close()
+
+
+def create_app(dispatcher: Dispatcher, bot: Bot, path: str = '/webhook', secret_token: Optional[str] = None,
+               max_in_flight: int = 256, **data: Any) -> web.Application:
+    """Создать aiohttp-приложение, принимающее апдейты на path"""
+    app = web.Application()
+    handler = OrderedRequestHandler(dispatcher, bot, max_in_flight=max_in_flight, secret_token=secret_token, **data)
+    # Обработчик регистрируется первым: при остановке сначала дорабатываются апдейты, затем
+    # выполняется shutdown диспетчера (в том числе запись состояний FSM)
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot, **data)
+    return app
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, base_url: str, path: str = '/webhook',
+                      host: str = '0.0.0.0', port: int = 8080, secret_token: Optional[str] = None,
+                      max_in_flight: int = 256, max_connections: int = 40):
+    """Зарегистрировать вебхук в Telegram и обслуживать его до отмены"""
+    app = create_app(dispatcher, bot, path=path, secret_token=secret_token, max_in_flight=max_in_flight)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await bot.set_webhook(
+            url=base_url.rstrip('/') + path,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=dispatcher.resolve_used_update_types()
+        )
+        logger.info('Вебхук слушает %s:%s%s', host, port, path)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,163 @@
+"""Массовый импорт и экспорт пользователей, желаний и резервирований в JSONL и CSV.
+
+Данные обрабатываются потоком, поэтому память не зависит от количества строк.
+Файлы с расширением .gz сжимаются и распаковываются на лету, '-' - stdin/stdout.
+
+Запуск: python -m wishlist_io export wishes wishes.jsonl.gz [--db wishlist.db]
+        python -m wishlist_io import wishes wishes.csv [--chunk-size 5000]
+"""
+import argparse
+import csv
+import gzip
+import html
+import io
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional, TextIO
+
+import db_controller
+
+FORMATS = ('jsonl', 'csv')
+
+# Столбцы, которые хранятся экранированными для parse_mode=HTML (см. renderer.escape).
+# В файлах они хранятся как есть, чтобы файлы не зависели от разметки бота
+ESCAPED_COLUMNS = ('wish_text', 'description')
+# Типы столбцов для значений из CSV (там все значения - строки)
+INT_COLUMNS = ('user_id', 'chat_id', 'wish_id', 'reservation_id', 'priority')
+FLOAT_COLUMNS = ('price',)
+
+
+def detect_format(path: str) -> str:
+    """Формат файла по расширению (.csv или .csv.gz - CSV, остальное - JSONL)"""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+@contextmanager
+def open_text(path: str, mode: str) -> Iterator[TextIO]:
+    """Открыть файл в текстовом режиме ('r' или 'w'), .gz - со сжатием, '-' - stdin/stdout"""
+    if path == '-':
+        file = io.TextIOWrapper((sys.stdin if mode == 'r' else sys.stdout).buffer, encoding='utf-8', newline='')
+        try:
+            yield file
+        finally:
+            file.flush()
+            # Отсоединяем обёртку, чтобы не закрыть stdin/stdout
+            file.detach()
+        return
+    if path.endswith('.gz'):
+        file = gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    else:
+        file = open(path, mode, encoding='utf-8', newline='')
+    with file:
+        yield file
+
+
+def _unescape(row: Dict[str, Any]) -> Dict[str, Any]:
+    for column in ESCAPED_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = html.unescape(row[column])
+    return row
+
+
+def _escape(row: Dict[str, Any]) -> Dict[str, Any]:
+    import renderer  # renderer импортирует aiogram, а выгрузке и запуску команды он не нужен
+    for column in ESCAPED_COLUMNS:
+        if row.get(column) is not None:
+            row[column] = renderer.escape(row[column])
+    return row
+
+
+def export_table(table: str, file: TextIO, fmt: str = 'jsonl') -> int:
+    """Выгрузить таблицу из db_controller.BULK_TABLES в file. Возвращает количество строк"""
+    rows = map(_unescape, db_controller.iter_table(table))
+    count = 0
+    if fmt == 'csv':
+        writer = csv.DictWriter(file, fieldnames=db_controller.BULK_TABLES[table].columns)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            file.write('\n')
+            count += 1
+    return count
+
+
+def export_file(table: str, path: str, fmt: Optional[str] = None) -> int:
+    """Выгрузить таблицу в файл path (формат и сжатие - по расширению). Возвращает количество строк"""
+    with open_text(path, 'w') as file:
+        return export_table(table, file, fmt or detect_format(path))
+
+
+def _read_jsonl(file: TextIO) -> Iterator[Dict[str, Any]]:
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _read_csv(file: TextIO) -> Iterator[Dict[str, Any]]:
+    for row in csv.DictReader(file):
+        typed = {}
+        for column, value in row.items():
+            if value == '' or value is None:
+                typed[column] = None
+            elif column in INT_COLUMNS:
+                typed[column] = int(value)
+            elif column in FLOAT_COLUMNS:
+                typed[column] = float(value)
+            else:
+                typed[column] = value
+        yield typed
+
+
+def read_rows(file: TextIO, fmt: str = 'jsonl') -> Iterable[Dict[str, Any]]:
+    """Строки файла в виде словарей (потоком)"""
+    return _read_csv(file) if fmt == 'csv' else _read_jsonl(file)
+
+
+def import_table(table: str, file: TextIO, fmt: str = 'jsonl', chunk_size: int = db_controller.BULK_CHUNK_SIZE,
+                 progress=None) -> int:
+    """Загрузить строки из file в таблицу из db_controller.BULK_TABLES. Возвращает количество строк"""
+    return db_controller.import_rows(table, map(_escape, read_rows(file, fmt)), chunk_size, progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('export', 'import'))
+    parser.add_argument('table', choices=db_controller.BULK_TABLES)
+    parser.add_argument('path', help="файл (.jsonl, .csv, с .gz - сжатый) или '-'")
+    parser.add_argument('--format', choices=FORMATS, help='формат файла (по умолчанию - по расширению)')
+    parser.add_argument('--db', help='файл БД (по умолчанию - DB_NAME из окружения или wishlist.db)')
+    parser.add_argument('--chunk-size', type=int, default=db_controller.BULK_CHUNK_SIZE,
+                        help='строк в одной транзакции при импорте')
+    args = parser.parse_args()
+
+    db_controller.configure(db_name=args.db or os.getenv('DB_NAME', 'wishlist.db'))
+    db_controller.init_db()
+    fmt = args.format or detect_format(args.path)
+    started = time.perf_counter()
+
+    def progress(total: int):
+        elapsed = time.perf_counter() - started
+        print(f'\rЗагружено строк: {total} ({total / elapsed:.0f}/с)', end='', file=sys.stderr, flush=True)
+
+    try:
+        if args.command == 'export':
+            count = export_file(args.table, args.path, fmt)
+            print(f'Выгружено строк: {count} за {time.perf_counter() - started:.1f} с', file=sys.stderr)
+        else:
+            with open_text(args.path, 'r') as file:
+                count = import_table(args.table, file, fmt, args.chunk_size, progress)
+            print(f'\nЗагружено строк: {count} за {time.perf_counter() - started:.1f} с', file=sys.stderr)
+    finally:
+        db_controller.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+import db_async
+import db_controller
+import metrics
+from sequencer import ChatSequencer
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений процесс-обработчик забирает из своей очереди за один раз
+RECEIVE_BATCH = 256
+
+# Как часто процесс-обработчик сообщает свои обращения к БД (с): по ним планировщик обслуживания
+# в этом процессе понимает, простаивает ли бот
+ACTIVITY_INTERVAL = 0.5
+
+
+def raw_chat_key(data: Dict[str, Any]) -> Optional[int]:
+    """Ключ чата необработанного апдейта, как sequencer.chat_key, но без разбора в модели aiogram"""
+    for field, event in data.items():
+        if not isinstance(event, dict):
+            continue
+        if field == 'callback_query' and event.get('message'):
+            event = event['message']
+        chat = event.get('chat') or event.get('voter_chat')
+        if chat:
+            return chat['id']
+        user = event.get('from') or event.get('user')
+        if user:
+            return user['id']
+    return None
+
+
+def default_setup() -> Tuple[Dispatcher, Bot]:
+    """Подготовка процесса-обработчика: своё подключение к БД, хранилище FSM и обработчики"""
+    import config
+    import bot as bot_module  # bot импортирует этот модуль
+    bot_module.configure_db()
+    return bot_module.create_dispatcher(), bot_module.create_bot(processes=config.WORKERS)
+
+
+class WorkerPool:
+    """Процессы-обработчики апдейтов, между которыми апдейты распределяются по чату.
+
+    Все апдейты одного чата попадают в один процесс, где обрабатываются по очереди
+    (sequencer.ChatSequencer), поэтому порядок и состояние FSM чата сохраняются.
+    У каждого процесса свои соединения с БД и свои кэши: инвалидации кэшей после
+    коммита рассылаются остальным процессам через этот процесс. Инвалидации изменений самого
+    этого процесса (например, фонового переноса в архив) получают все процессы-обработчики.
+    Если задан metrics_port, процесс с номером i отдаёт свои метрики на порту metrics_port + i.
+    """
+
+    def __init__(self, count: int, setup: Callable[[], Tuple[Dispatcher, Bot]] = default_setup,
+                 max_in_flight: int = 256, queue_size: int = 1024, metrics_host: str = '127.0.0.1',
+                 metrics_port: Optional[int] = None):
+        self.count = count
+        context = multiprocessing.get_context('spawn')
+        self._events = context.Queue()
+        self._inboxes = [context.Queue(queue_size) for _ in range(count)]
+        self._locks: List[asyncio.Lock] = []
+        self._processes = [
+            context.Process(
+                target=_worker_main,
+                args=(index, inbox, self._events, setup, max_in_flight,
+                      (metrics_host, metrics_port + index) if metrics_port else None),
+                name=f'wishlist-worker-{index}'
+            )
+            for index, inbox in enumerate(self._inboxes)
+        ]
+        self._ready = threading.Semaphore(0)
+        # Типы апдейтов, которые используют обработчики (присылают процессы-обработчики при запуске):
+        # этому процессу не нужно импортировать обработчики, чтобы их узнать
+        self.allowed_updates: Optional[List[str]] = None
+        # Последние присланные обращения к БД каждого процесса-обработчика (см. db_async.activity)
+        self._activity: Dict[int, Tuple[int, int]] = {}
+        self._relay = threading.Thread(target=self._relay_events, name='worker-events', daemon=True)
+
+    async def start(self):
+        """Запустить процессы и дождаться их готовности"""
+        self._locks = [asyncio.Lock() for _ in range(self.count)]
+        for process in self._processes:
+            process.start()
+        self._relay.start()
+        # Номер -1 не совпадает ни с одним процессом-обработчиком: инвалидация уйдёт всем
+        db_controller.add_invalidation_listener(lambda kind, args: self._events.put(('invalidate', -1, (kind, args))))
+        loop = asyncio.get_running_loop()
+        for _ in range(self.count):
+            while not await loop.run_in_executor(None, self._ready.acquire, True, 1.0):
+                failed = [process.name for process in self._processes if process.exitcode is not None]
+                if failed:
+                    raise RuntimeError(f'Процессы-обработчики завершились при запуске: {", ".join(failed)}')
+
+    def activity(self) -> Tuple[int, int]:
+        """Обращения к БД всех процессов-обработчиков: всего с запуска и выполняющиеся сейчас"""
+        reported = list(self._activity.values())
+        return sum(calls for calls, _ in reported), sum(in_flight for _, in_flight in reported)
+
+    def shard(self, key: Optional[int], update_id: int) -> int:
+        """Номер процесса для апдейта"""
+        return hash(key if key is not None else update_id) % self.count
+
+    async def route(self, data: Dict[str, Any]):
+        """Передать апдейт процессу его чата. Ждёт, если очередь процесса заполнена"""
+        index = self.shard(raw_chat_key(data), data.get('update_id', 0))
+        await self._put(index, ('update', data))
+
+    async def _put(self, index: int, message):
+        # Блокировка сохраняет порядок апдейтов, ожидающих места в очереди
+        async with self._locks[index]:
+            try:
+                self._inboxes[index].put_nowait(message)
+            except queue.Full:
+                await asyncio.get_running_loop().run_in_executor(None, self._inboxes[index].put, message)
+
+    def _relay_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                break
+            kind, index, payload = event
+            if kind == 'ready':
+                self.allowed_updates = payload
+                self._ready.release()
+            elif kind == 'activity':
+                self._activity[index] = payload
+            elif kind == 'invalidate':
+                for other, inbox in enumerate(self._inboxes):
+                    if other != index:
+                        inbox.put(('invalidate', payload))
+
+    async def close(self, timeout: float = 60):
+        """Дождаться обработки переданных апдейтов и остановить процессы"""
+        loop = asyncio.get_running_loop()
+        for index in range(self.count):
+            await self._put(index, None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.error('Процесс %s не остановился за %s с', process.name, timeout)
+                process.terminate()
+        self._events.put(None)
+        self._relay.join()
+
+
+def _receive(inbox) -> list:
+    """Забрать из очереди все накопившиеся сообщения (ожидая хотя бы одно)"""
+    messages = [inbox.get()]
+    try:
+        while len(messages) < RECEIVE_BATCH:
+            messages.append(inbox.get_nowait())
+    except queue.Empty:
+        pass
+    return messages
+
+
+def _worker_main(index: int, inbox, events, setup, max_in_flight: int, metrics_address):
+    asyncio.run(_worker_loop(index, inbox, events, setup, max_in_flight, metrics_address))
+
+
+async def _worker_loop(index: int, inbox, events, setup, max_in_flight: int,
+                       metrics_address: Optional[Tuple[str, int]] = None):
+    dispatcher, bot = setup()
+    metrics_runner = await metrics.start_server(*metrics_address) if metrics_address else None
+    db_controller.add_invalidation_listener(lambda kind, args: events.put(('invalidate', index, (kind, args))))
+    sequencer = ChatSequencer(max_in_flight)
+
+    async def process(update: Update):
+        result = await dispatcher.feed_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            await dispatcher.silent_call_request(bot=bot, result=result)
+
+    async def report_activity():
+        reported = None
+        while True:
+            await asyncio.sleep(ACTIVITY_INTERVAL)
+            activity = db_async.activity()
+            if activity != reported:
+                events.put(('activity', index, activity))
+                reported = activity
+
+    loop = asyncio.get_running_loop()
+    await dispatcher.emit_startup(bot=bot)
+    events.put(('ready', index, dispatcher.resolve_used_update_types()))
+    reporter = asyncio.create_task(report_activity())
+    try:
+        running = True
+        while running:
+            for message in await loop.run_in_executor(None, _receive, inbox):
+                if message is None:
+                    running = False
+                    break
+                kind, payload = message
+                if kind == 'update':
+                    update = Update.model_validate(payload, context={'bot': bot})
+                    await sequencer.submit(raw_chat_key(payload), process, update)
+                elif kind == 'invalidate':
+                    db_controller.apply_invalidation(*payload)
+        await sequencer.join()
+    finally:
+        reporter.cancel()
+        await dispatcher.emit_shutdown(bot=bot)
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        db_async.shutdown()
+        db_controller.close_connections()
+
+
+async def poll(bot: Bot, pool: WorkerPool, allowed_updates: Optional[List[str]] = None, timeout: int = 30):
+    """Получать апдейты long polling и распределять их по процессам"""
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                            request_timeout=timeout + 10)
+        except Exception:
+            logger.exception('Ошибка получения апдейтов, повтор через %s с', backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await pool.route(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+def create_app(pool: WorkerPool, path: str = '/webhook', secret_token: Optional[str] = None) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты вебхука и распределяющее их по процессам"""
+    async def handle(request: web.Request) -> web.Response:
+        if secret_token and not secrets.compare_digest(
+                request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), secret_token):
+            return web.Response(body='Unauthorized', status=401)
+        await pool.route(await request.json())
+        return web.json_response({})
+
+    app = web.Application()
+    app.router.add_post(path, handle)
+    return app
+
+
+async def run(bot: Bot, count: int, allowed_updates: Optional[List[str]] = None, max_in_flight: int = 256,
+              webhook_url: Optional[str] = None, path: str = '/webhook', host: str = '0.0.0.0', port: int = 8080,
+              secret_token: Optional[str] = None, max_connections: int = 40, metrics_host: str = '127.0.0.1',
+              metrics_port: Optional[int] = None, maintenance=None):
+    """Принимать апдейты (вебхук, если задан webhook_url, иначе polling) и обрабатывать их в count процессах.
+    Без allowed_updates принимаются типы апдейтов, которые используют обработчики процессов.
+    maintenance - планировщик обслуживания БД этого процесса: он учитывает и обращения процессов-обработчиков
+    """
+    pool = WorkerPool(count, max_in_flight=max_in_flight, metrics_host=metrics_host, metrics_port=metrics_port)
+    await pool.start()
+    if maintenance is not None:
+        maintenance.add_activity_source(pool.activity)
+    if allowed_updates is None:
+        allowed_updates = pool.allowed_updates
+    logger.info('Запущено процессов-обработчиков: %s', count)
+    runner = None
+    try:
+        if webhook_url:
+            runner = web.AppRunner(create_app(pool, path=path, secret_token=secret_token))
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            await bot.set_webhook(
+                url=webhook_url.rstrip('/') + path,
+                secret_token=secret_token,
+                max_connections=max_connections,
+                allowed_updates=allowed_updates
+            )
+            await asyncio.Event().wait()
+        else:
+            await poll(bot, pool, allowed_updates)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await pool.close()